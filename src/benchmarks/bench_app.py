@@ -0,0 +1,304 @@
+"""Benchmark the whole app against a fake Slack Web API.
+
+Replays synthetic ``/np``, ``/npp``, reply-in-thread and edit requests
+at a target rate, either over HTTP through ``noping.flask_app`` or the
+way socket mode dispatches them, and reports ack and completion latency,
+throughput and Slack API calls per command. A command is complete when
+its message is posted, its preview is shown or its message is updated.
+
+Run from ``src``, e.g.::
+
+    python -m benchmarks.bench_app --mode flask --rate 20 --duration 10
+
+Rate limits (``noping.ratelimit``) apply as in production; use
+``--unthrottled`` to measure the app without them.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+
+from benchmarks.fake_slack import FakeSlack
+
+SIGNING_SECRET = "bench-signing-secret"
+TEAM = {"id": "T0BENCH", "domain": "bench"}
+KINDS = ("np", "npp", "reply", "edit")
+
+
+def _mentions(n: int, users: int) -> list:
+    return [f"U{(n * 3 + i) % users:08}" for i in range(3)]
+
+
+def _command(kind: str, n: int, users: int) -> dict:
+    mentions = " ".join(f"<@{user_id}|name{user_id[-3:]}>"
+                        for user_id in _mentions(n, users))
+    return {
+        "command": "/" + kind,
+        "text": f"Benchmark {n}: {mentions} and <@U00000000|me> \\",
+        "user_id": f"U9{n % 50:07}",
+        "channel_id": f"C{n}",
+        "trigger_id": f"{n}.bench",
+        "team_id": TEAM["id"],
+        "team_domain": TEAM["domain"],
+    }
+
+
+def _view_submission(kind: str, n: int, users: int) -> dict:
+    elements = [{"type": "text", "text": f"Benchmark {n}: "}]
+    for user_id in _mentions(n, users):
+        elements += [{"type": "user", "user_id": user_id},
+                     {"type": "text", "text": " "}]
+    meta = {"ts": "1.000001", "ch": f"C{n}"}
+    if kind == "edit":
+        # As if the first mention was in the original message already
+        meta["names"] = {_mentions(n, users)[0]: "original"}
+    return {
+        "type": "view_submission",
+        "trigger_id": f"{n}.bench",
+        "user": {"id": f"U9{n % 50:07}"},
+        "team": TEAM,
+        "view": {
+            "id": f"V{n}",
+            "type": "modal",
+            "hash": "bench",
+            "callback_id": "reply_thread" if kind == "reply" else (
+                "edit_message"),
+            "private_metadata": json.dumps(meta),
+            "blocks": [{"type": "input", "block_id": "input"}],
+            "state": {"values": {"input": {"rich_text_input-action": {
+                "type": "rich_text_input",
+                "rich_text_value": {"type": "rich_text", "elements": [
+                    {"type": "rich_text_section", "elements": elements}]},
+            }}}},
+        },
+    }
+
+
+def build_payload(kind: str, n: int, users: int) -> dict:
+    """Build the payload of a synthetic request.
+
+    :param kind: ``np``, ``npp``, ``reply`` or ``edit``
+    :type kind: str
+    :param n: Sequence number, used for unique channel and trigger IDs
+    :type n: int
+    :param users: Number of distinct users to mention
+    :type users: int
+    :return: The request payload
+    :rtype: dict
+    """
+
+    if kind in ("np", "npp"):
+        return _command(kind, n, users)
+    return _view_submission(kind, n, users)
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Flask:
+    """Sends signed HTTP requests to ``noping.flask_app``."""
+
+    def __init__(self):
+        from slack_sdk.signature import SignatureVerifier
+        from werkzeug.serving import make_server
+
+        from noping.flask_app import create_flask_app
+
+        self._verifier = SignatureVerifier(SIGNING_SECRET)
+        # Built as a WSGI server would, before the first request
+        self._server = make_server("127.0.0.1", 0, create_flask_app(),
+            threaded=True)
+        threading.Thread(target=self._server.serve_forever,
+            daemon=True).start()
+        self._url = (f"http://127.0.0.1:{self._server.server_port}"
+                     f"/slack/events")
+
+    def send(self, payload: dict) -> int:
+        if "command" in payload:
+            body = urlencode(payload)
+        else:
+            body = "payload=" + quote(json.dumps(payload))
+        timestamp = str(int(time.time()))
+        request = urllib.request.Request(self._url, data=body.encode(),
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+                "X-Slack-Request-Timestamp": timestamp,
+                "X-Slack-Signature": self._verifier.generate_signature(
+                    timestamp=timestamp, body=body),
+            })
+        with urllib.request.urlopen(request) as response:
+            return response.status
+
+    def stop(self) -> None:
+        self._server.shutdown()
+
+
+class SocketMode:
+    """Dispatches requests the way ``SocketModeHandler`` does."""
+
+    def __init__(self):
+        from slack_bolt.adapter.socket_mode.internals import run_bolt_app
+        from slack_sdk.socket_mode.request import SocketModeRequest
+
+        from noping.__main__ import default_app
+
+        self._app = default_app()
+        self._run_bolt_app = run_bolt_app
+        self._request = SocketModeRequest
+
+    def send(self, payload: dict) -> int:
+        request = self._request(
+            type="slash_commands" if "command" in payload else "interactive",
+            envelope_id=payload["trigger_id"],
+            payload=payload,
+        )
+        return self._run_bolt_app(self._app, request).status
+
+    def stop(self) -> None:
+        pass
+
+
+def run(args) -> dict:
+    fake = FakeSlack(latency=args.latency / 1000, jitter=args.jitter / 1000,
+        error_rate=args.error_rate, ratelimit_rate=args.ratelimit_rate,
+        seed=0).start()
+    os.environ["SLACK_BOT_TOKEN"] = "xoxb-bench"
+    os.environ["SLACK_SIGNING_SECRET"] = SIGNING_SECRET
+    os.environ["NOPING_SLACK_API_URL"] = fake.url
+    if args.unthrottled:
+        from noping import ratelimit
+        os.environ["NOPING_RATE_LIMITS"] = ",".join(
+            f"{method}=1000000" for method in ratelimit.METHOD_LIMITS)
+
+    target = Flask() if args.mode == "flask" else SocketMode()
+    mix = [kind for kind in args.mix.split(",") if kind]
+    total = int(args.rate * args.duration)
+    sent = {}
+    finished = {}
+    acks = []
+    failed = []
+    lock = threading.Lock()
+    done = threading.Semaphore(0)
+
+    def _finished(n: int) -> None:
+        finished[n] = time.perf_counter()
+        done.release()
+
+    def _send(n: int, kind: str) -> None:
+        payload = build_payload(kind, n, args.users)
+        fake.on_finished(f"C{n}", lambda: _finished(n))
+        start = sent[n] = time.perf_counter()
+        try:
+            status = target.send(payload)
+        except Exception as e:
+            status = e
+        with lock:
+            acks.append(time.perf_counter() - start)
+            if status != 200:
+                failed.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.senders) as senders:
+        for n, kind in zip(range(total), itertools.cycle(mix)):
+            delay = started + n / args.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            senders.submit(_send, n, kind)
+
+    deadline = time.monotonic() + args.timeout
+    for _ in range(total):
+        if not done.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            break
+    ended = max(finished.values(), default=time.perf_counter())
+    # Lazy listeners still running would outlive the interpreter
+    from noping.__main__ import default_app
+    pool = default_app().listener_runner.lazy_listener_runner.pool
+    pool.drain(timeout=max(0.0, deadline - time.monotonic()))
+    pool.shutdown(cancel_futures=True)
+    target.stop()
+    fake.stop()
+
+    latencies = [finished[n] - sent[n] for n in finished]
+    calls = sum(fake.calls.values())
+    return {
+        "mode": args.mode,
+        "commands": total,
+        "completed": len(finished),
+        "failed_acks": len(failed),
+        "throughput": len(finished) / (ended - started),
+        "ack_ms": {p: percentile(acks, p) * 1000 for p in (50, 95, 99)},
+        "completion_ms": {
+            p: percentile(latencies, p) * 1000 for p in (50, 95, 99)},
+        "slack_calls_per_command": calls / total if total else 0.0,
+        "slack_calls": dict(fake.calls.most_common()),
+        "injected_errors": dict(fake.errors),
+    }
+
+
+def _print_report(report: dict) -> None:
+    print(f"mode:                {report['mode']}")
+    print(f"commands:            {report['completed']}/{report['commands']}"
+          f" completed, {report['failed_acks']} failed acks")
+    print(f"throughput:          {report['throughput']:.1f} commands/s")
+    for name in ("ack_ms", "completion_ms"):
+        latency = report[name]
+        print(f"{name.replace('_ms', ' latency'):<20} "
+              f"p50 {latency[50]:.1f} ms, p95 {latency[95]:.1f} ms,"
+              f" p99 {latency[99]:.1f} ms")
+    print(f"slack calls/command: {report['slack_calls_per_command']:.2f}")
+    for method, count in report["slack_calls"].items():
+        print(f"  {method:<18} {count}")
+    if report["injected_errors"]:
+        print(f"injected errors:     {report['injected_errors']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--mode", choices=("flask", "socket"),
+        default="socket")
+    parser.add_argument("--rate", type=float, default=20,
+        help="requests per second")
+    parser.add_argument("--duration", type=float, default=5,
+        help="seconds to send requests for")
+    parser.add_argument("--mix", default=",".join(KINDS),
+        help="comma-separated request kinds, sent round-robin")
+    parser.add_argument("--users", type=int, default=200,
+        help="number of distinct users to mention")
+    parser.add_argument("--latency", type=float, default=50,
+        help="Slack API latency in ms")
+    parser.add_argument("--jitter", type=float, default=0,
+        help="random extra Slack API latency in ms")
+    parser.add_argument("--error-rate", type=float, default=0,
+        help="share of Slack API calls failing with HTTP 500")
+    parser.add_argument("--ratelimit-rate", type=float, default=0,
+        help="share of Slack API calls failing with HTTP 429")
+    parser.add_argument("--unthrottled", action="store_true",
+        help="disable NoPing's own rate limiting")
+    parser.add_argument("--senders", type=int, default=32,
+        help="number of concurrent senders")
+    parser.add_argument("--timeout", type=float, default=30,
+        help="seconds to wait for commands to complete")
+    parser.add_argument("--json", action="store_true",
+        help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
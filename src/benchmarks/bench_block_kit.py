@@ -0,0 +1,85 @@
+"""Benchmark converting mentions in large multi-section rich text.
+
+Run from ``src`` with ``python -m benchmarks.bench_block_kit``.
+"""
+
+import copy
+import time
+
+from noping import text
+
+
+def _section(i: int) -> dict:
+    return {
+        "type": "rich_text_section",
+        "elements": [
+            {"type": "text", "text": f"Line {i}, cc "},
+            {"type": "user", "user_id": f"U{i % 500:08}"},
+            {"type": "text", "text": " and "},
+            {"type": "user", "user_id": f"U{(i + 1) % 500:08}"},
+            {"type": "text", "text": " \\ (escaped)"},
+        ],
+    }
+
+
+def build_content(sections: int) -> list:
+    """Build rich text with sections, lists, quotes and preformatted
+    blocks, each with two mentions (one escaped).
+
+    :param sections: Number of containers
+    :type sections: int
+    :return: ``rich_text`` elements
+    :rtype: list
+    """
+
+    content = []
+    for i in range(sections):
+        match i % 4:
+            case 0:
+                content.append(_section(i))
+            case 1:
+                content.append({"type": "rich_text_list", "style": "bullet",
+                                "elements": [_section(i)]})
+            case 2:
+                content.append({"type": "rich_text_quote",
+                                "elements": _section(i)["elements"]})
+            case 3:
+                content.append({"type": "rich_text_preformatted",
+                                "elements": _section(i)["elements"]})
+    return content
+
+
+def bench(sections: int, repeat: int = 5) -> float:
+    names = {f"U{i:08}": f"user{i}" for i in range(500)}
+    best = float("inf")
+    for _ in range(repeat):
+        content = build_content(sections)
+        start = time.perf_counter()
+        text.block_kit_mentions_to_links(content, "workspace", names=names)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_copy(sections: int, repeat: int = 5) -> float:
+    # What copying the whole tree alone would cost
+    content = build_content(sections)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        copy.deepcopy(content)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    print(f"{'sections':>10} {'convert ms':>12} {'us/section':>12}"
+          f" {'deepcopy ms':>12}")
+    for sections in (100, 1000, 10000, 100000):
+        took = bench(sections)
+        print(f"{sections:>10} {took * 1000:>12.2f}"
+              f" {took / sections * 1e6:>12.2f}"
+              f" {bench_copy(sections) * 1000:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark importing the app's entry points.
+
+Imports each module in a fresh interpreter with ``python -X importtime``
+and reports the total import time, the time spent in NoPing's own
+modules and the slowest modules. Importing must not build the app or
+call Slack, so the Slack API URL points at a closed port and no tokens
+are set; any network access on import makes it fail.
+
+Run from ``src``, e.g.::
+
+    python -m benchmarks.bench_import --max-own-ms 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ("noping", "noping.flask_app", "noping.async_app",
+           "noping.socket_mode")
+
+
+def import_times(module: str) -> dict:
+    """Import a module in a new interpreter.
+
+    :param module: Module to import
+    :type module: str
+    :return: Self time in microseconds by imported module
+    :rtype: dict
+    """
+
+    env = {key: value for key, value in os.environ.items()
+           if key not in ("SLACK_BOT_TOKEN", "SLACK_APP_TOKEN")}
+    env["NOPING_SLACK_API_URL"] = "http://127.0.0.1:9/api/"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             f"import {module}"],
+        capture_output=True, text=True, env=env, check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line.removeprefix("import time:").split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def bench(module: str, repeat: int = 5) -> dict:
+    best = None
+    for _ in range(repeat):
+        times = import_times(module)
+        if best is None or sum(times.values()) < sum(best.values()):
+            best = times
+    own = {name: us for name, us in best.items()
+           if name == "noping" or name.startswith("noping.")}
+    return {
+        "module": module,
+        "total_ms": sum(best.values()) / 1000,
+        "own_ms": sum(own.values()) / 1000,
+        "slowest": sorted(best.items(), key=lambda item: -item[1])[:5],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5,
+        help="imports per module; the fastest counts")
+    parser.add_argument("--max-own-ms", type=float,
+        help="fail if NoPing's own modules take longer to import")
+    parser.add_argument("--json", action="store_true",
+        help="print the report as JSON")
+    args = parser.parse_args()
+
+    reports = [bench(module, args.repeat) for module in args.modules]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print(f"{report['module']:<20} total {report['total_ms']:6.1f}"
+                  f" ms, noping {report['own_ms']:5.1f} ms")
+            for name, us in report["slowest"]:
+                print(f"  {name:<40} {us / 1000:6.1f} ms")
+
+    if args.max_own_ms is not None and any(
+            report["own_ms"] > args.max_own_ms for report in reports):
+        sys.exit(f"NoPing's own modules took over {args.max_own_ms} ms"
+                 f" to import")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark building and serializing modals.
+
+Compares building each view with ``noping.views``, which copies static
+parts built on import, with ``copy.deepcopy`` of the same view, and
+reports the time to serialize it as slack_sdk does (``json.dumps``) and
+the memory allocated per view.
+
+Run from ``src``, e.g.::
+
+    python -m benchmarks.bench_views --number 20000
+"""
+
+import argparse
+import copy
+import json
+import time
+import tracemalloc
+
+from noping import views
+
+SHORTCUT = {
+    "message": {"ts": "1700000000.000100"},
+    "channel": {"id": "C0BENCH"},
+    "user": {"id": "U0BENCH"},
+}
+BLOCKS = [
+    {"type": "context", "elements": [{"type": "mrkdwn",
+                                      "text": "*<@U0BENCH>*:"}]},
+    {"type": "rich_text", "elements": [{
+        "type": "rich_text_section",
+        "elements": [{"type": "text", "text": "Hello "},
+                     {"type": "link", "text": "@someone",
+                      "url": "https://bench.slack.com/team/U1?noping=1"}],
+    }]},
+]
+
+CASES = {
+    "cant_edit": lambda: views.cant_edit_view(),
+    "out_of_order": lambda: views.out_of_order_view(),
+    "cant_access_channel": lambda: views.cant_access_channel_view(BLOCKS),
+    "preview": lambda: views.preview_view("Not in this channel", BLOCKS),
+    "message_editor": lambda: views.message_editor_view("edit_message",
+        "Edit message", SHORTCUT, {"U1": "someone"}),
+}
+
+
+def _per_call(function, number: int) -> tuple:
+    start = time.perf_counter()
+    for _ in range(number):
+        function()
+    seconds = (time.perf_counter() - start) / number
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    function()
+    allocated = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return seconds, allocated
+
+
+def bench(name: str, number: int) -> dict:
+    build = CASES[name]
+    view = build()
+    built = _per_call(build, number)
+    deepcopied = _per_call(lambda: copy.deepcopy(view), number)
+    serialized = _per_call(lambda: json.dumps(view), number)
+    return {
+        "view": name,
+        "built_us": built[0] * 1e6,
+        "deepcopied_us": deepcopied[0] * 1e6,
+        "serialized_us": serialized[0] * 1e6,
+        "built_bytes": built[1],
+        "deepcopied_bytes": deepcopied[1],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("views", nargs="*", default=list(CASES),
+        help=f"views to benchmark: {', '.join(CASES)}")
+    parser.add_argument("--number", type=int, default=20000,
+        help="views to build per measurement")
+    parser.add_argument("--json", action="store_true",
+        help="print the report as JSON")
+    args = parser.parse_args()
+
+    reports = [bench(name, args.number) for name in args.views]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    print(f"{'view':<20} {'built':>10} {'deepcopy':>10} {'json':>10}"
+          f" {'built':>9} {'deepcopy':>9}")
+    for report in reports:
+        print(f"{report['view']:<20} {report['built_us']:7.2f} us"
+              f" {report['deepcopied_us']:7.2f} us"
+              f" {report['serialized_us']:7.2f} us"
+              f" {report['built_bytes']:7} B"
+              f" {report['deepcopied_bytes']:7} B")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""A local stand-in for the Slack Web API.
+
+Answers the API methods NoPing uses after a configurable latency, and
+can inject errors and rate limiting. Every call is counted by method.
+"""
+
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# API methods that finish handling a command, keyed by the parameter
+# that identifies the command
+TERMINAL_METHODS = {
+    "chat.postMessage": "channel",
+    "chat.postEphemeral": "channel",
+    "chat.update": "channel",
+    "views.open": "trigger_id",
+}
+
+
+def _params(handler, body: bytes) -> dict:
+    params = {}
+    query = handler.path.partition("?")[2]
+    for key, values in parse_qs(query).items():
+        params[key] = values[0]
+    content_type = handler.headers.get("Content-Type", "")
+    if content_type.startswith("application/json"):
+        params.update(json.loads(body or b"{}"))
+    else:
+        for key, values in parse_qs(body.decode()).items():
+            params[key] = values[0]
+    return params
+
+
+def _response(method: str, params: dict) -> dict:
+    if method == "auth.test":
+        return {"ok": True, "bot_id": "B0BENCH", "user_id": "U0BOT",
+                "team_id": "T0BENCH", "team": "bench",
+                "url": "https://bench.slack.com/"}
+    if method in ("users.profile.get", "users.info"):
+        user_id = params.get("user", "U0")
+        profile = {
+            "display_name": f"user-{user_id}",
+            "real_name": f"User {user_id}",
+            "image_512": f"https://example.com/{user_id}.png",
+        }
+        if method == "users.info":
+            return {"ok": True, "user": {"id": user_id, "profile": profile}}
+        return {"ok": True, "profile": profile}
+    if method == "users.list":
+        return {"ok": True, "members": [], "response_metadata": {
+            "next_cursor": ""}}
+    return {"ok": True, "ts": f"{time.time():.6f}"}
+
+
+class FakeSlack:
+    """A fake Slack Web API on ``127.0.0.1``."""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0,
+                 error_rate: float = 0.0, ratelimit_rate: float = 0.0,
+                 retry_after: int = 1, seed: int = None):
+        """
+        :param latency: Seconds before every response
+        :type latency: float
+        :param jitter: Up to this many seconds are added to the latency
+        :type jitter: float
+        :param error_rate: Share of calls answered with HTTP 500
+        :type error_rate: float
+        :param ratelimit_rate: Share of calls answered with HTTP 429
+        :type ratelimit_rate: float
+        :param retry_after: ``Retry-After`` of rate limited calls
+        :type retry_after: int
+        :param seed: Seed for the injected errors and jitter
+        :type seed: int
+        """
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.ratelimit_rate = ratelimit_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._waiters = {}  # (method param value) -> callback
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0),
+            self._handler_class())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/api/"
+
+    def start(self) -> "FakeSlack":
+        threading.Thread(target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.05}, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def on_finished(self, key: str, callback) -> None:
+        """Call ``callback()`` when a command is finished, i.e. a
+        ``TERMINAL_METHODS`` call with ``key`` succeeds.
+
+        :param key: Channel or trigger ID of the command
+        :type key: str
+        """
+
+        with self._lock:
+            self._waiters[key] = callback
+
+    def _inject(self, method: str) -> int:
+        with self._lock:
+            self.calls[method] += 1
+            roll = self._random.random()
+            delay = self.latency + self._random.random() * self.jitter
+        time.sleep(delay)
+        if roll < self.ratelimit_rate:
+            status = 429
+        elif roll < self.ratelimit_rate + self.error_rate:
+            status = 500
+        else:
+            return 200
+        with self._lock:
+            self.errors[status] += 1
+        return status
+
+    def _finish(self, method: str, params: dict) -> None:
+        if method not in TERMINAL_METHODS:
+            return
+        with self._lock:
+            callback = self._waiters.pop(
+                params.get(TERMINAL_METHODS[method]), None)
+        if callback is not None:
+            callback()
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(
+                    int(self.headers.get("Content-Length", 0)))
+                method = self.path.partition("?")[0].rstrip("/").rsplit(
+                    "/", 1)[-1]
+                params = _params(self, body)
+                status = fake._inject(method)
+                if status == 200:
+                    data = _response(method, params)
+                elif status == 429:
+                    data = {"ok": False, "error": "ratelimited"}
+                else:
+                    data = {"ok": False, "error": "internal_error"}
+
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type",
+                    "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                if status == 429:
+                    self.send_header("Retry-After", str(fake.retry_after))
+                self.end_headers()
+                self.wfile.write(payload)
+                if status == 200:
+                    fake._finish(method, params)
+
+            do_GET = do_POST
+
+        return Handler
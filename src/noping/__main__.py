@@ -1,371 +1,186 @@
 import os
-from json import dumps, loads
+import threading
 
 from dotenv import load_dotenv
 from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk.errors import SlackApiError
 
-from noping import text
+from noping import (identity, idempotency, messages, metrics, profiles,
+    ratelimit, resolution, text, tracing, transport, views, workspaces)
+from noping.ratelimit import ScheduledWebClient
+from noping.worker import (WorkerLazyListenerRunner, WorkerPool,
+    reject_when_busy)
 
-load_dotenv()
 
-
-# noinspection PyUnusedLocal
-def _build_blocks(client, user_id, content, team_domain) -> list:
+def _build_blocks(client, user_id, content, team_domain,
+                  names=None) -> list:
     if type(content) == list:
-        body = {
-            "type": "rich_text",
-            "elements": [
-                {
-                    "type": "rich_text_section",
-                    "elements": text.block_kit_mentions_to_links(
-                        content,
-                        team_domain,
-                        client,
-                    ),
-                }
-            ]
-        }
+        converted = text.block_kit_mentions_to_links(content, team_domain,
+            client, names)
     else:
-        body = {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": text.mentions_to_links(content, team_domain,
-                    app.client)
-            }
-        }
-
-    return [
-        {
-            "type": "context",
-            "elements": [
-                {
-                    "type": "mrkdwn",
-                    "text": f"*<@{user_id}>*:"
-                }
-            ]
-        }
-    ] + [body]
-
-
-def _build_message_editor_blocks(user_id: str) -> list:
-    return [
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": "Mentions will be depinged unless they're"
-                        r" followed by `\`."
-            },
-        },
-        {
-            "type": "divider"
-        },
-        {
-            "type": "input",
-            "element": {
-                "type": "rich_text_input",
-                "action_id": "rich_text_input-action",
-            },
-            "label": {
-                "type": "plain_text",
-                "text": f"<@{user_id}>:",
-            },
-        },
-    ]
-
-
-def _get_message_editor_input(view):
-    return view["state"]["values"][view["blocks"][-1]["block_id"]][
-        "rich_text_input-action"]["rich_text_value"]["elements"][0]["elements"]
+        converted = text.mentions_to_links(content, team_domain, client,
+            names)
+
+    return views.message_blocks(user_id, converted)
+
+
+def _lookup_profiles(client, user_id, content,
+                     policy=resolution.LOOKUP) -> tuple[dict | None, dict]:
+    """Look up the sender's and all mentioned users' profiles at once.
+
+    See ``messages.lookup_result``.
+    """
+
+    mentioned = text.content_mention_user_ids(content)
+    with tracing.span("lookup_profiles", attributes={
+            "mentions": len(mentioned), "policy": policy}):
+        found = profiles.get_profiles(client,
+            messages.users_to_look_up(user_id, mentioned, policy))
+    return messages.lookup_result(found, user_id, mentioned, policy,
+        profiles.cache_for(client))
 
 
 def _post_noping_message(client, profile, user_id, blocks, trigger_id,
                          **kwargs):
-    profile_name = (
-        profile["display_name"]
-        or profile["real_name"]
-    )
-
     try:  # To show a modal if the conversation is inaccessible
         m = client.chat_postMessage(
-            text=f"*<@{user_id}>*: ...",
-            blocks=blocks,
-            username=profile_name,
-            icon_url=profile["image_512"],
+            **messages.noping_message(profile, user_id, blocks),
             **kwargs
         )
     except SlackApiError as e:
-        if e.response["error"] != "channel_not_found":
+        if not messages.channel_not_found(e):
             raise  # Slack returned a different error
 
-        # Slack returned "channel_not_found" meaning it's inaccessible
-        # Show the modal
+        # The conversation is inaccessible, show the modal
         client.views_open(
             trigger_id=trigger_id,
-            view={
-                "type": "modal",
-                "title": {
-                    "type": "plain_text",
-                    "text": "Can't access channel",
-                },
-                "close": {
-                    "type": "plain_text",
-                    "text": "Close",
-                },
-                "blocks": [
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": "NoPing is not in this private channel "
-                                    "and cannot send messages in it. "
-                                    "Try inviting NoPing with `/invite`.",
-                        },
-                    },
-                    { "type": "divider" },
-                    {
-                        "type": "context",
-                        "elements": [
-                            {
-                                "type": "plain_text",
-                                "text": "Preview of your message:",
-                                "emoji": False,
-                            }
-                        ]
-                    }
-                ] + blocks,
-            },
+            view=views.cant_access_channel_view(blocks),
         )
     else:
         return m
 
 
-app = App(
-    token=os.environ.get("SLACK_BOT_TOKEN"),
-    signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
-)
+def _ack(ack):
+    ack()
 
 
-@app.command("/np")
-def np(ack, client, command):
-    ack()
+def np(client, command):
     if command["text"].strip():
-        user = client.users_info(user=command["user_id"])["user"]
+        profile, names = _lookup_profiles(client, command["user_id"],
+            command["text"], resolution.resolution_policy(
+                command["team_id"], command["command"]))
         _post_noping_message(
             client,
-            user["profile"],
+            profile,
             command["user_id"],
-            blocks=_build_blocks(client, command["user_id"], command["text"],
-                command["team_domain"]),
+            # Everyone is resolved already
+            blocks=_build_blocks(None, command["user_id"], command["text"],
+                command["team_domain"], names),
             trigger_id=command["trigger_id"],
             channel=command["channel_id"],
         )
     else:
         try:
             client.chat_postEphemeral(
-                text="There's nothing for me to send!"
-                     " Use `/np <message>` to send a message without pings,"
-                     r" and use `@... \` in your message to escape a ping.",
+                text=messages.NOTHING_TO_SEND_TEXT,
                 channel=command["channel_id"],
                 user=command["user_id"],
             )
         except SlackApiError as e:
-            if e.response["error"] != "channel_not_found":
+            if not messages.channel_not_found(e):
                 raise
 
             client.views_open(
                 trigger_id=command["trigger_id"],
-                view={
-                    "type": "modal",
-                    "title": {
-                        "type": "plain_text",
-                        "text": "Can't access channel",
-                    },
-                    "close": {
-                        "type": "plain_text",
-                        "text": "Close",
-                    },
-                    "blocks": [
-                        {
-                            "type": "section",
-                            "text": {
-                                "type": "mrkdwn",
-                                "text": "There's nothing for me to send in "
-                                        "this private channel. To use `/np` "
-                                        "to send directly, use `/invite` to "
-                                        "add me first. You can also use "
-                                        "`/npp` to preview a message in any "
-                                        "channel."
-                            },
-                        },
-                    ],
-                },
+                view=views.nothing_to_send_view(),
             )
 
 
-@app.command("/npp")
-def npp(ack, client, command):
+def npp(client, command):
     """Send an ephemeral message similar to ``/np`` for previewing."""
 
-    ack()
-    preview_header = [
-        {
-            "type": "context",
-            "elements": [{
-                "type": "mrkdwn",
-                "text": "This is only a preview; "
-                        "*your message hasn't been sent yet!*"
-            }],
-        },
-        {
-            "type": "divider",
-        },
-    ]
-
     def _preview_modal(reason: str, blocks_: list) -> None:
         client.views_open(
             trigger_id=command["trigger_id"],
-            view={
-                "type": "modal",
-                "title": {
-                    "type": "plain_text",
-                    "text": "Message preview",
-                },
-                "close": {
-                    "type": "plain_text",
-                    "text": "Close",
-                },
-                "blocks": preview_header + [
-                    {
-                        "type": "context",
-                        "elements": [{
-                            "type": "mrkdwn",
-                            "text": reason,
-                        }],
-                    },
-                    {
-                        "type": "divider",
-                    },
-                ] + blocks_,
-            },
+            view=views.preview_view(reason, blocks_),
         )
 
     if command["text"].strip():
-        if command["text"].strip()[:3] == "-m ":  # User forces modal
-            blocks = _build_blocks(
-                client,
-                command["user_id"],
-                command["text"].replace("-m ", "", 1),
-                command["team_domain"]
-            )
-            _preview_modal("You're seeing this because you used `/npp -m`. "
-                           "Without `-m`, this would display as an ephemeral "
-                           "message.", blocks)
-        else:
-            blocks = _build_blocks(
-                client,
-                command["user_id"],
-                command["text"],
-                command["team_domain"]
+        message, forced_modal = messages.preview_request(command["text"])
+        _, names = _lookup_profiles(client, None, message,
+            resolution.resolution_policy(command["team_id"],
+                command["command"]))
+        blocks = _build_blocks(None, command["user_id"], message,
+            command["team_domain"], names)
+
+        if forced_modal:
+            _preview_modal(messages.FORCED_MODAL_REASON, blocks)
+            return
+        try:  # Usual method: Ephemeral message
+            client.chat_postEphemeral(
+                blocks=views.preview_header() + blocks,
+                channel=command["channel_id"],
+                user=command["user_id"],
             )
-
-            try:  # Usual method: Ephemeral message
-                client.chat_postEphemeral(
-                    blocks=preview_header + blocks,
-                    channel=command["channel_id"],
-                    user=command["user_id"],
-                )
-            except SlackApiError as e:
-                if e.response["error"] != "channel_not_found":
-                    raise
-                # Use a modal instead
-                _preview_modal("You're seeing this because NoPing is "
-                               "not in this private channel.", blocks)
+        except SlackApiError as e:
+            if not messages.channel_not_found(e):
+                raise
+            # Use a modal instead
+            _preview_modal(messages.PRIVATE_CHANNEL_REASON, blocks)
     else:  # No text is provided
         try:
             client.chat_postEphemeral(
-                text="I can't preview an empty string. Check `/np` for usage.",
+                text=messages.NOTHING_TO_PREVIEW_TEXT,
                 channel=command["channel_id"],
                 user=command["user_id"],
             )
         except SlackApiError as e:
-            if e.response["error"] != "channel_not_found":
+            if not messages.channel_not_found(e):
                 raise
             client.views_open(
                 trigger_id=command["trigger_id"],
-                view={
-                    "type": "modal",
-                    "title": {
-                        "type": "plain_text",
-                        "text": "Nothing to preview",
-                    },
-                    "close": {
-                        "type": "plain_text",
-                        "text": "Close",
-                    },
-                    "blocks": [
-                        {
-                            "type": "section",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "I can't preview an empty string. See "
-                                        "my description for usage. "
-                                        "You're seeing this because NoPing is "
-                                        "not in this private channel."
-                            },
-                        },
-                    ],
-                },
+                view=views.nothing_to_preview_view(),
             )
 
 
-@app.message_shortcut("reply_thread")
-def reply_thread(ack, client, shortcut):
-    ack()
-    client.views_open(
-        trigger_id=shortcut["trigger_id"],
-        view={
-            "callback_id": "reply_thread",
-            "private_metadata": dumps({
-                "ts": shortcut["message"]["ts"],
-                "ch": shortcut["channel"]["id"],
-            }),
-            "type": "modal",
-            "title": {
-                "type": "plain_text",
-                "text": "Reply in thread"
-            },
-            "submit": {
-                "type": "plain_text",
-                "text": "Submit"
-            },
-            "close": {
-                "type": "plain_text",
-                "text": "Cancel"
-            },
-            "blocks": _build_message_editor_blocks(shortcut["user"]["id"]),
-        },
-    )
+def _open_view(client, trigger_id, view, channel=None, user=None):
+    """Open a modal, or tell the user in ``channel`` that Slack is rate
+    limiting NoPing if the modal can't be opened in time.
+    """
 
+    try:
+        client.views_open(trigger_id=trigger_id, view=view)
+    except SlackApiError as e:
+        if channel is None or not ratelimit.is_ratelimited(e):
+            raise
+        client.chat_postEphemeral(
+            text=views.RATELIMITED_TEXT,
+            channel=channel,
+            user=user,
+        )
 
-@app.view("reply_thread")
-def handle_reply_thread(ack, client, view, body):
-    ack()
-    meta = loads(view["private_metadata"])
 
-    user = client.users_info(user=body["user"]["id"])["user"]
+def reply_thread(client, shortcut):
+    _open_view(client, shortcut["trigger_id"],
+        views.message_editor_view("reply_thread", "Reply in thread",
+            shortcut),
+        *messages.shortcut_origin(shortcut))
+
+
+def handle_reply_thread(client, view, body):
+    meta, content = messages.editor_submission(view)
+
+    profile, names = _lookup_profiles(client, body["user"]["id"], content)
     _post_noping_message(
         client,
-        user["profile"],
+        profile,
         body["user"]["id"],
         blocks=_build_blocks(
             client,
             body["user"]["id"],
-            _get_message_editor_input(view),
-            body["team"]["domain"]
+            content,
+            body["team"]["domain"],
+            names,
         ),
         trigger_id=body["trigger_id"],
         channel=meta["ch"],
@@ -374,13 +189,6 @@ def handle_reply_thread(ack, client, view, body):
 
 
 # noinspection PyUnusedLocal
-def _user_can_edit_message(client, msg_bot_id, msg_text, user_id) -> bool:
-    return (msg_bot_id == client.auth_test().data["bot_id"]
-            and text.user_owns_message(msg_text, user_id))
-
-
-# noinspection PyUnusedLocal
-@app.message_shortcut("delete_message")
 def delete_message(ack, shortcut, client):
     """A stubbed function to respond to ``delete_message`` shortcuts.
 
@@ -389,126 +197,163 @@ def delete_message(ack, shortcut, client):
     admin token, which is likely not possible for the Hack Club Slack.
     """
     ack()
-    client.views_open(
-        trigger_id=shortcut["trigger_id"],
-        view={
-            "type": "modal",
-            "title": {
-                "type": "plain_text",
-                "text": "Out of order",
-            },
-            "close": {
-                "type": "plain_text",
-                "text": "Close",
-            },
-            "blocks": [
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "Due to NoPing's \"impersonation\", it cannot "
-                                "delete messages. Use `/npp` to preview "
-                                "messages and manually send them to have "
-                                "control over your messages. "
-                                "Editing is unaffected.",
-                    },
-                },
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": "(Slack prevents impersonated messages from "
-                                "being deleted by the bot who sent it. "
-                                "Allowing deletion requires a highly "
-                                "privileged and insecure admin token.)",
-                    },
-                }
-            ],
-        },
-    )
+    _open_view(client, shortcut["trigger_id"], views.out_of_order_view(),
+        *messages.shortcut_origin(shortcut))
 
 
-@app.view("delete_message")
 def handle_delete_message(ack, client, view):
     ack()
-    meta = loads(view["private_metadata"])
+    meta = messages.view_metadata(view)
     client.chat_delete(
         channel=meta["ch"],
         ts=meta["ts"]
     )
 
 
-@app.message_shortcut("edit_message")
-def edit_message(ack, shortcut, client):
-    ack()
-    if ("bot_id" in shortcut["message"]  # Prevents KeyError
-            and _user_can_edit_message(client,
-                shortcut["message"]["bot_id"],
-                shortcut["message"]["text"],
-                shortcut["user"]["id"])):
-        client.views_open(
-            trigger_id=shortcut["trigger_id"],
-            view={
-                "callback_id": "edit_message",
-                "private_metadata": dumps({
-                    "ts": shortcut["message"]["ts"],
-                    "ch": shortcut["channel"]["id"],
-                }),
-                "type": "modal",
-                "title": {
-                    "type": "plain_text",
-                    "text": "Edit message"
-                },
-                "submit": {
-                    "type": "plain_text",
-                    "text": "Submit"
-                },
-                "close": {
-                    "type": "plain_text",
-                    "text": "Cancel"
-                },
-                "blocks": _build_message_editor_blocks(shortcut["user"]["id"]),
-            },
-        )
-    else:
-        client.views_open(
-            trigger_id=shortcut["trigger_id"],
-            view={
-                "type": "modal",
-                "title": {
-                    "type": "plain_text",
-                    "text": "Can't edit message",
-                },
-                "close": {
-                    "type": "plain_text",
-                    "text": "Close",
-                },
-                "blocks": [
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "This message wasn't sent using NoPing or"
-                                    " was sent by someone else.",
-                        },
-                    },
-                ],
-            },
-        )
+def edit_message(shortcut, client):
+    # Only messages from a bot can be NoPing's
+    bot_id = (identity.get_bot_identity(client)["bot_id"]
+              if "bot_id" in shortcut["message"] else None)
+    _open_view(client, shortcut["trigger_id"],
+        messages.edit_message_view(shortcut, bot_id),
+        *messages.shortcut_origin(shortcut))
 
 
-@app.view("edit_message")
-def handle_edit_message(ack, client, view, body):
-    ack()
-    meta = loads(view["private_metadata"])
+def handle_edit_message(client, view, body, logger):
+    meta, content = messages.editor_submission(view)
+
+    # Only look up users who weren't mentioned in the original message
+    names, saved = resolution.reused_names(content, meta.get("names", {}),
+        profiles.cache_for(client))
+    logger.debug(f"Reused {saved} names from the original message")
     client.chat_update(
         channel=meta["ch"],
         ts=meta["ts"],
-        blocks=_build_blocks(client, body["user"]["id"],
-            _get_message_editor_input(view), body["team"]["domain"]),
+        blocks=_build_blocks(client, body["user"]["id"], content,
+            body["team"]["domain"], names),
     )
 
 
-if __name__ == "__main__":
-    if os.environ.get("DEBUG") == "True":  # If explicitly in debug
-        SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
+def handle_user_change(client, event):
+    """Keep cached profiles up to date when users change them."""
+
+    profiles.update_cached_user(event["user"], profiles.cache_for(client))
+
+
+def handle_tokens_revoked():
+    identity.forget_bot_identities()
+
+
+def create_app(token_verification_enabled: bool = False) -> App:
+    """Build the app.
+
+    Building it doesn't call Slack: the bot token is checked with
+    ``auth.test`` on the first request instead, unless
+    ``token_verification_enabled``. If ``SLACK_CLIENT_ID`` is set
+    instead of ``SLACK_BOT_TOKEN``, the app can be installed in many
+    workspaces (see ``noping.workspaces``).
+
+    :param token_verification_enabled: Whether to check the token now
+    :type token_verification_enabled: bool
+    :return: The app
+    :rtype: App
+    """
+
+    load_dotenv()
+    # Shared by all handlers, keeping connections to Slack open
+    client = ScheduledWebClient(token=os.environ.get("SLACK_BOT_TOKEN"),
+        **transport.client_options_from_env())
+    registry = None
+    oauth_options = {}
+    if workspaces.oauth_enabled():
+        registry = workspaces.WorkspaceRegistry.from_env(ScheduledWebClient,
+            transport.client_options_from_env())
+        oauth_options = workspaces.oauth_options(client)
+    app = App(
+        client=client,
+        signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
+        token_verification_enabled=token_verification_enabled,
+        **oauth_options,
+    )
+    # Listeners only ack; the work runs in a bounded pool of its own so
+    # acks never wait behind slow Slack API calls
+    worker_pool = WorkerPool.from_env()
+    app.listener_runner.lazy_listener_runner = WorkerLazyListenerRunner(
+        app.logger, worker_pool)
+
+    metrics.register_app_stats(app.client, worker_pool.stats,
+        profiles.profile_flight, registry)
+    app.dispatch = tracing.traced_dispatch(
+        metrics.timed_dispatch(app.dispatch))
+
+    # After Bolt's signature verification and authorization
+    app.middleware(tracing.trace_request)
+    # Redelivered requests are answered without running any listener
+    app.middleware(idempotency.skip_duplicates)
+
+    @app.middleware
+    def _use_scheduled_client(context, next):
+        # Bolt creates a plain WebClient for every request otherwise
+        if registry is None:
+            context["client"] = app.client
+        elif context.bot_token:
+            context["client"] = registry.client(
+                workspaces.workspace_id(context), context.bot_token)
+        next()
+
+    def _forget_workspace(context, next):
+        identity.forget_bot_identities(context.team_id)
+        registry.forget(workspaces.workspace_id(context))
+        next()
+
+    # Lazy listeners tell the user to try again when the pool is full
+    busy = [reject_when_busy(worker_pool)]
+    app.command("/np", middleware=busy)(ack=_ack, lazy=[np])
+    app.command("/npp", middleware=busy)(ack=_ack, lazy=[npp])
+    app.message_shortcut("reply_thread", middleware=busy)(ack=_ack,
+        lazy=[reply_thread])
+    app.view("reply_thread", middleware=busy)(ack=_ack,
+        lazy=[handle_reply_thread])
+    app.message_shortcut("delete_message")(delete_message)
+    app.view("delete_message")(handle_delete_message)
+    app.message_shortcut("edit_message", middleware=busy)(ack=_ack,
+        lazy=[edit_message])
+    app.view("edit_message", middleware=busy)(ack=_ack,
+        lazy=[handle_edit_message])
+    app.event("team_join")(handle_user_change)
+    app.event("user_change")(handle_user_change)
+    if registry is None:
+        app.event("tokens_revoked")(handle_tokens_revoked)
+    else:
+        # Bolt's listeners delete the installations
+        app.event("tokens_revoked", middleware=[_forget_workspace])(
+            app.default_tokens_revoked_event_listener())
+        app.event("app_uninstalled", middleware=[_forget_workspace])(
+            app.default_app_uninstalled_event_listener())
+    return app
+
+
+_default_app = None
+_default_app_lock = threading.Lock()
+
+
+def default_app() -> App:
+    """Get the process-wide app, building it on first use.
+
+    :return: The shared app
+    :rtype: App
+    """
+
+    global _default_app
+    if _default_app is None:
+        with _default_app_lock:
+            if _default_app is None:
+                _default_app = create_app()
+    return _default_app
+
+
+if __name__ == "__main__":  # python -m noping, like noping.socket_mode
+    load_dotenv()
+    from noping import socket_mode
+
+    socket_mode.run(default_app())
@@ -0,0 +1,407 @@
+"""NoPing on asyncio.
+
+This is the same app as ``noping.__main__``, but built on ``AsyncApp``
+so a single process can handle many commands at once without a thread
+per request. Run it with an ASGI server (``noping.async_app:asgi_app``)
+or in socket mode with ``python -m noping.async_app``.
+
+Requires the ``async`` extra (``aiohttp``).
+"""
+
+import asyncio
+import os
+import threading
+
+from dotenv import load_dotenv
+from slack_bolt.adapter.asgi.async_handler import AsyncSlackRequestHandler
+from slack_bolt.async_app import AsyncApp
+from slack_sdk.errors import SlackApiError
+
+from noping import (async_transport, identity, idempotency, messages,
+    metrics, profiles, ratelimit, resolution, text, tracing, views, warmup,
+    workspaces)
+from noping.async_ratelimit import AsyncScheduledWebClient
+from noping.async_socket_mode import AsyncSocketModeRunner
+from noping.async_worker import (AsyncWorkerLazyListenerRunner,
+    reject_when_busy_async)
+
+
+async def _build_blocks(client, user_id, content, team_domain,
+                        names=None) -> list:
+    if type(content) == list:
+        converted = await text.block_kit_mentions_to_links_async(content,
+            team_domain, client, names)
+    else:
+        converted = await text.mentions_to_links_async(content, team_domain,
+            client, names)
+
+    return views.message_blocks(user_id, converted)
+
+
+async def _lookup_profiles(client, user_id, content,
+                           policy=resolution.LOOKUP
+                           ) -> tuple[dict | None, dict]:
+    """Look up the sender's and all mentioned users' profiles at once.
+
+    See ``noping.__main__._lookup_profiles``.
+    """
+
+    mentioned = text.content_mention_user_ids(content)
+    with tracing.span("lookup_profiles", attributes={
+            "mentions": len(mentioned), "policy": policy}):
+        found = await profiles.get_profiles_async(client,
+            messages.users_to_look_up(user_id, mentioned, policy))
+    return messages.lookup_result(found, user_id, mentioned, policy,
+        profiles.cache_for(client))
+
+
+async def _post_noping_message(client, profile, user_id, blocks, trigger_id,
+                               **kwargs):
+    try:  # To show a modal if the conversation is inaccessible
+        m = await client.chat_postMessage(
+            **messages.noping_message(profile, user_id, blocks),
+            **kwargs
+        )
+    except SlackApiError as e:
+        if not messages.channel_not_found(e):
+            raise  # Slack returned a different error
+
+        # The conversation is inaccessible, show the modal
+        await client.views_open(
+            trigger_id=trigger_id,
+            view=views.cant_access_channel_view(blocks),
+        )
+    else:
+        return m
+
+
+async def _ack(ack):
+    await ack()
+
+
+async def np(client, command):
+    if command["text"].strip():
+        profile, names = await _lookup_profiles(client, command["user_id"],
+            command["text"], resolution.resolution_policy(
+                command["team_id"], command["command"]))
+        await _post_noping_message(
+            client,
+            profile,
+            command["user_id"],
+            # Everyone is resolved already
+            blocks=await _build_blocks(None, command["user_id"],
+                command["text"], command["team_domain"], names),
+            trigger_id=command["trigger_id"],
+            channel=command["channel_id"],
+        )
+    else:
+        try:
+            await client.chat_postEphemeral(
+                text=messages.NOTHING_TO_SEND_TEXT,
+                channel=command["channel_id"],
+                user=command["user_id"],
+            )
+        except SlackApiError as e:
+            if not messages.channel_not_found(e):
+                raise
+
+            await client.views_open(
+                trigger_id=command["trigger_id"],
+                view=views.nothing_to_send_view(),
+            )
+
+
+async def npp(client, command):
+    """Send an ephemeral message similar to ``/np`` for previewing."""
+
+    async def _preview_modal(reason: str, blocks_: list) -> None:
+        await client.views_open(
+            trigger_id=command["trigger_id"],
+            view=views.preview_view(reason, blocks_),
+        )
+
+    if command["text"].strip():
+        message, forced_modal = messages.preview_request(command["text"])
+        _, names = await _lookup_profiles(client, None, message,
+            resolution.resolution_policy(command["team_id"],
+                command["command"]))
+        blocks = await _build_blocks(None, command["user_id"], message,
+            command["team_domain"], names)
+
+        if forced_modal:
+            await _preview_modal(messages.FORCED_MODAL_REASON, blocks)
+            return
+        try:  # Usual method: Ephemeral message
+            await client.chat_postEphemeral(
+                blocks=views.preview_header() + blocks,
+                channel=command["channel_id"],
+                user=command["user_id"],
+            )
+        except SlackApiError as e:
+            if not messages.channel_not_found(e):
+                raise
+            # Use a modal instead
+            await _preview_modal(messages.PRIVATE_CHANNEL_REASON, blocks)
+    else:  # No text is provided
+        try:
+            await client.chat_postEphemeral(
+                text=messages.NOTHING_TO_PREVIEW_TEXT,
+                channel=command["channel_id"],
+                user=command["user_id"],
+            )
+        except SlackApiError as e:
+            if not messages.channel_not_found(e):
+                raise
+            await client.views_open(
+                trigger_id=command["trigger_id"],
+                view=views.nothing_to_preview_view(),
+            )
+
+
+async def _open_view(client, trigger_id, view, channel=None,
+                     user=None):
+    """Open a modal, or tell the user in ``channel`` that Slack is rate
+    limiting NoPing if the modal can't be opened in time.
+    """
+
+    try:
+        await client.views_open(trigger_id=trigger_id, view=view)
+    except SlackApiError as e:
+        if channel is None or not ratelimit.is_ratelimited(e):
+            raise
+        await client.chat_postEphemeral(
+            text=views.RATELIMITED_TEXT,
+            channel=channel,
+            user=user,
+        )
+
+
+async def reply_thread(client, shortcut):
+    await _open_view(client, shortcut["trigger_id"],
+        views.message_editor_view("reply_thread", "Reply in thread",
+            shortcut),
+        *messages.shortcut_origin(shortcut))
+
+
+async def handle_reply_thread(client, view, body):
+    meta, content = messages.editor_submission(view)
+
+    profile, names = await _lookup_profiles(client, body["user"]["id"],
+        content)
+    await _post_noping_message(
+        client,
+        profile,
+        body["user"]["id"],
+        blocks=await _build_blocks(
+            client,
+            body["user"]["id"],
+            content,
+            body["team"]["domain"],
+            names,
+        ),
+        trigger_id=body["trigger_id"],
+        channel=meta["ch"],
+        thread_ts=meta["ts"],
+    )
+
+
+# noinspection PyUnusedLocal
+async def delete_message(ack, shortcut, client):
+    """A stubbed function to respond to ``delete_message`` shortcuts.
+
+    See ``noping.__main__.delete_message``.
+    """
+    await ack()
+    await _open_view(client, shortcut["trigger_id"],
+        views.out_of_order_view(), *messages.shortcut_origin(shortcut))
+
+
+async def handle_delete_message(ack, client, view):
+    await ack()
+    meta = messages.view_metadata(view)
+    await client.chat_delete(
+        channel=meta["ch"],
+        ts=meta["ts"]
+    )
+
+
+async def edit_message(shortcut, client):
+    # Only messages from a bot can be NoPing's
+    bot_id = ((await identity.get_bot_identity_async(client))["bot_id"]
+              if "bot_id" in shortcut["message"] else None)
+    await _open_view(client, shortcut["trigger_id"],
+        messages.edit_message_view(shortcut, bot_id),
+        *messages.shortcut_origin(shortcut))
+
+
+async def handle_edit_message(client, view, body, logger):
+    meta, content = messages.editor_submission(view)
+
+    # Only look up users who weren't mentioned in the original message
+    names, saved = resolution.reused_names(content, meta.get("names", {}),
+        profiles.cache_for(client))
+    logger.debug(f"Reused {saved} names from the original message")
+    await client.chat_update(
+        channel=meta["ch"],
+        ts=meta["ts"],
+        blocks=await _build_blocks(client, body["user"]["id"], content,
+            body["team"]["domain"], names),
+    )
+
+
+async def handle_user_change(client, event):
+    """Keep cached profiles up to date when users change them."""
+
+    profiles.update_cached_user(event["user"], profiles.cache_for(client))
+
+
+async def handle_tokens_revoked():
+    identity.forget_bot_identities()
+
+
+def create_app() -> AsyncApp:
+    """Build the app. Building it doesn't call Slack; the bot token is
+    checked on the first request. If ``SLACK_CLIENT_ID`` is set instead
+    of ``SLACK_BOT_TOKEN``, the app can be installed in many workspaces
+    (see ``noping.workspaces``).
+
+    :return: The app
+    :rtype: AsyncApp
+    """
+
+    load_dotenv()
+    # Shared by all handlers, keeping connections to Slack open
+    client = AsyncScheduledWebClient(token=os.environ.get("SLACK_BOT_TOKEN"),
+        **async_transport.client_options_from_env())
+    registry = None
+    oauth_options = {}
+    if workspaces.oauth_enabled():
+        registry = workspaces.WorkspaceRegistry.from_env(
+            AsyncScheduledWebClient,
+            async_transport.client_options_from_env())
+        oauth_options = workspaces.oauth_options_async(client)
+    app = AsyncApp(
+        client=client,
+        signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
+        **oauth_options,
+    )
+    # Listeners only ack; the work runs as bounded background tasks
+    lazy_listener_runner = AsyncWorkerLazyListenerRunner.from_env(
+        app.logger)
+    app.listener_runner.lazy_listener_runner = lazy_listener_runner
+
+    metrics.register_app_stats(app.client, lazy_listener_runner.stats,
+        profiles.async_profile_flight, registry)
+    app.async_dispatch = tracing.traced_dispatch(
+        metrics.timed_dispatch(app.async_dispatch))
+
+    # After Bolt's signature verification and authorization
+    app.middleware(tracing.trace_request_async)
+    # Redelivered requests are answered without running any listener
+    app.middleware(idempotency.skip_duplicates_async)
+
+    @app.middleware
+    async def _use_scheduled_client(context, next):
+        # Bolt creates a plain AsyncWebClient for every request otherwise
+        if registry is None:
+            context["client"] = app.client
+        elif context.bot_token:
+            context["client"] = registry.client(
+                workspaces.workspace_id(context), context.bot_token)
+        await next()
+
+    async def _forget_workspace(context, next):
+        identity.forget_bot_identities(context.team_id)
+        registry.forget(workspaces.workspace_id(context))
+        await next()
+
+    # Lazy listeners tell the user to try again when the pool is full
+    busy = [reject_when_busy_async(lazy_listener_runner)]
+    app.command("/np", middleware=busy)(ack=_ack, lazy=[np])
+    app.command("/npp", middleware=busy)(ack=_ack, lazy=[npp])
+    app.message_shortcut("reply_thread", middleware=busy)(ack=_ack,
+        lazy=[reply_thread])
+    app.view("reply_thread", middleware=busy)(ack=_ack,
+        lazy=[handle_reply_thread])
+    app.message_shortcut("delete_message")(delete_message)
+    app.view("delete_message")(handle_delete_message)
+    app.message_shortcut("edit_message", middleware=busy)(ack=_ack,
+        lazy=[edit_message])
+    app.view("edit_message", middleware=busy)(ack=_ack,
+        lazy=[handle_edit_message])
+    app.event("team_join")(handle_user_change)
+    app.event("user_change")(handle_user_change)
+    if registry is None:
+        app.event("tokens_revoked")(handle_tokens_revoked)
+    else:
+        # Bolt's listeners delete the installations
+        app.event("tokens_revoked", middleware=[_forget_workspace])(
+            app.default_tokens_revoked_event_listener())
+        app.event("app_uninstalled", middleware=[_forget_workspace])(
+            app.default_app_uninstalled_event_listener())
+    return app
+
+
+_default_app = None
+_default_app_lock = threading.Lock()
+
+
+def default_app() -> AsyncApp:
+    """Get the process-wide app, building it on first use.
+
+    :return: The shared app
+    :rtype: AsyncApp
+    """
+
+    global _default_app
+    if _default_app is None:
+        with _default_app_lock:
+            if _default_app is None:
+                _default_app = create_app()
+    return _default_app
+
+
+_asgi_handler = None
+
+
+async def asgi_app(scope, receive, send) -> None:
+    """ASGI app serving ``default_app()``, which is built on the first
+    request.
+    """
+
+    global _asgi_handler
+    if _asgi_handler is None:
+        _asgi_handler = AsyncSlackRequestHandler(default_app())
+    await _asgi_handler(scope, receive, send)
+
+
+async def _warm_up(app: AsyncApp) -> None:
+    try:
+        added = await warmup.warm_profile_cache_async(app.client)
+    except Exception as e:
+        app.logger.warning(f"Profile cache warm-up failed ({e})")
+    else:
+        app.logger.info(f"Profile cache warm-up added {added} profiles")
+
+
+async def start_socket_mode() -> None:
+    """Serve the app in socket mode until SIGTERM or SIGINT (see
+    ``noping.async_socket_mode``), warming up the profile cache and
+    logging metrics in the background.
+    """
+
+    app = default_app()
+    warmup_task = (asyncio.create_task(_warm_up(app))
+                   if warmup.warmup_enabled() else None)
+    metrics.start_log_thread(app.logger)
+    try:
+        await AsyncSocketModeRunner.from_env(app).start()
+    finally:
+        if warmup_task is not None:  # Don't keep filling a closing pool
+            warmup_task.cancel()
+        await app.client.pool.close()
+
+
+if __name__ == "__main__":  # Like noping.async_socket_mode
+    load_dotenv()
+    asyncio.run(start_socket_mode())
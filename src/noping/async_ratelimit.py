@@ -0,0 +1,27 @@
+"""Slack API rate limiting functions for the asyncio app.
+
+See ``noping.ratelimit``.
+"""
+
+from noping import metrics, tracing
+from noping.async_transport import AsyncPooledWebClient
+from noping.ratelimit import RateLimitScheduler, default_scheduler
+
+
+class AsyncScheduledWebClient(AsyncPooledWebClient):
+    """An ``AsyncPooledWebClient`` whose calls all go through a
+    ``RateLimitScheduler``.
+    """
+
+    def __init__(self, *args, scheduler: RateLimitScheduler = None,
+                 profile_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler or default_scheduler()
+        # The workspace's own profile cache (see profiles.cache_for)
+        self.profile_cache = profile_cache
+
+    async def api_call(self, api_method: str, **kwargs):
+        with (metrics.slack_api_call(api_method),
+              tracing.slack_api_span(api_method, kwargs)):
+            return await self.scheduler.call_async(api_method,
+                super().api_call, api_method, **kwargs)
@@ -0,0 +1,140 @@
+"""Socket mode functions for the asyncio app.
+
+See ``noping.socket_mode``. Run it with
+``python -m noping.async_socket_mode``.
+"""
+
+import asyncio
+import os
+import signal
+import time
+
+from slack_bolt.adapter.socket_mode.async_handler import (
+    AsyncSocketModeHandler)
+
+from noping import tracing
+from noping.socket_mode import MAX_CONNECTIONS
+
+
+class AsyncSocketModeRunner:
+    """Keeps several socket mode connections open for an ``AsyncApp``."""
+
+    def __init__(self, app, app_token: str = None, connections: int = 2,
+                 ping_interval: float = 5.0, shutdown_timeout: float = 30.0,
+                 handler_class=AsyncSocketModeHandler):
+        """
+        :param app: The Bolt app
+        :type app: slack_bolt.async_app.AsyncApp
+        :param app_token: App-level token. If None, use
+        ``SLACK_APP_TOKEN``.
+        :type app_token: str
+        :param connections: Number of connections to open (1-10)
+        :type connections: int
+        :param ping_interval: Seconds between pings checking a connection
+        :type ping_interval: float
+        :param shutdown_timeout: Seconds to wait for work in progress
+        when stopping
+        :type shutdown_timeout: float
+        :param handler_class: Bolt socket mode handler to use
+        """
+
+        if not 1 <= connections <= MAX_CONNECTIONS:
+            raise ValueError(
+                f"connections must be between 1 and {MAX_CONNECTIONS}")
+
+        self.app = app
+        self.app_token = app_token or os.environ["SLACK_APP_TOKEN"]
+        self.connections = connections
+        self.ping_interval = ping_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.handler_class = handler_class
+        self.handlers = []
+        self._stopped = None
+
+    @classmethod
+    def from_env(cls, app, app_token: str = None
+                 ) -> "AsyncSocketModeRunner":
+        """Create a runner configured by ``NOPING_SOCKET_CONNECTIONS``,
+        ``NOPING_SOCKET_PING_INTERVAL`` and ``NOPING_SHUTDOWN_TIMEOUT``.
+
+        :param app: The Bolt app
+        :type app: slack_bolt.async_app.AsyncApp
+        :param app_token: App-level token. If None, use
+        ``SLACK_APP_TOKEN``.
+        :type app_token: str
+        :return: A new runner
+        :rtype: AsyncSocketModeRunner
+        """
+
+        return cls(
+            app,
+            app_token,
+            connections=int(os.environ.get("NOPING_SOCKET_CONNECTIONS", 2)),
+            ping_interval=float(os.environ.get(
+                "NOPING_SOCKET_PING_INTERVAL", 5)),
+            shutdown_timeout=float(os.environ.get("NOPING_SHUTDOWN_TIMEOUT",
+                30)),
+        )
+
+    async def connect(self) -> None:
+        """Open all connections."""
+
+        handlers = [
+            self.handler_class(self.app, self.app_token,
+                ping_interval=self.ping_interval)
+            for _ in range(self.connections)
+        ]
+        await asyncio.gather(*(handler.connect_async()
+                               for handler in handlers))
+        self.handlers += handlers
+        self.app.logger.info(
+            f"Opened {self.connections} socket mode connections")
+
+    async def start(self) -> None:
+        """Open all connections and serve requests until ``stop()`` is
+        called or SIGTERM or SIGINT is received.
+        """
+
+        self._stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # Not supported here, e.g. outside the main thread
+        await self.connect()
+        try:
+            await self._stopped.wait()
+        finally:
+            await self.close()
+
+    def stop(self) -> None:
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def close(self) -> None:
+        """Close all connections, then wait up to ``shutdown_timeout``
+        seconds for queued and running lazy listeners.
+        """
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        await asyncio.gather(*(handler.close_async()
+                               for handler in self.handlers))
+        self.handlers = []
+
+        runner = self.app.listener_runner.lazy_listener_runner
+        if hasattr(runner, "drain") and not await runner.drain(
+                max(0.0, deadline - time.monotonic())):
+            self.app.logger.warning(
+                f"Stopped with {runner.stats.depth()} listeners unfinished")
+        tracing.default_tracer().flush()
+
+
+def main() -> None:
+    from noping.async_app import start_socket_mode
+
+    asyncio.run(start_socket_mode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Pooled HTTP transport functions for the asyncio app.
+
+See ``noping.transport``. ``AsyncWebClient`` opens a new ``aiohttp``
+session (and so new connections) for every API call unless it's given
+one; these functions share one session per event loop instead.
+
+As with ``noping.transport``, a failed request is only sent again if
+Slack can't have acted on it.
+"""
+
+import asyncio
+import os
+import threading
+
+import aiohttp
+from slack_sdk.http_retry.builtin_async_handlers import (
+    AsyncConnectionErrorRetryHandler, AsyncServerErrorRetryHandler)
+from slack_sdk.web.async_client import AsyncWebClient
+
+from noping.transport import IDEMPOTENT_METHODS, ConnectionStats, api_method
+
+
+class SessionPool:
+    """Shares a keep-alive ``aiohttp`` session with a bounded connection
+    pool.
+    """
+
+    def __init__(self, maxsize: int = 100, idle_timeout: float = 50.0,
+                 timeout: float = 30):
+        """
+        :param maxsize: Maximum number of connections open at once
+        :type maxsize: int
+        :param idle_timeout: Seconds after which an idle connection is
+        closed
+        :type idle_timeout: float
+        :param timeout: Total timeout of a request in seconds
+        :type timeout: float
+        """
+
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stats = ConnectionStats()
+        self._session = None
+        self._loop = None
+        self._closing = set()
+
+    @classmethod
+    def from_env(cls) -> "SessionPool":
+        """Create a pool configured by ``NOPING_HTTP_POOL_SIZE``,
+        ``NOPING_HTTP_IDLE_TIMEOUT`` and ``NOPING_HTTP_TIMEOUT``.
+
+        :return: A new pool
+        :rtype: SessionPool
+        """
+
+        return cls(
+            maxsize=int(os.environ.get("NOPING_HTTP_POOL_SIZE", 100)),
+            idle_timeout=float(os.environ.get("NOPING_HTTP_IDLE_TIMEOUT",
+                50)),
+            timeout=float(os.environ.get("NOPING_HTTP_TIMEOUT", 30)),
+        )
+
+    def __deepcopy__(self, memo):
+        # Bolt copies the client for lazy listeners; the session must
+        # stay shared
+        return self
+
+    async def _on_connection_create(self, session, context, params):
+        self.stats.record_request(reused=False)
+
+    async def _on_connection_reuse(self, session, context, params):
+        self.stats.record_request(reused=True)
+
+    def session(self) -> aiohttp.ClientSession:
+        """Get the session of the running event loop, creating it the
+        first time.
+
+        :return: The shared session
+        :rtype: aiohttp.ClientSession
+        """
+
+        loop = asyncio.get_running_loop()
+        if (self._session is None or self._session.closed
+                or self._loop is not loop):
+            if self._session is not None and not self._session.closed:
+                self._retire(self._session, self._loop)
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._on_connection_create)
+            trace.on_connection_reuseconn.append(self._on_connection_reuse)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.maxsize,
+                    keepalive_timeout=self.idle_timeout),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                trace_configs=[trace],
+            )
+            self._loop = loop
+        return self._session
+
+    def _retire(self, session: aiohttp.ClientSession, loop) -> None:
+        # Close the session of another event loop, on that loop if it's
+        # still running in another thread
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+            return
+        task = asyncio.create_task(_close_retired(session))
+        self._closing.add(task)  # Tasks are only weakly referenced
+        task.add_done_callback(self._closing.discard)
+
+    async def close(self) -> None:
+        """Close the session and its connections."""
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+async def _close_retired(session: aiohttp.ClientSession) -> None:
+    try:
+        await session.close()
+    except RuntimeError:  # Its loop stopped; its connections went with it
+        pass
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_session_pool() -> SessionPool:
+    """Get the process-wide session pool, creating it from the
+    environment on first use.
+
+    :return: The shared session pool
+    :rtype: SessionPool
+    """
+
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = SessionPool.from_env()
+    return _default_pool
+
+
+class AsyncSafeConnectionErrorRetryHandler(
+        AsyncConnectionErrorRetryHandler):
+    """Retries connection errors only if Slack can't have acted on the
+    request: it couldn't connect or its API method is idempotent.
+    """
+
+    async def _can_retry_async(self, *, state, request, response=None,
+                               error=None) -> bool:
+        if not (isinstance(error, aiohttp.ClientConnectorError)
+                or api_method(request.url) in IDEMPOTENT_METHODS):
+            return False
+        return await super()._can_retry_async(state=state, request=request,
+            response=response, error=error)
+
+
+def client_options_from_env() -> dict:
+    """Get ``AsyncWebClient`` options configured by the same environment
+    variables as ``noping.transport.client_options_from_env``.
+
+    :return: ``base_url``, ``timeout`` and ``retry_handlers``
+    :rtype: dict
+    """
+
+    return {
+        # Only meant for pointing NoPing at a stand-in for testing
+        "base_url": os.environ.get("NOPING_SLACK_API_URL",
+            "https://slack.com/api/"),
+        "timeout": int(os.environ.get("NOPING_HTTP_TIMEOUT", 30)),
+        "retry_handlers": [
+            AsyncSafeConnectionErrorRetryHandler(
+                max_retry_count=int(os.environ.get("NOPING_HTTP_RETRIES", 1))),
+            AsyncServerErrorRetryHandler(max_retry_count=int(
+                os.environ.get("NOPING_HTTP_SERVER_ERROR_RETRIES", 0))),
+        ],
+    }
+
+
+class AsyncPooledWebClient(AsyncWebClient):
+    """An ``AsyncWebClient`` that uses the session of a
+    ``SessionPool``.
+    """
+
+    def __init__(self, *args, pool: SessionPool = None, **kwargs):
+        # Instead of slack_sdk's default, which retries any request
+        kwargs.setdefault("retry_handlers",
+            [AsyncSafeConnectionErrorRetryHandler()])
+        self.pool = pool or default_session_pool()
+        super().__init__(*args, **kwargs)
+
+    @property
+    def session(self) -> aiohttp.ClientSession | None:
+        """The ``session`` option of ``AsyncWebClient``, which sends every
+        request with it: the session passed in, or else the pool's session
+        of the running event loop.
+        """
+
+        if self._session is not None:
+            return self._session
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:  # Sessions belong to an event loop
+            return None
+        return self.pool.session()
+
+    @session.setter
+    def session(self, session: aiohttp.ClientSession | None) -> None:
+        self._session = session
@@ -0,0 +1,156 @@
+"""Background processing functions for the asyncio app.
+
+See ``noping.worker``.
+"""
+
+import asyncio
+import os
+import time
+from logging import Logger
+
+from slack_bolt import BoltResponse
+from slack_bolt.lazy_listener.async_internals import to_runnable_function
+from slack_bolt.lazy_listener.async_runner import AsyncLazyListenerRunner
+
+from noping import metrics, tracing, views
+from noping.worker import (RESERVATION_KEY, Reservation, WorkerStats,
+    track_errors)
+
+
+class AsyncWorkerLazyListenerRunner(AsyncLazyListenerRunner):
+    """Runs Bolt lazy listeners as asyncio tasks, with at most
+    ``max_running`` at once and ``max_queue`` waiting.
+    """
+
+    def __init__(self, logger: Logger, max_running: int = 100,
+                 max_queue: int = 1000):
+        self.logger = logger
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.stats = WorkerStats()
+        self._semaphore = None
+        self._reserved = 0  # Slots held by reservations and tasks
+        self._tasks = set()
+
+    @classmethod
+    def from_env(cls, logger: Logger) -> "AsyncWorkerLazyListenerRunner":
+        return cls(
+            logger,
+            max_running=int(os.environ.get("NOPING_WORKERS", 100)),
+            max_queue=int(os.environ.get("NOPING_WORKER_QUEUE", 1000)),
+        )
+
+    def reserve(self) -> Reservation | None:
+        """Reserve a slot for a listener that will be started with the
+        reservation in its request context.
+
+        :return: The reservation, or None if the queue is full
+        :rtype: Reservation | None
+        """
+
+        if self._reserved >= self.max_running + self.max_queue:
+            return None
+        self._reserved += 1
+        return Reservation(self._release)
+
+    def _release(self) -> None:
+        self._reserved -= 1
+
+    def start(self, function, request) -> None:
+        # The request is acknowledged already, so without a reserved
+        # slot it queues past the bound instead of being dropped
+        reservation = request.context.get(RESERVATION_KEY)
+        slot = reservation is not None and reservation.take()
+
+        if self._semaphore is None:  # Created in the running loop
+            self._semaphore = asyncio.Semaphore(self.max_running)
+        self.stats.record_queued()
+        task = asyncio.ensure_future(
+            self._run(function, request, time.monotonic()))
+        # The loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if slot:
+            task.add_done_callback(lambda _: self._release())
+
+    async def _run(self, function, request, queued_at: float) -> None:
+        async with self._semaphore:
+            started_at = time.monotonic()
+            self.stats.record_started(started_at - queued_at)
+            errors = []
+            try:
+                with tracing.attach(request.context.get(
+                        tracing.CONTEXT_KEY)):
+                    await to_runnable_function(
+                        internal_func=track_errors(
+                            metrics.instrument_listener(
+                                tracing.trace_listener(function)), errors),
+                        logger=self.logger,
+                        request=request,
+                    )
+            finally:
+                # to_runnable_function logs the listener's error itself
+                self.stats.record_finished(time.monotonic() - started_at,
+                    bool(errors))
+
+    async def drain(self, timeout: float = None) -> bool:
+        """Wait for all queued and running listeners to finish.
+
+        :param timeout: Seconds to wait at most. If None, wait until
+        they finish.
+        :type timeout: float
+        :return: True if all listeners finished
+        :rtype: bool
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._tasks:
+            remaining = (None if deadline is None
+                         else deadline - time.monotonic())
+            if remaining is not None and remaining <= 0:
+                return False
+            await asyncio.wait(set(self._tasks), timeout=remaining)
+        return True
+
+
+async def busy_response_async(body: dict, client) -> BoltResponse:
+    """Tell a user that NoPing is too busy to handle their request.
+
+    This is the same as ``noping.worker.busy_response`` but for an
+    ``AsyncWebClient``.
+
+    :param body: Request body
+    :type body: dict
+    :param client: Async Slack client
+    :return: The acknowledgement
+    :rtype: BoltResponse
+    """
+
+    response_body = views.busy_response_body(body)
+    if response_body is None:
+        await client.views_open(trigger_id=body["trigger_id"],
+            view=views.busy_view())
+        return BoltResponse(status=200, body="")
+    return BoltResponse(status=200, body=response_body)
+
+
+def reject_when_busy_async(runner: AsyncWorkerLazyListenerRunner):
+    """Create a Bolt listener middleware that answers requests with
+    ``busy_response_async`` when the runner is full.
+
+    See ``noping.worker.reject_when_busy``.
+
+    :param runner: The runner of the listener's lazy functions
+    :type runner: AsyncWorkerLazyListenerRunner
+    :return: The middleware
+    """
+
+    async def _reject_when_busy(body, client, context, next):
+        reservation = runner.reserve()
+        if reservation is None:
+            runner.stats.record_rejected()
+            return await busy_response_async(body, client)
+        context[RESERVATION_KEY] = reservation
+        return await next()
+
+    return _reject_when_busy
@@ -1,17 +1,90 @@
+"""NoPing as a WSGI app.
+
+``create_flask_app()`` builds the app and starts the profile cache
+warm-up right away, so run it as each worker starts, e.g.
+``gunicorn 'noping.flask_app:create_flask_app()'``. ``flask_app`` only
+builds them on its first request, so importing this module never does
+anything but define routes.
+"""
+
+import hmac
+import os
+import threading
+
 from slack_bolt.adapter.flask import SlackRequestHandler
-from flask import Flask, request
+from flask import Flask, Response, request
+
+from noping import metrics, warmup
+from noping.__main__ import default_app
+
+_handler = None
+_handler_lock = threading.Lock()
 
-from noping.__main__ import app
 
-flask_app = Flask(__name__)
-handler = SlackRequestHandler(app)
+def _get_handler() -> SlackRequestHandler:
+    # Building the app doesn't call Slack; the warm-up runs in the
+    # background
+    global _handler
+    if _handler is None:
+        with _handler_lock:
+            if _handler is None:
+                app = default_app()
+                warmup.start_warmup(app.client, app.logger)
+                _handler = SlackRequestHandler(app)
+    return _handler
 
 
-@flask_app.route("/slack/events", methods=["POST"])
 def slack_events():
     # handler runs App's dispatch method
-    return handler.handle(request)
+    return _get_handler().handle(request)
+
+
+# Installing in other workspaces (see noping.workspaces)
+def slack_oauth():
+    return _get_handler().handle(request)
+
+
+def metrics_endpoint():
+    # Only served with NOPING_METRICS_TOKEN as a bearer token
+    token = os.environ.get("NOPING_METRICS_TOKEN")
+    if not token:
+        return Response("Not found", status=404)
+    if not hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(),
+            f"Bearer {token}".encode()):
+        return Response("Unauthorized", status=401,
+            headers={"WWW-Authenticate": "Bearer"})
+
+    _get_handler()  # Registers the app's stats
+    return Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+
+
+def _add_routes(flask: Flask) -> Flask:
+    flask.add_url_rule("/slack/events", view_func=slack_events,
+        methods=["POST"])
+    flask.add_url_rule("/slack/install", view_func=slack_oauth,
+        methods=["GET"])
+    flask.add_url_rule("/slack/oauth_redirect", view_func=slack_oauth,
+        methods=["GET"])
+    flask.add_url_rule("/metrics", view_func=metrics_endpoint,
+        methods=["GET"])
+    return flask
+
+
+def create_flask_app() -> Flask:
+    """Build the Flask app, building the Bolt app and starting the
+    profile cache warm-up now instead of on the first request.
+
+    :return: The Flask app
+    :rtype: Flask
+    """
+
+    _get_handler()
+    return _add_routes(Flask(__name__))
+
+
+flask_app = _add_routes(Flask(__name__))
 
 
 if __name__ == "__main__":
-    flask_app.run(debug=True)
+    create_flask_app().run(debug=True)
@@ -0,0 +1,209 @@
+"""Duplicate delivery functions.
+
+Slack redelivers a request when the response is slow (HTTP) or isn't
+acknowledged (socket mode). NoPing can't delete the messages it posts
+(see ``delete_message``), so a redelivered ``/np`` would post a
+permanent duplicate. The middlewares here remember every delivery for a
+while and answer redeliveries right away without running any listener.
+
+Deliveries are only remembered by the process that handled them: with
+several processes behind a load balancer, a redelivery that reaches
+another one is run again. Socket mode sends it over the connection of
+the same process unless that connection is gone.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from slack_bolt import BoltResponse
+
+
+class IdempotencyStore:
+    """A size-bounded, time-windowed set of delivery keys."""
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 600.0,
+                 clock=time.monotonic):
+        """
+        :param maxsize: Maximum number of keys to remember
+        :type maxsize: int
+        :param ttl: Seconds to remember a key for
+        :type ttl: float
+        :param clock: Function returning the current time in seconds
+        """
+
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._keys = OrderedDict()  # key -> expires_at, oldest first
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.suppressed = 0
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls) -> "IdempotencyStore":
+        """Create a store configured by ``NOPING_IDEMPOTENCY_SIZE`` and
+        ``NOPING_IDEMPOTENCY_TTL``. The store only covers this process.
+
+        :return: A new store
+        :rtype: IdempotencyStore
+        """
+
+        return cls(
+            maxsize=int(os.environ.get("NOPING_IDEMPOTENCY_SIZE", 10000)),
+            ttl=float(os.environ.get("NOPING_IDEMPOTENCY_TTL", 600)),
+        )
+
+    def _expire(self, now: float) -> None:
+        # Every key has the same TTL, so the oldest keys expire first
+        while self._keys:
+            key, expires_at = next(iter(self._keys.items()))
+            if expires_at > now:
+                break
+            del self._keys[key]
+
+    def check(self, key: str, retry: bool = False) -> bool:
+        """Remember a delivery key.
+
+        :param key: Key of the delivery (see ``delivery_key``)
+        :type key: str
+        :param retry: Whether Slack marked the delivery as a retry
+        :type retry: bool
+        :return: True if the key was seen before, i.e. the delivery is a
+        duplicate
+        :rtype: bool
+        """
+
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            self.checked += 1
+            if retry:
+                self.retries += 1
+            if key in self._keys:
+                self.suppressed += 1
+                return True
+
+            self._keys[key] = now + self.ttl
+            if len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+            return False
+
+    def forget(self, key: str) -> None:
+        """Forget a delivery key so it's processed if it's delivered
+        again.
+
+        :param key: Key of the delivery
+        :type key: str
+        """
+
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def stats(self) -> dict:
+        """Get the number of deliveries checked and suppressed.
+
+        :return: ``keys``, ``checked``, ``retries`` (deliveries marked as
+        retries by Slack) and ``suppressed`` (duplicates)
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {
+                "keys": len(self._keys),
+                "checked": self.checked,
+                "retries": self.retries,
+                "suppressed": self.suppressed,
+            }
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def default_idempotency_store() -> IdempotencyStore:
+    """Get the process-wide store, creating it from the environment on
+    first use.
+
+    :return: The shared store
+    :rtype: IdempotencyStore
+    """
+
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = IdempotencyStore.from_env()
+    return _default_store
+
+
+def delivery_key(body: dict) -> str | None:
+    """Get the key identifying a delivery, which is the same every time
+    Slack delivers it.
+
+    :param body: Request body
+    :type body: dict
+    :return: The event ID, trigger ID or view ID and hash, or None if
+    the request has none of them
+    :rtype: str | None
+    """
+
+    if "event_id" in body:
+        return "event:" + body["event_id"]
+    if "trigger_id" in body:
+        return "trigger:" + body["trigger_id"]
+    view = body.get("view")
+    if view and "id" in view:
+        return f"view:{view['id']}:{view.get('hash', '')}"
+    return None
+
+
+def _retry_num(request) -> int:
+    # Only sent over HTTP; socket mode redeliveries are just duplicates
+    values = request.headers.get("x-slack-retry-num")
+    return int(values[0]) if values else 0
+
+
+def is_duplicate(request, store: IdempotencyStore = None) -> bool:
+    """Check whether a Bolt request was delivered before.
+
+    :param request: Bolt request
+    :param store: Store to use. If None, use the shared store.
+    :type store: IdempotencyStore
+    :return: True if the request is a duplicate
+    :rtype: bool
+    """
+
+    key = delivery_key(request.body)
+    if key is None:
+        return False
+    if store is None:
+        store = default_idempotency_store()
+    return store.check(key, retry=_retry_num(request) > 0)
+
+
+def skip_duplicates(req, next):
+    """Bolt middleware answering duplicate deliveries right away."""
+
+    if is_duplicate(req):
+        return BoltResponse(status=200, body="")
+    return next()
+
+
+async def skip_duplicates_async(req, next):
+    """Bolt middleware answering duplicate deliveries right away.
+
+    This is the same as ``skip_duplicates`` but for ``AsyncApp``.
+    """
+
+    if is_duplicate(req):
+        return BoltResponse(status=200, body="")
+    return await next()
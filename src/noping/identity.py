@@ -0,0 +1,152 @@
+"""Bot identity functions.
+
+NoPing's own bot ID never changes for a given token, so ``auth.test`` is
+called once per token instead of on every ownership check. Identities
+are kept by a hash of the token, for up to ``NOPING_MAX_WORKSPACES``
+tokens, and concurrent first lookups share one call.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from noping.singleflight import AsyncSingleFlight, SingleFlight
+
+_identities = OrderedDict()  # token hash -> identity
+_lock = threading.Lock()
+
+identity_flight = SingleFlight()
+async_identity_flight = AsyncSingleFlight()
+
+
+def _token_key(token: str) -> str:
+    # Tokens themselves aren't kept, e.g. to show up in a heap dump
+    return hashlib.sha256((token or "").encode()).hexdigest()
+
+
+def _to_identity(data) -> dict:
+    return {
+        "bot_id": data["bot_id"],
+        "user_id": data["user_id"],
+        "team_id": data["team_id"],
+    }
+
+
+def _cached(key: str) -> dict | None:
+    with _lock:
+        identity = _identities.get(key)
+        if identity is not None:
+            _identities.move_to_end(key)
+        return identity
+
+
+def _store(key: str, identity: dict) -> None:
+    maxsize = max(1, int(os.environ.get("NOPING_MAX_WORKSPACES", 1000)))
+    with _lock:
+        _identities[key] = identity
+        _identities.move_to_end(key)
+        while len(_identities) > maxsize:
+            # Drop the least recently used one
+            _identities.popitem(last=False)
+
+
+def get_bot_identity(client) -> dict:
+    """Get the bot's identity, calling ``auth.test`` only the first time
+    for each token.
+
+    :param client: Slack client with the bot token
+    :return: ``bot_id``, ``user_id`` (bot user ID) and ``team_id``
+    :rtype: dict
+    """
+
+    key = _token_key(client.token)
+    identity = _cached(key)
+    if identity is None:
+        identity = identity_flight.do(key, refresh_bot_identity, client)
+    return identity
+
+
+def refresh_bot_identity(client) -> dict:
+    """Look up the bot's identity again, e.g. after rotating the token.
+
+    :param client: Slack client with the bot token
+    :return: ``bot_id``, ``user_id`` (bot user ID) and ``team_id``
+    :rtype: dict
+    """
+
+    identity = _to_identity(client.auth_test().data)
+    _store(_token_key(client.token), identity)
+    return identity
+
+
+async def get_bot_identity_async(client) -> dict:
+    """Get the bot's identity, calling ``auth.test`` only the first time
+    for each token.
+
+    This is the same as ``get_bot_identity`` but for an
+    ``AsyncWebClient``.
+
+    :param client: Async Slack client with the bot token
+    :return: ``bot_id``, ``user_id`` (bot user ID) and ``team_id``
+    :rtype: dict
+    """
+
+    key = _token_key(client.token)
+    identity = _cached(key)
+    if identity is None:
+        identity = await async_identity_flight.do(key,
+            refresh_bot_identity_async, client)
+    return identity
+
+
+async def refresh_bot_identity_async(client) -> dict:
+    """Look up the bot's identity again, e.g. after rotating the token.
+
+    This is the same as ``refresh_bot_identity`` but for an
+    ``AsyncWebClient``.
+
+    :param client: Async Slack client with the bot token
+    :return: ``bot_id``, ``user_id`` (bot user ID) and ``team_id``
+    :rtype: dict
+    """
+
+    identity = _to_identity((await client.auth_test()).data)
+    _store(_token_key(client.token), identity)
+    return identity
+
+
+def forget_bot_identities(team_id: str = None) -> None:
+    """Forget cached identities, e.g. after tokens are revoked.
+
+    :param team_id: Only forget the identities of this team's tokens. If
+    None, forget all of them.
+    :type team_id: str
+    """
+
+    with _lock:
+        if team_id is None:
+            _identities.clear()
+            return
+        for key in [key for key, identity in _identities.items()
+                    if identity["team_id"] == team_id]:
+            del _identities[key]
+
+
+def stats() -> dict:
+    """Get the number of cached identities and ``auth.test`` calls.
+
+    :return: ``cached``, ``calls`` (actually made) and ``shared``
+    (coalesced)
+    :rtype: dict
+    """
+
+    flights = identity_flight.stats()
+    async_flights = async_identity_flight.stats()
+    with _lock:
+        cached = len(_identities)
+    return {
+        "cached": cached,
+        "calls": flights["calls"] + async_flights["calls"],
+        "shared": flights["shared"] + async_flights["shared"],
+    }
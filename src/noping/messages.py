@@ -0,0 +1,194 @@
+"""Message functions shared by the app and the asyncio app.
+
+``noping.__main__`` and ``noping.async_app`` only differ in how they
+call Slack. Which users they look up, what they post and what they tell
+the user is decided here.
+"""
+
+from json import loads
+
+from slack_sdk.errors import SlackApiError
+
+from noping import profiles, resolution, text, views
+
+NOTHING_TO_SEND_TEXT = ("There's nothing for me to send!"
+                        " Use `/np <message>` to send a message without"
+                        r" pings, and use `@... \` in your message to"
+                        " escape a ping.")
+NOTHING_TO_PREVIEW_TEXT = ("I can't preview an empty string."
+                           " Check `/np` for usage.")
+FORCED_MODAL_REASON = ("You're seeing this because you used `/npp -m`."
+                       " Without `-m`, this would display as an ephemeral"
+                       " message.")
+PRIVATE_CHANNEL_REASON = ("You're seeing this because NoPing is not in"
+                          " this private channel.")
+
+
+def channel_not_found(e: SlackApiError) -> bool:
+    """Check whether a call failed because NoPing can't access the
+    conversation, so a modal has to be shown instead.
+
+    :param e: The error of the call
+    :type e: SlackApiError
+    :return: Whether Slack returned ``channel_not_found``
+    :rtype: bool
+    """
+
+    return e.response["error"] == "channel_not_found"
+
+
+def users_to_look_up(user_id: str | None, mentioned: list,
+                     policy: str = resolution.LOOKUP) -> list:
+    """Get the users whose profiles a message needs.
+
+    :param user_id: User ID of the sender, or None to only resolve
+    mentions
+    :type user_id: str | None
+    :param mentioned: User IDs of the mentioned users
+    :type mentioned: list
+    :param policy: Resolution policy (see ``noping.resolution``); only
+    ``lookup`` looks up mentioned users
+    :type policy: str
+    :return: User IDs to look up
+    :rtype: list
+    """
+
+    senders = [user_id] if user_id else []
+    return senders + mentioned if policy == resolution.LOOKUP else senders
+
+
+def lookup_result(found: dict, user_id: str | None, mentioned: list,
+                  policy: str, cache: profiles.ProfileCache
+                  ) -> tuple[dict | None, dict]:
+    """Get the sender's profile and the names of mentioned users from
+    the profiles of ``users_to_look_up``.
+
+    :param found: Profiles by user ID
+    :type found: dict
+    :param user_id: User ID of the sender, or None
+    :type user_id: str | None
+    :param mentioned: User IDs of the mentioned users
+    :type mentioned: list
+    :param policy: Resolution policy
+    :type policy: str
+    :param cache: Profile cache of the workspace, for ``cached``
+    :type cache: ProfileCache
+    :return: The sender's profile (None without ``user_id``, named after
+    the user ID if it can't be looked up) and profile names of mentioned
+    users
+    :rtype: tuple[dict | None, dict]
+    """
+
+    if policy == resolution.LOOKUP:
+        # Users that can't be looked up keep their embedded username
+        names = {
+            mentioned_id: profiles.profile_name(found[mentioned_id])
+            for mentioned_id in mentioned if mentioned_id in found
+        }
+    elif policy == resolution.CACHED:
+        names = resolution.cached_names(mentioned, cache)
+    else:
+        names = {}
+
+    if user_id and user_id not in found:  # The sender can't be looked up
+        return profiles.unknown_profile(user_id), names
+    return found.get(user_id), names
+
+
+def noping_message(profile: dict, user_id: str, blocks: list) -> dict:
+    """Build the ``chat.postMessage`` arguments of a message posted as
+    its sender.
+
+    :param profile: The sender's profile
+    :type profile: dict
+    :param user_id: User ID of the sender
+    :type user_id: str
+    :param blocks: Message blocks (see ``views.message_blocks``)
+    :type blocks: list
+    :return: ``text``, ``blocks``, ``username`` and ``icon_url``
+    :rtype: dict
+    """
+
+    message = {
+        "text": f"*<@{user_id}>*: ...",
+        "blocks": blocks,
+        "username": profiles.profile_name(profile),
+    }
+    if profile["image_512"]:  # Unknown senders get the app's icon
+        message["icon_url"] = profile["image_512"]
+    return message
+
+
+def preview_request(command_text: str) -> tuple[str, bool]:
+    """Parse the text of ``/npp``.
+
+    :param command_text: Text of the command
+    :type command_text: str
+    :return: The message to preview and whether the user forces a modal
+    with ``-m``
+    :rtype: tuple[str, bool]
+    """
+
+    if command_text.strip()[:3] == "-m ":
+        return command_text.replace("-m ", "", 1), True
+    return command_text, False
+
+
+def shortcut_origin(shortcut: dict) -> tuple[str, str]:
+    """Get where a shortcut was used, to tell the user something there.
+
+    :param shortcut: Shortcut payload
+    :type shortcut: dict
+    :return: Channel ID and user ID
+    :rtype: tuple[str, str]
+    """
+
+    return shortcut["channel"]["id"], shortcut["user"]["id"]
+
+
+def view_metadata(view: dict) -> dict:
+    """Get which message a modal was opened for.
+
+    :param view: Submitted modal
+    :type view: dict
+    :return: Its metadata (``ch``, ``ts`` and, for message editors,
+    ``names``)
+    :rtype: dict
+    """
+
+    return loads(view["private_metadata"])
+
+
+def editor_submission(view: dict) -> tuple[dict, str | list]:
+    """Get what a message editor was opened for and the message.
+
+    :param view: Submitted message editor (see
+    ``views.message_editor_view``)
+    :type view: dict
+    :return: Its metadata (see ``view_metadata``) and the message
+    :rtype: tuple[dict, str | list]
+    """
+
+    return view_metadata(view), views.get_message_editor_input(view)
+
+
+def edit_message_view(shortcut: dict, bot_id: str | None) -> dict:
+    """Build the modal for editing a message: the message editor if the
+    user sent it through NoPing, or an explanation otherwise.
+
+    :param shortcut: Shortcut payload
+    :type shortcut: dict
+    :param bot_id: NoPing's bot ID, or None if the message isn't from a
+    bot
+    :type bot_id: str | None
+    :return: The modal
+    :rtype: dict
+    """
+
+    message = shortcut["message"]
+    if (bot_id is not None and message.get("bot_id") == bot_id
+            and text.user_owns_message(message["text"],
+                shortcut["user"]["id"])):
+        return views.message_editor_view("edit_message", "Edit message",
+            shortcut, text.link_names(message.get("blocks", [])))
+    return views.cant_edit_view()
@@ -0,0 +1,476 @@
+"""Metrics functions.
+
+Latency histograms and error counters are recorded in ``REGISTRY`` and
+rendered in the Prometheus text format (the ``/metrics`` route of
+``noping.flask_app``) or as a periodic log line in socket mode. Stats
+that other modules already keep (cache, workers, ...) are read only
+when metrics are rendered, so they cost nothing on the hot path.
+"""
+
+import inspect
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import cache, wraps
+
+from slack_sdk.errors import SlackApiError
+
+from noping import identity, idempotency, profiles, resolution
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+class Histogram:
+    """Counts observations per bucket. Not thread-safe on its own; see
+    ``Registry``.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile like Prometheus' ``histogram_quantile``,
+        interpolating linearly within a bucket.
+
+        :param q: Quantile between 0 and 1
+        :type q: float
+        :return: The estimate, or NaN without observations
+        :rtype: float
+        """
+
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if i == len(self.buckets):  # Only know it's above that
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (
+                    (rank - seen) / count)
+            seen += count
+        return self.buckets[-1]
+
+
+def _format_labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _format_number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Thread-safe histograms, counters and stats collectors."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # name -> {labels: Histogram}
+        self._counters = {}  # name -> {labels: value}
+        self._help = {}  # name -> help text
+        self._collectors = []  # (prefix, function, summary keys)
+
+    def describe(self, name: str, help_text: str) -> None:
+        """Set the help text of a metric.
+
+        :param name: Metric name
+        :type name: str
+        :param help_text: Description of the metric
+        :type help_text: str
+        """
+
+        self._help[name] = help_text
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Record a value (usually seconds) in a histogram.
+
+        :param name: Histogram name
+        :type name: str
+        :param value: Value to record
+        :type value: float
+        """
+
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        """Increase a counter.
+
+        :param name: Counter name, ending in ``_total``
+        :type name: str
+        :param amount: Amount to add
+        :type amount: float
+        """
+
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def register_stats(self, prefix: str, function,
+                       summary_keys: tuple = ()) -> None:
+        """Expose a stats function (like ``ProfileCache.stats``) as
+        gauges named ``noping_<prefix>_<key>``.
+
+        :param prefix: Metric name prefix
+        :type prefix: str
+        :param function: Function returning a dict of numbers
+        :param summary_keys: Keys to include in ``summary``
+        :type summary_keys: tuple
+        """
+
+        with self._lock:
+            self._collectors = [collector for collector in self._collectors
+                                if collector[0] != prefix]
+            self._collectors.append((prefix, function, summary_keys))
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        with self._lock:
+            return self._histograms.get(name, {}).get(
+                tuple(sorted(labels.items())))
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(
+                tuple(sorted(labels.items())), 0)
+
+    def _snapshot(self):
+        with self._lock:
+            histograms = {
+                name: {labels: (list(h.counts), h.sum, h.count, h.buckets)
+                       for labels, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+            counters = {name: dict(series)
+                        for name, series in self._counters.items()}
+            collectors = list(self._collectors)
+        return histograms, counters, collectors
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format.
+
+        :return: The metrics
+        :rtype: str
+        """
+
+        histograms, counters, collectors = self._snapshot()
+        lines = []
+
+        for name, series in sorted(histograms.items()):
+            self._header(lines, name, "histogram")
+            for labels, (counts, total, count, buckets) in series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (math.inf,),
+                                               counts):
+                    cumulative += bucket_count
+                    le = f'le="{_format_number(bound)}"'
+                    lines.append(f"{name}_bucket"
+                                 f"{_format_labels(labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total!r}")
+                lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        for name, series in sorted(counters.items()):
+            self._header(lines, name, "counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)}"
+                             f" {_format_number(value)}")
+
+        for prefix, function, _ in collectors:
+            for key, value in function().items():
+                name = f"noping_{prefix}_{key}"
+                self._header(lines, name, "gauge")
+                lines.append(f"{name} {_format_number(value)}")
+
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: list, name: str, kind: str) -> None:
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def summary(self) -> str:
+        """Summarize the metrics in a single line, e.g. for logging.
+
+        :return: Count, p50 and p95 of every histogram, every counter
+        and the summary keys of stats functions
+        :rtype: str
+        """
+
+        histograms, counters, collectors = self._snapshot()
+        parts = []
+        for name, series in sorted(histograms.items()):
+            short = name.removeprefix("noping_").removesuffix(
+                "_duration_seconds")
+            for labels, (counts, total, count, buckets) in series.items():
+                histogram = Histogram(buckets)
+                histogram.counts, histogram.count = counts, count
+                label = ",".join(str(value) for _, value in labels)
+                parts.append(
+                    f"{short}[{label}] n={count}"
+                    f" p50={histogram.quantile(0.5) * 1000:.0f}ms"
+                    f" p95={histogram.quantile(0.95) * 1000:.0f}ms")
+        for name, series in sorted(counters.items()):
+            short = name.removeprefix("noping_").removesuffix("_total")
+            for labels, value in series.items():
+                label = ",".join(str(value) for _, value in labels)
+                parts.append(f"{short}[{label}]={_format_number(value)}")
+        for prefix, function, summary_keys in collectors:
+            if summary_keys:
+                stats = function()
+                for key in summary_keys:
+                    value = stats[key]
+                    if isinstance(value, float):
+                        value = f"{value:.3g}"
+                    parts.append(f"{prefix}.{key}={value}")
+        return "; ".join(parts)
+
+
+REGISTRY = Registry()
+REGISTRY.describe("noping_ack_duration_seconds",
+    "Time until a request is acknowledged")
+REGISTRY.describe("noping_listener_duration_seconds",
+    "Time spent in a lazy listener")
+REGISTRY.describe("noping_listener_errors_total",
+    "Lazy listeners that raised an error")
+REGISTRY.describe("noping_slack_api_duration_seconds",
+    "Time spent in a Slack API call, including rate limiting")
+REGISTRY.describe("noping_slack_api_errors_total",
+    "Failed Slack API calls by error code")
+
+
+@contextmanager
+def _timed(name: str, error_counter: str, error_labels, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if error_counter:
+            REGISTRY.inc(error_counter, **labels, **error_labels(e))
+        raise
+    finally:
+        REGISTRY.observe(name, time.perf_counter() - start, **labels)
+
+
+def _no_labels(e: Exception) -> dict:
+    return {}
+
+
+def _slack_error(e: Exception) -> dict:
+    if isinstance(e, SlackApiError):
+        return {"error": e.response.get("error") or "unknown"}
+    return {"error": type(e).__name__}
+
+
+def slack_api_call(method: str):
+    """Time a Slack API call and count its error, if any.
+
+    :param method: API method, e.g. ``"chat.postMessage"``
+    :type method: str
+    :return: Context manager around the call
+    """
+
+    return _timed("noping_slack_api_duration_seconds",
+        "noping_slack_api_errors_total", _slack_error, method=method)
+
+
+@cache
+def instrument_listener(function):
+    """Wrap a listener function to time it and count its errors.
+
+    The wrapper keeps the function's signature for Bolt's argument
+    injection.
+
+    :param function: Listener function, sync or async
+    :return: The wrapped function
+    """
+
+    name = function.__name__
+
+    if inspect.iscoroutinefunction(function):
+        @wraps(function)
+        async def _instrumented_async(**kwargs):
+            with _timed("noping_listener_duration_seconds",
+                        "noping_listener_errors_total", _no_labels,
+                        listener=name):
+                return await function(**kwargs)
+
+        return _instrumented_async
+
+    @wraps(function)
+    def _instrumented(**kwargs):
+        with _timed("noping_listener_duration_seconds",
+                    "noping_listener_errors_total", _no_labels,
+                    listener=name):
+            return function(**kwargs)
+
+    return _instrumented
+
+
+# Requests NoPing has listeners for. Requests are timed before Bolt
+# verifies them, so anything else is "other" to keep unverified requests
+# from adding label values.
+REQUEST_KINDS = frozenset({
+    "/np", "/npp", "reply_thread", "edit_message", "delete_message",
+    "team_join", "user_change", "tokens_revoked", "app_uninstalled",
+})
+
+
+def request_kind(body: dict) -> str:
+    """Name a request for metrics, e.g. ``/np`` or ``edit_message``.
+
+    :param body: Request body
+    :type body: dict
+    :return: The command, callback ID or event type if it's one of
+    ``REQUEST_KINDS``, otherwise ``"other"``
+    :rtype: str
+    """
+
+    view = body.get("view")
+    event = body.get("event")
+    if "command" in body:
+        kind = body["command"]
+    elif isinstance(view, dict) and "callback_id" in view:
+        kind = view["callback_id"]
+    elif "callback_id" in body:
+        kind = body["callback_id"]
+    elif isinstance(event, dict):
+        kind = event.get("type")
+    else:
+        kind = None
+    return kind if isinstance(kind, str) and kind in REQUEST_KINDS else (
+        "other")
+
+
+def timed_dispatch(dispatch):
+    """Wrap ``App.dispatch`` (or ``AsyncApp.async_dispatch``) to time
+    how long requests take to be acknowledged.
+
+    Bolt runs global middleware before any listener, so a middleware
+    can't time the ack. Requests that fail Bolt's signature verification
+    (401) aren't recorded.
+
+    :param dispatch: The app's dispatch method
+    :return: The wrapped method
+    """
+
+    def _observe(req, start: float, response) -> None:
+        if getattr(response, "status", None) != 401:
+            REGISTRY.observe("noping_ack_duration_seconds",
+                time.perf_counter() - start, request=request_kind(req.body))
+
+    if inspect.iscoroutinefunction(dispatch):
+        @wraps(dispatch)
+        async def _timed_dispatch_async(req):
+            start = time.perf_counter()
+            response = await dispatch(req)
+            _observe(req, start, response)
+            return response
+
+        return _timed_dispatch_async
+
+    @wraps(dispatch)
+    def _timed_dispatch(req):
+        start = time.perf_counter()
+        response = dispatch(req)
+        _observe(req, start, response)
+        return response
+
+    return _timed_dispatch
+
+
+def register_app_stats(client, worker_stats, profile_flight,
+                       workspaces=None) -> None:
+    """Expose the stats of the app's caches, workers and Slack client in
+    ``REGISTRY``.
+
+    :param client: The app's ``ScheduledWebClient`` or
+    ``AsyncScheduledWebClient``
+    :param worker_stats: ``WorkerStats`` of the lazy listener runner
+    :param profile_flight: Single-flight of profile lookups
+    :param workspaces: ``WorkspaceRegistry`` if the app is installed in
+    many workspaces; its profile caches are added up instead of the
+    default one
+    """
+
+    if workspaces is None:
+        REGISTRY.register_stats("profile_cache",
+            lambda: profiles.default_profile_cache().stats(), ("hit_ratio",))
+    else:  # Every workspace has a cache of its own
+        REGISTRY.register_stats("profile_cache",
+            workspaces.profile_cache_stats, ("hit_ratio",))
+    REGISTRY.register_stats("profile_lookups", profile_flight.stats)
+    REGISTRY.register_stats("identity", identity.stats)
+    REGISTRY.register_stats("resolution",
+        lambda: {"saved_lookups": resolution.saved_lookups()})
+    REGISTRY.register_stats("worker", worker_stats.snapshot,
+        ("queued", "running", "rejected"))
+    REGISTRY.register_stats("idempotency",
+        lambda: idempotency.default_idempotency_store().stats(),
+        ("suppressed",))
+    REGISTRY.register_stats("ratelimit", client.scheduler.stats,
+        ("ratelimited",))
+    REGISTRY.register_stats("http", client.pool.stats.snapshot,
+        ("reuse_ratio",))
+    if workspaces is not None:
+        REGISTRY.register_stats("workspaces", workspaces.stats,
+            ("workspaces", "profiles"))
+
+
+def start_log_thread(logger, interval: float = None
+                     ) -> threading.Thread | None:
+    """Log ``REGISTRY.summary()`` periodically in a background thread,
+    e.g. in socket mode where there's no ``/metrics`` route.
+
+    :param logger: Logger to use
+    :param interval: Seconds between log lines. If None, use
+    ``NOPING_METRICS_LOG_INTERVAL`` (default 60); 0 disables logging.
+    :type interval: float
+    :return: The thread, or None if logging is disabled
+    :rtype: threading.Thread | None
+    """
+
+    if interval is None:
+        interval = float(os.environ.get("NOPING_METRICS_LOG_INTERVAL", 60))
+    if interval <= 0:
+        return None
+
+    def _run():
+        while True:
+            time.sleep(interval)
+            logger.info(f"Metrics: {REGISTRY.summary()}")
+
+    thread = threading.Thread(target=_run, name="noping-metrics",
+        daemon=True)
+    thread.start()
+    return thread
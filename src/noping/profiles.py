@@ -0,0 +1,612 @@
+"""User profile functions.
+
+This module includes the in-memory profile cache shared by the text
+functions and the command handlers, so the same user isn't looked up
+over and over again.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from slack_sdk.errors import SlackApiError
+
+from noping.singleflight import AsyncSingleFlight, SingleFlight
+
+# Only these profile fields are used by NoPing; everything else is
+# dropped before caching to keep entries small
+PROFILE_FIELDS = ("display_name", "real_name", "image_512")
+
+EVICTION_POLICIES = ("lru", "fifo")
+
+# users.profile.get errors for users that can't be looked up (yet), e.g.
+# unknown users or users of other workspaces in shared channels
+UNRESOLVABLE_ERRORS = frozenset({"user_not_found", "user_not_visible"})
+
+
+class ProfileNotFound(LookupError):
+    """A user's profile can't be looked up."""
+
+    def __init__(self, user_id: str, error: str):
+        super().__init__(f"{user_id}: {error}")
+        self.user_id = user_id
+        self.error = error
+
+
+class NegativeCache:
+    """Remembers users whose profiles couldn't be looked up, so they
+    aren't looked up again for ``ttl`` seconds.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0,
+                 clock=time.monotonic):
+        """
+        :param maxsize: Maximum number of users to remember; the oldest
+        is forgotten first
+        :type maxsize: int
+        :param ttl: Seconds before a user is looked up again; 0 disables
+        the cache
+        :type ttl: float
+        :param clock: Function returning the current time in seconds
+        """
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # user_id -> (expires_at, error)
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def get(self, user_id: str) -> str | None:
+        """Check whether a user's lookup failed recently.
+
+        :param user_id: User ID
+        :type user_id: str
+        :return: The error of the failed lookup, or None
+        :rtype: str | None
+        """
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[user_id]
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def add(self, user_id: str, error: str) -> None:
+        """Remember a failed lookup.
+
+        :param user_id: User ID
+        :type user_id: str
+        :param error: Slack API error, e.g. ``"user_not_found"``
+        :type error: str
+        """
+
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries.pop(user_id, None)
+            if len(self._entries) >= self.maxsize:
+                self._entries.popitem(last=False)
+            self._entries[user_id] = (self._clock() + self.ttl, error)
+
+    def discard(self, user_id: str) -> None:
+        """Forget a failed lookup, e.g. when the user joins."""
+
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ProfileCache:
+    """A size-bounded, in-memory cache of user profiles.
+
+    Entries expire ``ttl`` seconds after they are stored. When the cache
+    is full, the least recently used (``"lru"``) or the oldest
+    (``"fifo"``) entry is evicted.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0,
+                 eviction: str = "lru", clock=time.monotonic,
+                 negative_ttl: float = 60.0):
+        """
+        :param maxsize: Maximum number of profiles to keep
+        :type maxsize: int
+        :param ttl: Seconds before a cached profile expires
+        :type ttl: float
+        :param eviction: Eviction policy, either ``"lru"`` or ``"fifo"``
+        :type eviction: str
+        :param clock: Function returning the current time in seconds
+        :param negative_ttl: Seconds before a user whose lookup failed is
+        looked up again
+        :type negative_ttl: float
+        """
+
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"unknown eviction policy: {eviction!r}")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.eviction = eviction
+        self._clock = clock
+        self._entries = OrderedDict()  # user_id -> (expires_at, profile)
+        self._lock = threading.Lock()
+        self.negative = NegativeCache(maxsize, negative_ttl, clock)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_env(cls) -> "ProfileCache":
+        """Create a cache configured by ``NOPING_PROFILE_CACHE_*``
+        environment variables.
+
+        :return: A new profile cache
+        :rtype: ProfileCache
+        """
+
+        return cls(
+            maxsize=int(os.environ.get("NOPING_PROFILE_CACHE_SIZE", 1024)),
+            ttl=float(os.environ.get("NOPING_PROFILE_CACHE_TTL", 300)),
+            eviction=os.environ.get("NOPING_PROFILE_CACHE_EVICTION", "lru"),
+            negative_ttl=float(os.environ.get("NOPING_PROFILE_NEGATIVE_TTL",
+                60)),
+        )
+
+    def __deepcopy__(self, memo):
+        # Bolt copies the client (which may hold its workspace's cache)
+        # for lazy listeners
+        return self
+
+    def get(self, user_id: str) -> dict | None:
+        """Get a cached profile.
+
+        :param user_id: User ID of the profile
+        :type user_id: str
+        :return: The cached profile, or None if it's missing or expired
+        :rtype: dict | None
+        """
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= self._clock():
+                del self._entries[user_id]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            if self.eviction == "lru":
+                self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: str, profile: dict) -> None:
+        """Cache a profile, evicting another one if the cache is full.
+
+        :param user_id: User ID of the profile
+        :type user_id: str
+        :param profile: Profile as returned by Slack
+        :type profile: dict
+        """
+
+        entry = (self._clock() + self.ttl, slim_profile(profile))
+        with self._lock:
+            if user_id in self._entries:
+                self._entries.move_to_end(user_id)
+            elif len(self._entries) >= self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._entries[user_id] = entry
+
+    def replace(self, user_id: str, profile: dict) -> bool:
+        """Update a profile only if it's already cached, resetting its
+        TTL.
+
+        :param user_id: User ID of the profile
+        :type user_id: str
+        :param profile: Profile as returned by Slack
+        :type profile: dict
+        :return: Whether the profile was cached
+        :rtype: bool
+        """
+
+        entry = (self._clock() + self.ttl, slim_profile(profile))
+        with self._lock:
+            if user_id not in self._entries:
+                return False
+            self._entries[user_id] = entry
+            return True
+
+    def invalidate(self, user_id: str) -> bool:
+        """Remove a profile from the cache.
+
+        :param user_id: User ID of the profile
+        :type user_id: str
+        :return: Whether the profile was cached
+        :rtype: bool
+        """
+
+        with self._lock:
+            return self._entries.pop(user_id, None) is not None
+
+    def clear(self) -> None:
+        """Remove all profiles from the cache."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Get the cache counters, e.g. for sizing the cache.
+
+        :return: Size, hit/miss/eviction counters, the hit ratio and the
+        number of users whose lookup failed and the hits on those
+        :rtype: dict
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "negative_size": len(self.negative),
+                "negative_hits": self.negative.hits,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def default_profile_cache() -> ProfileCache:
+    """Get the process-wide profile cache, creating it from the
+    environment on first use. If ``NOPING_SHARED_PROFILE_CACHE`` is set,
+    it's a ``SharedProfileCache`` shared with other processes.
+
+    :return: The shared profile cache
+    :rtype: ProfileCache
+    """
+
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                if os.environ.get("NOPING_SHARED_PROFILE_CACHE"):
+                    from noping.shared_profiles import SharedProfileCache
+
+                    _default_cache = SharedProfileCache.from_env()
+                else:
+                    _default_cache = ProfileCache.from_env()
+    return _default_cache
+
+
+def set_default_profile_cache(cache: ProfileCache) -> None:
+    """Replace the process-wide profile cache.
+
+    :param cache: The profile cache to share
+    :type cache: ProfileCache
+    """
+
+    global _default_cache
+    with _default_cache_lock:
+        _default_cache = cache
+
+
+def cache_for(client) -> ProfileCache:
+    """Get the profile cache to use with a Slack client.
+
+    :param client: Slack client
+    :return: The cache of the client's workspace (see
+    ``noping.workspaces``), or the shared cache
+    :rtype: ProfileCache
+    """
+
+    cache = getattr(client, "profile_cache", None)
+    return default_profile_cache() if cache is None else cache
+
+
+def slim_profile(profile: dict) -> dict:
+    """Keep only the profile fields NoPing uses.
+
+    :param profile: Profile as returned by Slack
+    :type profile: dict
+    :return: Profile with only ``PROFILE_FIELDS``
+    :rtype: dict
+    """
+
+    return {field: profile.get(field, "") for field in PROFILE_FIELDS}
+
+
+def unknown_profile(user_id: str) -> dict:
+    """Build a profile for a user that can't be looked up.
+
+    :param user_id: User ID of the user
+    :type user_id: str
+    :return: Profile named after the user ID, without an image
+    :rtype: dict
+    """
+
+    return slim_profile({"display_name": user_id})
+
+
+def profile_name(profile: dict) -> str:
+    """Get the name to show for a profile.
+
+    :param profile: User profile
+    :type profile: dict
+    :return: The display name, or the real name if there is none
+    :rtype: str
+    """
+
+    # Prefer display_name (some users and all bots don't have one)
+    return profile["display_name"] or profile["real_name"]
+
+
+def update_cached_user(user: dict, cache: ProfileCache = None) -> None:
+    """Update the cache from a user object in a ``user_change`` or
+    ``team_join`` event.
+
+    Cached profiles are updated in place and deactivated users are
+    removed, so cached profiles stay correct even with long TTLs.
+
+    :param user: User object from the event
+    :type user: dict
+    :param cache: Profile cache to update. If None, use the shared cache.
+    :type cache: ProfileCache
+    """
+
+    if cache is None:
+        cache = default_profile_cache()
+
+    # New users can be looked up now
+    cache.negative.discard(user["id"])
+    if user.get("deleted") or "profile" not in user:
+        cache.invalidate(user["id"])
+    else:
+        cache.replace(user["id"], user["profile"])
+
+
+def get_profile(client, user_id: str, cache: ProfileCache = None) -> dict:
+    """Get a user's profile, using the cache if possible.
+
+    :param client: Slack client to use on a cache miss
+    :param user_id: User ID of the profile
+    :type user_id: str
+    :param cache: Profile cache to use. If None, use the client's (see
+    ``cache_for``).
+    :type cache: ProfileCache
+    :return: The user's profile
+    :rtype: dict
+    :raises ProfileNotFound: The user can't be looked up
+    """
+
+    if cache is None:
+        cache = cache_for(client)
+
+    profile = cache.get(user_id)
+    if profile is None:
+        profile = _fetch_profile(client, user_id, cache)
+    return profile
+
+
+# Concurrent lookups of the same user share a single request
+profile_flight = SingleFlight()
+async_profile_flight = AsyncSingleFlight()
+
+
+def _check_negative(user_id: str, cache: ProfileCache) -> None:
+    error = cache.negative.get(user_id)
+    if error is not None:
+        raise ProfileNotFound(user_id, error)
+
+
+def _unresolvable(user_id: str, e: SlackApiError,
+                  cache: ProfileCache) -> ProfileNotFound | None:
+    error = e.response.get("error")
+    if error not in UNRESOLVABLE_ERRORS:
+        return None
+    cache.negative.add(user_id, error)
+    return ProfileNotFound(user_id, error)
+
+
+def _fetch_profile(client, user_id: str, cache: ProfileCache) -> dict:
+    _check_negative(user_id, cache)
+    return profile_flight.do((id(cache), user_id), _fetch_uncached_profile,
+        client, user_id, cache)
+
+
+def _fetch_uncached_profile(client, user_id: str,
+                            cache: ProfileCache) -> dict:
+    try:
+        response = client.users_profile_get(user=user_id)
+    except SlackApiError as e:
+        if (not_found := _unresolvable(user_id, e, cache)) is None:
+            raise
+        raise not_found from e
+    profile = slim_profile(response.data["profile"])
+    cache.put(user_id, profile)
+    return profile
+
+
+def _fetch_found_profile(client, user_id: str,
+                         cache: ProfileCache) -> dict | None:
+    try:
+        return _fetch_profile(client, user_id, cache)
+    except ProfileNotFound:
+        return None
+
+
+_lookup_executor = None
+_lookup_executor_lock = threading.Lock()
+
+
+def _get_lookup_executor() -> ThreadPoolExecutor:
+    global _lookup_executor
+    if _lookup_executor is None:
+        with _lookup_executor_lock:
+            if _lookup_executor is None:
+                _lookup_executor = ThreadPoolExecutor(
+                    max_workers=int(
+                        os.environ.get("NOPING_LOOKUP_WORKERS", 8)),
+                    thread_name_prefix="noping-lookup",
+                )
+    return _lookup_executor
+
+
+def get_profiles(client, user_ids, cache: ProfileCache = None) -> dict:
+    """Get several users' profiles, looking up cache misses
+    concurrently.
+
+    :param client: Slack client to use on cache misses
+    :param user_ids: User IDs of the profiles; duplicates are looked up
+    only once
+    :param cache: Profile cache to use. If None, use the client's (see
+    ``cache_for``).
+    :type cache: ProfileCache
+    :return: Profiles by user ID, without users that can't be looked
+    up (see ``ProfileNotFound``)
+    :rtype: dict
+    """
+
+    if cache is None:
+        cache = cache_for(client)
+
+    found = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        profile = cache.get(user_id)
+        if profile is None:
+            missing.append(user_id)
+        else:
+            found[user_id] = profile
+
+    if len(missing) == 1:  # Not worth a round trip through the pool
+        found[missing[0]] = _fetch_found_profile(client, missing[0], cache)
+    elif missing:
+        # Lookups keep the caller's context (rate limit priority, trace)
+        futures = {
+            user_id: _get_lookup_executor().submit(
+                contextvars.copy_context().run, _fetch_found_profile,
+                client, user_id, cache)
+            for user_id in missing
+        }
+        for user_id, future in futures.items():
+            found[user_id] = future.result()
+
+    return {user_id: profile for user_id, profile in found.items()
+            if profile is not None}
+
+
+async def get_profile_async(client, user_id: str,
+                            cache: ProfileCache = None) -> dict:
+    """Get a user's profile, using the cache if possible.
+
+    This is the same as ``get_profile`` but for an ``AsyncWebClient``.
+
+    :param client: Async Slack client to use on a cache miss
+    :param user_id: User ID of the profile
+    :type user_id: str
+    :param cache: Profile cache to use. If None, use the client's (see
+    ``cache_for``).
+    :type cache: ProfileCache
+    :return: The user's profile
+    :rtype: dict
+    :raises ProfileNotFound: The user can't be looked up
+    """
+
+    if cache is None:
+        cache = cache_for(client)
+
+    profile = cache.get(user_id)
+    if profile is None:
+        profile = await _fetch_profile_async(client, user_id, cache)
+    return profile
+
+
+async def _fetch_profile_async(client, user_id: str,
+                               cache: ProfileCache) -> dict:
+    _check_negative(user_id, cache)
+    return await async_profile_flight.do((id(cache), user_id),
+        _fetch_uncached_profile_async, client, user_id, cache)
+
+
+async def _fetch_uncached_profile_async(client, user_id: str,
+                                        cache: ProfileCache) -> dict:
+    try:
+        response = await client.users_profile_get(user=user_id)
+    except SlackApiError as e:
+        if (not_found := _unresolvable(user_id, e, cache)) is None:
+            raise
+        raise not_found from e
+    profile = slim_profile(response.data["profile"])
+    cache.put(user_id, profile)
+    return profile
+
+
+async def _fetch_found_profile_async(client, user_id: str,
+                                     cache: ProfileCache) -> dict | None:
+    try:
+        return await _fetch_profile_async(client, user_id, cache)
+    except ProfileNotFound:
+        return None
+
+
+async def get_profiles_async(client, user_ids,
+                             cache: ProfileCache = None) -> dict:
+    """Get several users' profiles, looking up cache misses
+    concurrently.
+
+    This is the same as ``get_profiles`` but for an ``AsyncWebClient``.
+
+    :param client: Async Slack client to use on cache misses
+    :param user_ids: User IDs of the profiles; duplicates are looked up
+    only once
+    :param cache: Profile cache to use. If None, use the client's (see
+    ``cache_for``).
+    :type cache: ProfileCache
+    :return: Profiles by user ID, without users that can't be looked
+    up (see ``ProfileNotFound``)
+    :rtype: dict
+    """
+
+    if cache is None:
+        cache = cache_for(client)
+
+    found = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        profile = cache.get(user_id)
+        if profile is None:
+            missing.append(user_id)
+        else:
+            found[user_id] = profile
+
+    fetched = await asyncio.gather(*(
+        _fetch_found_profile_async(client, user_id, cache)
+        for user_id in missing))
+    found.update((user_id, profile)
+                 for user_id, profile in zip(missing, fetched)
+                 if profile is not None)
+    return found
@@ -0,0 +1,464 @@
+"""Slack API rate limiting functions.
+
+Slack limits every Web API method separately (by "tier"). Calls go
+straight to Slack until a method is rate limited: the 429 response
+pauses its bucket for ``Retry-After`` seconds, and from then on each
+call takes a token from the bucket first, waiting if there is none,
+until the method has stayed under its limit long enough to fill the
+bucket again.
+
+Latency-critical calls (``views.open`` has to use its trigger ID within
+3 seconds; the user is waiting for ``chat.postMessage``) can use every
+token. Normal calls leave some tokens for them and background calls
+(``users.list`` and anything in a ``background()`` block, like the
+cache warm-up) leave even more.
+
+Trigger-bound calls (``views.open``) are never retried and never wait
+long for a token: their trigger ID would expire first. They fail fast
+with a ``ratelimited`` error instead, so the user can be told.
+"""
+
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import SlackResponse
+
+from noping import metrics, tracing
+from noping.transport import PooledWebClient
+
+# Requests per minute, see https://api.slack.com/apis/rate-limits
+TIER_1 = 1
+TIER_2 = 20
+TIER_3 = 50
+TIER_4 = 100
+# chat.postMessage is limited to about 1 per second per channel, with
+# a workspace-wide limit of several hundred per minute
+POST_MESSAGE = 300
+
+METHOD_LIMITS = {
+    "auth.test": TIER_4,
+    "chat.delete": TIER_3,
+    "chat.postEphemeral": TIER_4,
+    "chat.postMessage": POST_MESSAGE,
+    "chat.update": TIER_3,
+    "users.info": TIER_4,
+    "users.list": TIER_2,
+    "users.profile.get": TIER_4,
+    "views.open": TIER_4,
+}
+DEFAULT_LIMIT = TIER_3
+
+CRITICAL = 0
+NORMAL = 1
+BACKGROUND = 2
+
+CRITICAL_METHODS = frozenset({
+    "chat.postEphemeral",
+    "chat.postMessage",
+    "chat.update",
+    "views.open",
+})
+BACKGROUND_METHODS = frozenset({"users.list"})
+# Methods using a trigger ID, which expires 3 seconds after the request
+TRIGGER_METHODS = frozenset({"views.open"})
+# Longest wait for a token for a trigger-bound call
+TRIGGER_WAIT = 1.0
+
+# Share of a full bucket each priority must leave for higher ones
+_RESERVES = {CRITICAL: 0.0, NORMAL: 0.25, BACKGROUND: 0.5}
+
+_background = contextvars.ContextVar("noping_background", default=False)
+
+
+@contextmanager
+def background():
+    """Run every Slack API call in the block with background priority."""
+
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+class TokenBucket:
+    """A thread-safe token bucket for one API method."""
+
+    def __init__(self, per_minute: float, burst: float = None,
+                 clock=time.monotonic, reactive: bool = False):
+        """
+        :param per_minute: Sustained number of calls per minute
+        :type per_minute: float
+        :param burst: Maximum number of tokens. If None, allow 10
+        seconds' worth of calls at once.
+        :type burst: float
+        :param clock: Function returning the current time in seconds
+        :param reactive: Whether to hand out tokens freely until the
+        bucket is paused, and again once it's full after that
+        :type reactive: bool
+        """
+
+        self.rate = per_minute / 60
+        self.capacity = burst or max(1.0, per_minute / 6)
+        self.tokens = self.capacity
+        self.reactive = reactive
+        self.throttled = not reactive
+        self._clock = clock
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        if now <= self._updated:  # Still paused
+            return
+        self.tokens = min(self.capacity,
+            self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.reactive and self.tokens >= self.capacity:
+            self.throttled = False
+
+    def reserve(self, priority: int = NORMAL) -> float:
+        """Take a token if one is available to the priority.
+
+        :param priority: ``CRITICAL``, ``NORMAL`` or ``BACKGROUND``
+        :type priority: int
+        :return: 0 if a token was taken, otherwise the number of seconds
+        to wait before trying again
+        :rtype: float
+        """
+
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if now < self._paused_until:
+                return self._paused_until - now
+            if not self.throttled:
+                return 0.0
+
+            needed = min(self.capacity,
+                1 + self.capacity * _RESERVES[priority])
+            if self.tokens >= needed:
+                self.tokens -= 1
+                return 0.0
+            return (needed - self.tokens) / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens, e.g. for a 429's ``Retry-After``.
+
+        A reactive bucket then starts throttling, filling up from empty
+        after the pause.
+
+        :param seconds: Number of seconds to pause for
+        :type seconds: float
+        """
+
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            self._paused_until = max(self._paused_until, now + seconds)
+            if self.reactive:
+                self.tokens = 0.0
+                self.throttled = True
+                self._updated = self._paused_until
+
+
+def _retry_after(response) -> float:
+    headers = response.headers or {}
+    for name in ("retry-after", "Retry-After"):
+        if name in headers:
+            value = headers[name]
+            if isinstance(value, list):  # Some clients keep all values
+                value = value[0]
+            return float(value)
+    return 1.0
+
+
+def is_ratelimited(e: SlackApiError) -> bool:
+    """Check whether an API call failed because it was rate limited.
+
+    :param e: The error of the call
+    :type e: SlackApiError
+    :return: Whether it was rate limited
+    :rtype: bool
+    """
+
+    return (e.response.status_code == 429
+            or e.response.get("error") == "ratelimited")
+
+
+def _ratelimited_error(method: str, retry_after: float) -> SlackApiError:
+    # What Slack would answer, for calls that aren't made at all
+    return SlackApiError(f"{method} is rate limited", SlackResponse(
+        client=None,
+        http_verb="POST",
+        api_url=method,
+        req_args={},
+        data={"ok": False, "error": "ratelimited"},
+        headers={"retry-after": str(retry_after)},
+        status_code=429,
+    ))
+
+
+class RateLimitScheduler:
+    """Schedules Slack API calls by method and priority."""
+
+    def __init__(self, limits: dict = None, max_retries: int = 3,
+                 clock=time.monotonic, sleep=time.sleep,
+                 reactive: bool = True):
+        """
+        :param limits: Calls per minute by API method, overriding
+        ``METHOD_LIMITS``
+        :type limits: dict
+        :param max_retries: Number of times to retry a rate limited call
+        :type max_retries: int
+        :param reactive: Whether to only throttle methods after Slack
+        rate limited them, instead of always
+        :type reactive: bool
+        :param clock: Function returning the current time in seconds
+        :param sleep: Function to wait for a number of seconds
+        """
+
+        self.limits = METHOD_LIMITS | (limits or {})
+        self.max_retries = max_retries
+        self.reactive = reactive
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.waits = 0
+        self.wait_seconds_total = 0.0
+        self.ratelimited = 0
+        self.retries = 0
+
+    @classmethod
+    def from_env(cls) -> "RateLimitScheduler":
+        """Create a scheduler configured by ``NOPING_RATE_LIMITS`` (a
+        comma-separated list of ``method=calls per minute``) and
+        ``NOPING_RATE_LIMIT_RETRIES``.
+
+        :return: The scheduler
+        :rtype: RateLimitScheduler
+        """
+
+        limits = {}
+        for pair in os.environ.get("NOPING_RATE_LIMITS", "").split(","):
+            if not pair.strip():
+                continue
+            method, _, per_minute = pair.partition("=")
+            limits[method.strip()] = float(per_minute)
+        return cls(limits, max_retries=int(
+            os.environ.get("NOPING_RATE_LIMIT_RETRIES", 3)))
+
+    def __deepcopy__(self, memo):
+        # Bolt copies the client for lazy listeners; the buckets must
+        # stay shared
+        return self
+
+    def bucket(self, method: str) -> TokenBucket:
+        """Get the token bucket of an API method.
+
+        :param method: API method, e.g. ``"users.profile.get"``
+        :type method: str
+        :return: The method's bucket
+        :rtype: TokenBucket
+        """
+
+        with self._lock:
+            bucket = self._buckets.get(method)
+            if bucket is None:
+                bucket = self._buckets[method] = TokenBucket(
+                    self.limits.get(method, DEFAULT_LIMIT),
+                    clock=self._clock, reactive=self.reactive)
+            return bucket
+
+    @staticmethod
+    def priority(method: str) -> int:
+        """Get the priority of a call in the current context.
+
+        :param method: API method, e.g. ``"views.open"``
+        :type method: str
+        :return: ``CRITICAL``, ``NORMAL`` or ``BACKGROUND``
+        :rtype: int
+        """
+
+        if _background.get() or method in BACKGROUND_METHODS:
+            return BACKGROUND
+        if method in CRITICAL_METHODS:
+            return CRITICAL
+        return NORMAL
+
+    def _record_call(self, waited: float) -> None:
+        with self._lock:
+            self.calls += 1
+            if waited:
+                self.waits += 1
+                self.wait_seconds_total += waited
+
+    def _record_ratelimited(self, retried: bool) -> None:
+        with self._lock:
+            self.ratelimited += 1
+            if retried:
+                self.retries += 1
+
+    def _should_retry(self, method: str, e: SlackApiError,
+                      attempt: int) -> bool:
+        if not is_ratelimited(e):
+            return False
+        retried = (attempt < self.max_retries
+                   and method not in TRIGGER_METHODS)
+        self._record_ratelimited(retried)
+        self.bucket(method).pause(_retry_after(e.response))
+        return retried
+
+    def _check_wait(self, method: str, wait: float) -> None:
+        if method in TRIGGER_METHODS and wait > TRIGGER_WAIT:
+            self._record_ratelimited(False)
+            raise _ratelimited_error(method, wait)
+
+    def acquire(self, method: str) -> float:
+        """Wait for a token for an API method.
+
+        :param method: API method, e.g. ``"views.open"``
+        :type method: str
+        :return: Number of seconds waited
+        :rtype: float
+        :raises SlackApiError: A trigger-bound method would have to wait
+        longer than ``TRIGGER_WAIT``
+        """
+
+        bucket = self.bucket(method)
+        priority = self.priority(method)
+        waited = 0.0
+        while wait := bucket.reserve(priority):
+            self._check_wait(method, waited + wait)
+            self._sleep(wait)
+            waited += wait
+        self._record_call(waited)
+        return waited
+
+    def call(self, method: str, fn, *args, **kwargs):
+        """Call ``fn(*args, **kwargs)`` once there's a token for the API
+        method, retrying after ``Retry-After`` if it's rate limited (unless
+        it's trigger-bound).
+
+        :param method: API method, e.g. ``"views.open"``
+        :type method: str
+        :param fn: Function making the API call
+        :return: The result of the call
+        :raises SlackApiError: The call failed, is still rate limited
+        after ``max_retries`` retries or is trigger-bound and rate limited
+        """
+
+        attempt = 0
+        while True:
+            self.acquire(method)
+            try:
+                return fn(*args, **kwargs)
+            except SlackApiError as e:
+                if not self._should_retry(method, e, attempt):
+                    raise
+            attempt += 1
+
+    async def acquire_async(self, method: str) -> float:
+        """Wait for a token for an API method without blocking the event
+        loop.
+
+        :param method: API method, e.g. ``"views.open"``
+        :type method: str
+        :return: Number of seconds waited
+        :rtype: float
+        :raises SlackApiError: A trigger-bound method would have to wait
+        longer than ``TRIGGER_WAIT``
+        """
+
+        bucket = self.bucket(method)
+        priority = self.priority(method)
+        waited = 0.0
+        while wait := bucket.reserve(priority):
+            self._check_wait(method, waited + wait)
+            await asyncio.sleep(wait)
+            waited += wait
+        self._record_call(waited)
+        return waited
+
+    async def call_async(self, method: str, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` once there's a token for the API
+        method, retrying after ``Retry-After`` if it's rate limited.
+
+        This is the same as ``call`` but for coroutine functions.
+
+        :return: The result of the call
+        :raises SlackApiError: The call failed, is still rate limited
+        after ``max_retries`` retries or is trigger-bound and rate limited
+        """
+
+        attempt = 0
+        while True:
+            await self.acquire_async(method)
+            try:
+                return await fn(*args, **kwargs)
+            except SlackApiError as e:
+                if not self._should_retry(method, e, attempt):
+                    raise
+            attempt += 1
+
+    def stats(self) -> dict:
+        """Get the number of calls, waits and rate limited calls.
+
+        :return: ``calls``, ``waits``, ``wait_seconds_total``,
+        ``ratelimited`` and ``retries``
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "waits": self.waits,
+                "wait_seconds_total": self.wait_seconds_total,
+                "ratelimited": self.ratelimited,
+                "retries": self.retries,
+            }
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def default_scheduler() -> RateLimitScheduler:
+    """Get the shared scheduler, creating it from the environment the
+    first time.
+
+    :return: The shared scheduler
+    :rtype: RateLimitScheduler
+    """
+
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RateLimitScheduler.from_env()
+        return _default_scheduler
+
+
+class ScheduledWebClient(PooledWebClient):
+    """A ``PooledWebClient`` whose calls all go through a
+    ``RateLimitScheduler``.
+    """
+
+    def __init__(self, *args, scheduler: RateLimitScheduler = None,
+                 profile_cache=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler or default_scheduler()
+        # The workspace's own profile cache (see profiles.cache_for)
+        self.profile_cache = profile_cache
+
+    def api_call(self, api_method: str, **kwargs):
+        with (metrics.slack_api_call(api_method),
+              tracing.slack_api_span(api_method, kwargs)):
+            return self.scheduler.call(api_method, super().api_call,
+                api_method, **kwargs)
@@ -0,0 +1,147 @@
+"""Mention resolution policy functions.
+
+Slash command text already has a username for every mention
+("<@U123|username>"), so commands can skip profile lookups entirely:
+
+``lookup``
+    Look up every mentioned user's display name (the default).
+``cached``
+    Use display names that are already cached and the embedded username
+    for everyone else. Never calls Slack for mentions.
+``embedded``
+    Always use the embedded username.
+
+The policy is set with ``NOPING_RESOLUTION_POLICY`` and can be
+overridden per workspace and/or command with
+``NOPING_RESOLUTION_POLICY_OVERRIDES``, a comma-separated list of
+``key=policy`` where the key is a team ID (``T123``), a command
+(``/np``) or both (``T123/np``).
+"""
+
+import os
+import threading
+from functools import cache
+
+from noping import profiles, text
+
+LOOKUP = "lookup"
+CACHED = "cached"
+EMBEDDED = "embedded"
+POLICIES = (LOOKUP, CACHED, EMBEDDED)
+
+_saved_lookups = 0
+_saved_lookups_lock = threading.Lock()
+
+
+def _parse_policy(policy: str) -> str:
+    policy = policy.strip().lower()
+    if policy not in POLICIES:
+        raise ValueError(f"unknown resolution policy: {policy!r}")
+    return policy
+
+
+@cache
+def parse_overrides(overrides: str) -> dict:
+    """Parse ``NOPING_RESOLUTION_POLICY_OVERRIDES``.
+
+    :param overrides: Comma-separated ``key=policy`` pairs
+    :type overrides: str
+    :return: Policies by key
+    :rtype: dict
+    """
+
+    parsed = {}
+    for pair in overrides.split(","):
+        if not pair.strip():
+            continue
+        key, _, policy = pair.partition("=")
+        parsed[key.strip()] = _parse_policy(policy)
+    return parsed
+
+
+def resolution_policy(team_id: str, command: str) -> str:
+    """Get the resolution policy for a slash command.
+
+    :param team_id: ID of the workspace the command was used in
+    :type team_id: str
+    :param command: The command, e.g. ``"/np"``
+    :type command: str
+    :return: ``"lookup"``, ``"cached"`` or ``"embedded"``
+    :rtype: str
+    """
+
+    overrides = parse_overrides(
+        os.environ.get("NOPING_RESOLUTION_POLICY_OVERRIDES", ""))
+    for key in (team_id + command, command, team_id):
+        if key in overrides:
+            return overrides[key]
+    return _parse_policy(os.environ.get("NOPING_RESOLUTION_POLICY", LOOKUP))
+
+
+def cached_names(user_ids,
+                 profile_cache: profiles.ProfileCache = None) -> dict:
+    """Get the profile names of users that are already cached, without
+    looking anyone up.
+
+    :param user_ids: User IDs to get names for
+    :param profile_cache: Profile cache to use. If None, use the shared
+    cache.
+    :type profile_cache: ProfileCache
+    :return: Profile names by user ID, only for cached users
+    :rtype: dict
+    """
+
+    if profile_cache is None:
+        profile_cache = profiles.default_profile_cache()
+
+    names = {}
+    for user_id in user_ids:
+        profile = profile_cache.get(user_id)
+        if profile is not None:
+            names[user_id] = profiles.profile_name(profile)
+    return names
+
+
+def reused_names(content, old_names: dict,
+                 profile_cache: profiles.ProfileCache = None
+                 ) -> tuple[dict, int]:
+    """Get the profile names of users mentioned in an edited message
+    that can be reused from the original message, so only new mentions
+    have to be looked up.
+
+    Cached names are preferred since they may be newer.
+
+    :param content: The edited message, either text or a list with Slack
+    Block Kit format rich text
+    :param old_names: Profile names by user ID from the original message
+    (see ``text.link_names``)
+    :type old_names: dict
+    :param profile_cache: Profile cache to use. If None, use the shared
+    cache.
+    :type profile_cache: ProfileCache
+    :return: Profile names by user ID and the number of lookups saved
+    :rtype: tuple[dict, int]
+    """
+
+    mentioned = text.content_mention_user_ids(content)
+    names = cached_names(mentioned, profile_cache)
+    saved = 0
+    for user_id in mentioned:
+        if user_id not in names and user_id in old_names:
+            names[user_id] = old_names[user_id]
+            saved += 1
+
+    global _saved_lookups
+    with _saved_lookups_lock:
+        _saved_lookups += saved
+    return names, saved
+
+
+def saved_lookups() -> int:
+    """Get the total number of lookups saved by ``reused_names``.
+
+    :return: Number of lookups saved since startup
+    :rtype: int
+    """
+
+    return _saved_lookups
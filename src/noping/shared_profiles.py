@@ -0,0 +1,417 @@
+"""Shared profile cache functions.
+
+With several worker processes (e.g. under a WSGI server), each one
+would otherwise keep and fill its own ``ProfileCache``.
+``SharedProfileCache`` keeps profiles in a shared memory segment
+instead, so a profile looked up by one worker is a hit in all of them.
+
+The segment is a fixed-size table of slots in ``/dev/shm`` (memory, not
+disk). Reads don't take any lock: every slot has a sequence number that
+writers make odd while they change the slot (a seqlock), and readers
+retry if it changed under them. Writers lock the group of slots they
+change with ``fcntl.lockf``, so a slot that stays odd under the lock was
+left by a writer that died, and is freed. ``lockf`` doesn't exclude
+threads of the same process, so a process opens each segment only once
+(see ``SharedProfileCache.from_env``).
+"""
+
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+import zlib
+
+from noping.profiles import NegativeCache, slim_profile
+
+SHM_DIR = "/dev/shm"
+
+MAGIC = b"NOPING01"
+_HEADER = struct.Struct("<8sII")  # magic, slot count, slot size
+HEADER_SIZE = 64
+# Number of taken slots, changed under a lock of its own
+_SIZE = struct.Struct("<q")
+_SIZE_OFFSET = 16
+
+# Sequence number, expiry time, user ID length, user ID, profile length
+_SLOT = struct.Struct("<IdB23sH")
+SLOT_SIZE = 512
+MAX_PROFILE_SIZE = SLOT_SIZE - _SLOT.size
+
+# A user is always stored in the same group of slots, so readers check
+# at most this many slots and writers lock only these
+GROUP_SIZE = 8
+
+_READ_ATTEMPTS = 4
+
+_open_caches = weakref.WeakValueDictionary()  # path -> cache
+_open_caches_lock = threading.Lock()
+
+
+class SharedProfileCache:
+    """A size-bounded profile cache shared by all processes that open
+    the same ``name``.
+
+    Entries expire ``ttl`` seconds after they are stored. When all slots
+    a user can be stored in are taken, the entry that expires first
+    (i.e. the oldest) is evicted.
+
+    Only the profiles are shared: failed lookups (``negative``) and the
+    hit/miss/expiration counters are per process, and the counters are
+    approximate since lock-free reads update them without a lock.
+    """
+
+    def __init__(self, name: str = "noping-profiles", maxsize: int = 1024,
+                 ttl: float = 300.0, clock=time.time,
+                 directory: str = SHM_DIR, negative_ttl: float = 60.0):
+        """
+        :param name: Name of the shared memory segment
+        :type name: str
+        :param maxsize: Number of slots, rounded up to a multiple of
+        ``GROUP_SIZE``. Ignored if the segment already exists.
+        :type maxsize: int
+        :param ttl: Seconds before a cached profile expires
+        :type ttl: float
+        :param clock: Function returning the current time in seconds,
+        the same in all processes
+        :param directory: Directory of the segment; must be in memory
+        :type directory: str
+        :param negative_ttl: Seconds before a user whose lookup failed is
+        looked up again. Failed lookups are only remembered per process.
+        :type negative_ttl: float
+        """
+
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if not os.path.isdir(directory):
+            raise ValueError(f"{directory} doesn't exist; shared profile"
+                             f" caches need a memory file system")
+
+        self.name = name
+        self.ttl = ttl
+        self.path = os.path.join(directory, name)
+        self._clock = clock
+        self._lock = threading.Lock()  # lockf only excludes processes
+        self.negative = NegativeCache(maxsize, negative_ttl)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.oversized = 0
+
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        slots = -(-maxsize // GROUP_SIZE) * GROUP_SIZE
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            if len(header) == _HEADER.size and header.startswith(MAGIC):
+                _, slots, slot_size = _HEADER.unpack(header)
+                if slot_size != SLOT_SIZE:
+                    raise ValueError(f"{self.path} has an incompatible"
+                                     f" layout")
+            else:  # The first process creates the table
+                os.ftruncate(self._fd, HEADER_SIZE + slots * SLOT_SIZE)
+                os.pwrite(self._fd, _HEADER.pack(MAGIC, slots, SLOT_SIZE),
+                    0)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+
+        self.maxsize = slots
+        self._map = mmap.mmap(self._fd, HEADER_SIZE + slots * SLOT_SIZE)
+
+    @classmethod
+    def from_env(cls, name: str = None) -> "SharedProfileCache":
+        """Get the cache configured by ``NOPING_SHARED_PROFILE_CACHE``
+        (the segment name), ``NOPING_PROFILE_CACHE_SIZE`` and
+        ``NOPING_PROFILE_CACHE_TTL``.
+
+        Every segment is opened once per process: while a cache of the
+        segment is still in use, it is returned again.
+
+        :param name: Segment name, instead of
+        ``NOPING_SHARED_PROFILE_CACHE``
+        :type name: str
+        :return: The shared profile cache
+        :rtype: SharedProfileCache
+        """
+
+        name = name or os.environ.get("NOPING_SHARED_PROFILE_CACHE",
+            "noping-profiles")
+        with _open_caches_lock:
+            cache = _open_caches.get(os.path.join(SHM_DIR, name))
+            if cache is None:
+                cache = cls(
+                    name=name,
+                    maxsize=int(os.environ.get("NOPING_PROFILE_CACHE_SIZE",
+                        1024)),
+                    ttl=float(os.environ.get("NOPING_PROFILE_CACHE_TTL",
+                        300)),
+                    negative_ttl=float(os.environ.get(
+                        "NOPING_PROFILE_NEGATIVE_TTL", 60)),
+                )
+                _open_caches[cache.path] = cache
+            return cache
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def _group(self, user_id: str) -> int:
+        groups = self.maxsize // GROUP_SIZE
+        return zlib.crc32(user_id.encode()) % groups * GROUP_SIZE
+
+    @staticmethod
+    def _offset(slot: int) -> int:
+        return HEADER_SIZE + slot * SLOT_SIZE
+
+    def _read(self, slot: int) -> tuple | None:
+        """Read a slot consistently.
+
+        :return: Expiry time, user ID and profile bytes, or None if the
+        slot kept changing
+        """
+
+        offset = self._offset(slot)
+        for _ in range(_READ_ATTEMPTS):
+            seq, expires_at, key_size, key, size = _SLOT.unpack_from(
+                self._map, offset)
+            if seq % 2:  # Being written
+                time.sleep(0)
+                continue
+            data = self._map[offset + _SLOT.size:
+                             offset + _SLOT.size + size]
+            if _SLOT.unpack_from(self._map, offset)[0] == seq:
+                return expires_at, key[:key_size].decode(), data
+        return None
+
+    def _read_locked(self, slot: int) -> tuple:
+        """Read a slot of a group whose locks are held, freeing it if a
+        writer died while changing it.
+
+        :return: Expiry time, user ID and profile bytes
+        """
+
+        entry = self._read(slot)
+        if entry is None:  # Nobody else can be writing it
+            self._write(slot, 0.0, "", b"")
+            return 0.0, "", b""
+        return entry
+
+    def _add_size(self, change: int) -> None:
+        # Writers of other groups (and processes) change it too
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _SIZE.size, _SIZE_OFFSET)
+        try:
+            size = _SIZE.unpack_from(self._map, _SIZE_OFFSET)[0]
+            _SIZE.pack_into(self._map, _SIZE_OFFSET, size + change)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _SIZE.size, _SIZE_OFFSET)
+
+    def _write(self, slot: int, expires_at: float, user_id: str,
+               data: bytes) -> None:
+        # Callers hold the group's locks
+        offset = self._offset(slot)
+        taken = self._map[offset + 12] > 0  # User ID length
+        if taken != bool(user_id):
+            self._add_size(1 if user_id else -1)
+        seq = struct.unpack_from("<I", self._map, offset)[0]
+        seq += seq % 2  # Left odd by a writer that died
+        struct.pack_into("<I", self._map, offset, (seq + 1) & 0xFFFFFFFF)
+        key = user_id.encode()
+        struct.pack_into("<dB23sH", self._map, offset + 4, expires_at,
+            len(key), key, len(data))
+        self._map[offset + _SLOT.size:offset + _SLOT.size + len(data)] = (
+            data)
+        struct.pack_into("<I", self._map, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def _locked_group(self, group: int):
+        return _GroupLock(self, group)
+
+    def get(self, user_id: str) -> dict | None:
+        """Get a cached profile without taking any lock.
+
+        :param user_id: User ID of the profile
+        :type user_id: str
+        :return: The cached profile, or None if it's missing or expired
+        :rtype: dict | None
+        """
+
+        group = self._group(user_id)
+        for slot in range(group, group + GROUP_SIZE):
+            entry = self._read(slot)
+            if entry is None or entry[1] != user_id:
+                continue
+            if entry[0] <= self._clock():
+                self.expirations += 1
+                break
+            self.hits += 1
+            return json.loads(entry[2])
+        self.misses += 1
+        return None
+
+    def put(self, user_id: str, profile: dict) -> None:
+        """Cache a profile, evicting the oldest one of its group if they
+        are all taken.
+
+        :param user_id: User ID of the profile
+        :type user_id: str
+        :param profile: Profile as returned by Slack
+        :type profile: dict
+        """
+
+        self._store(user_id, profile, only_replace=False)
+
+    def replace(self, user_id: str, profile: dict) -> bool:
+        """Update a profile only if it's already cached, resetting its
+        TTL.
+
+        :param user_id: User ID of the profile
+        :type user_id: str
+        :param profile: Profile as returned by Slack
+        :type profile: dict
+        :return: Whether the profile was cached
+        :rtype: bool
+        """
+
+        return self._store(user_id, profile, only_replace=True)
+
+    def _store(self, user_id: str, profile: dict, only_replace: bool
+               ) -> bool:
+        data = json.dumps(slim_profile(profile),
+            separators=(",", ":")).encode()
+        if len(data) > MAX_PROFILE_SIZE or len(user_id.encode()) > 23:
+            self.oversized += 1
+            return False
+
+        now = self._clock()
+        group = self._group(user_id)
+        with self._locked_group(group):
+            target = None
+            oldest = None
+            for slot in range(group, group + GROUP_SIZE):
+                expires_at, key, _ = self._read_locked(slot)
+                if key == user_id:
+                    target = slot
+                    break
+                if only_replace:
+                    continue
+                if not key or expires_at <= now:
+                    if target is None:
+                        target = slot
+                elif oldest is None or expires_at < oldest[0]:
+                    oldest = (expires_at, slot)
+
+            if only_replace and target is None:
+                return False
+            if target is None:
+                target = oldest[1]
+                self.evictions += 1
+            self._write(target, now + self.ttl, user_id, data)
+            return True
+
+    def invalidate(self, user_id: str) -> bool:
+        """Remove a profile from the cache.
+
+        :param user_id: User ID of the profile
+        :type user_id: str
+        :return: Whether the profile was cached
+        :rtype: bool
+        """
+
+        group = self._group(user_id)
+        with self._locked_group(group):
+            for slot in range(group, group + GROUP_SIZE):
+                if self._read_locked(slot)[1] == user_id:
+                    self._write(slot, 0.0, "", b"")
+                    return True
+        return False
+
+    def clear(self) -> None:
+        """Remove all profiles from the cache."""
+
+        for group in range(0, self.maxsize, GROUP_SIZE):
+            with self._locked_group(group):
+                for slot in range(group, group + GROUP_SIZE):
+                    self._write(slot, 0.0, "", b"")
+
+    def stats(self) -> dict:
+        """Get the cache counters, e.g. for sizing the cache.
+
+        :return: Size (taken slots of the shared table, including
+        expired profiles not replaced yet), this process's
+        hit/miss/eviction counters and its hit ratio
+        :rtype: dict
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "oversized": self.oversized,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "negative_size": len(self.negative),
+            "negative_hits": self.negative.hits,
+        }
+
+    def __len__(self) -> int:
+        # Kept in the header, since counting would read every slot
+        size = _SIZE.unpack_from(self._map, _SIZE_OFFSET)[0]
+        return min(max(size, 0), self.maxsize)
+
+    def close(self) -> None:
+        """Unmap the segment; other processes keep using it."""
+
+        if self._fd < 0:
+            return
+        self._map.close()
+        os.close(self._fd)
+        self._fd = -1
+
+    def __del__(self):
+        # Dropped caches, e.g. of evicted workspaces, close themselves
+        if getattr(self, "_map", None) is not None:
+            self.close()
+
+    def unlink(self) -> None:
+        """Delete the segment, e.g. when no process uses it anymore.
+
+        This cache keeps working on the deleted segment until it is
+        closed; ``from_env`` creates a new segment.
+        """
+
+        with _open_caches_lock:
+            if _open_caches.get(self.path) is self:
+                del _open_caches[self.path]
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _GroupLock:
+    """Locks a group of slots against other threads and processes."""
+
+    def __init__(self, cache: SharedProfileCache, group: int):
+        self._cache = cache
+        self._start = SharedProfileCache._offset(group)
+
+    def __enter__(self):
+        self._cache._lock.acquire()
+        try:
+            fcntl.lockf(self._cache._fd, fcntl.LOCK_EX,
+                GROUP_SIZE * SLOT_SIZE, self._start)
+        except BaseException:
+            self._cache._lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.lockf(self._cache._fd, fcntl.LOCK_UN,
+                GROUP_SIZE * SLOT_SIZE, self._start)
+        finally:
+            self._cache._lock.release()
@@ -0,0 +1,118 @@
+"""Request coalescing ("single-flight") functions.
+
+When several requests need the same thing at the same time, only the
+first one makes the call; the others wait for it and share its result
+or error.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key across threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call ``fn(*args, **kwargs)`` unless a call with the same key is
+        already in flight, in which case wait for that one instead.
+
+        :param key: Key identifying the call
+        :param fn: Function to call
+        :return: The result of the call
+        :raises: The error raised by the call
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        """Get the number of calls made and shared.
+
+        :return: ``calls`` (actually made) and ``shared`` (coalesced)
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared}
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent calls with the same key across asyncio
+    tasks.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` unless a call with the same key
+        is already in flight, in which case await that one instead.
+
+        Cancelling one waiter doesn't cancel the shared call.
+
+        :param key: Key identifying the call
+        :param fn: Coroutine function to call
+        :return: The result of the call
+        :raises: The error raised by the call
+        """
+
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    def stats(self) -> dict:
+        """Get the number of calls made and shared.
+
+        :return: ``calls`` (actually made) and ``shared`` (coalesced)
+        :rtype: dict
+        """
+
+        return {"calls": self.calls, "shared": self.shared}
@@ -0,0 +1,163 @@
+"""Socket mode functions.
+
+Runs the app over several socket mode connections at once. Slack spreads
+requests across all of an app's open connections (up to 10), so while
+one of them is refreshed or reconnects, the others keep taking requests.
+On SIGTERM or SIGINT the connections are closed first and the work
+already received is finished before exiting.
+
+Run it with ``python -m noping.socket_mode``.
+"""
+
+import os
+import signal
+import threading
+import time
+
+from slack_bolt.adapter.socket_mode import SocketModeHandler
+
+from noping import metrics, tracing, warmup
+
+# Slack's limit of connections per app
+MAX_CONNECTIONS = 10
+
+
+class SocketModeRunner:
+    """Keeps several socket mode connections open for an ``App``."""
+
+    def __init__(self, app, app_token: str = None, connections: int = 2,
+                 concurrency: int = 10, ping_interval: float = 5.0,
+                 shutdown_timeout: float = 30.0,
+                 handler_class=SocketModeHandler):
+        """
+        :param app: The Bolt app
+        :type app: slack_bolt.App
+        :param app_token: App-level token. If None, use
+        ``SLACK_APP_TOKEN``.
+        :type app_token: str
+        :param connections: Number of connections to open (1-10)
+        :type connections: int
+        :param concurrency: Number of threads per connection acking
+        requests
+        :type concurrency: int
+        :param ping_interval: Seconds between pings checking a connection
+        :type ping_interval: float
+        :param shutdown_timeout: Seconds to wait for work in progress
+        when stopping
+        :type shutdown_timeout: float
+        :param handler_class: Bolt socket mode handler to use
+        """
+
+        if not 1 <= connections <= MAX_CONNECTIONS:
+            raise ValueError(
+                f"connections must be between 1 and {MAX_CONNECTIONS}")
+
+        self.app = app
+        self.app_token = app_token or os.environ["SLACK_APP_TOKEN"]
+        self.connections = connections
+        self.concurrency = concurrency
+        self.ping_interval = ping_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.handler_class = handler_class
+        self.handlers = []
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_env(cls, app, app_token: str = None) -> "SocketModeRunner":
+        """Create a runner configured by ``NOPING_SOCKET_CONNECTIONS``,
+        ``NOPING_SOCKET_CONCURRENCY``, ``NOPING_SOCKET_PING_INTERVAL``
+        and ``NOPING_SHUTDOWN_TIMEOUT``.
+
+        :param app: The Bolt app
+        :type app: slack_bolt.App
+        :param app_token: App-level token. If None, use
+        ``SLACK_APP_TOKEN``.
+        :type app_token: str
+        :return: A new runner
+        :rtype: SocketModeRunner
+        """
+
+        return cls(
+            app,
+            app_token,
+            connections=int(os.environ.get("NOPING_SOCKET_CONNECTIONS", 2)),
+            concurrency=int(os.environ.get("NOPING_SOCKET_CONCURRENCY", 10)),
+            ping_interval=float(os.environ.get(
+                "NOPING_SOCKET_PING_INTERVAL", 5)),
+            shutdown_timeout=float(os.environ.get("NOPING_SHUTDOWN_TIMEOUT",
+                30)),
+        )
+
+    def connect(self) -> None:
+        """Open all connections."""
+
+        for _ in range(self.connections):
+            handler = self.handler_class(self.app, self.app_token,
+                ping_interval=self.ping_interval,
+                concurrency=self.concurrency)
+            handler.connect()
+            self.handlers.append(handler)
+        self.app.logger.info(
+            f"Opened {self.connections} socket mode connections")
+
+    def start(self) -> None:
+        """Open all connections and serve requests until ``stop()`` is
+        called or SIGTERM or SIGINT is received.
+        """
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        self.connect()
+        try:
+            self._stopped.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def close(self) -> None:
+        """Close all connections, then wait up to ``shutdown_timeout``
+        seconds for requests being handled and queued lazy listeners.
+        """
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        # Stops receiving and waits for the requests being acked
+        for handler in self.handlers:
+            handler.close()
+        self.handlers = []
+
+        runner = self.app.listener_runner.lazy_listener_runner
+        pool = getattr(runner, "pool", None)
+        if pool is not None and not pool.drain(
+                max(0.0, deadline - time.monotonic())):
+            self.app.logger.warning(
+                f"Stopped with {pool.stats.depth()} jobs unfinished")
+        tracing.default_tracer().flush()
+
+
+def run(app, app_token: str = None) -> None:
+    """Serve an app in socket mode until SIGTERM or SIGINT, warming up
+    the profile cache and logging metrics in the background.
+
+    :param app: The Bolt app
+    :type app: slack_bolt.App
+    :param app_token: App-level token. If None, use ``SLACK_APP_TOKEN``.
+    :type app_token: str
+    """
+
+    warmup.start_warmup(app.client, app.logger)
+    metrics.start_log_thread(app.logger)
+    SocketModeRunner.from_env(app, app_token).start()
+
+
+def main() -> None:
+    from noping.__main__ import default_app
+
+    run(default_app())
+
+
+if __name__ == "__main__":
+    main()
@@ -5,91 +5,506 @@ This module includes things like text parsing and replacement.
 
 import re
 from re import Match
+from typing import NamedTuple
 
+from noping import profiles
 
-def mentions_to_links(text: str, team_domain: str, client=None) -> str:
+# A Slack mrkdwn mention, "<@ID>" or "<@ID|username>". User IDs can't
+# contain "|", "<" or ">", so a failed match never scans past the next
+# "<" and matching is linear in the length of the text.
+_MENTION_RE = re.compile(
+    r"<@(?P<user_id>[^|<>]*)(?:>|\|(?P<username>[a-z0-9\-._]{1,21})>)")
+
+# A NoPing link in mrkdwn, as made by mentions_to_links
+_MRKDWN_LINK_RE = re.compile(
+    r"<(?P<url>https://[^|<>]*)\|(?P<name>@[^<>]*)>")
+_LINK_URL_RE = re.compile(
+    r"https://[^/]*\.slack\.com/team/(?P<user_id>[^/?]+)\?noping=1")
+
+
+class Mention(NamedTuple):
+    """A Slack mrkdwn mention ("<@ID>" or "<@ID|username>") in text."""
+
+    start: int
+    end: int
+    user_id: str
+    username: str | None
+    escaped: bool
+
+
+def starts_with_escape(text: str, pos: int = 0) -> bool:
+    """Check if text escapes a mention right before ``pos``, i.e. it
+    continues with a backslash, optionally after a single space.
+
+    :param text: Text after a mention
+    :type text: str
+    :param pos: Position in the text right after the mention
+    :type pos: int
+    :return: Whether the mention is escaped
+    :rtype: bool
+    """
+
+    return text.startswith("\\", pos) or text.startswith(" \\", pos)
+
+
+def _to_mention(m: Match) -> Mention:
+    return Mention(m.start(), m.end(), m.group("user_id"),
+                   m.group("username"), starts_with_escape(m.string, m.end()))
+
+
+def scan_mentions(text: str):
+    """Find all Slack mrkdwn mentions in text.
+
+    Every character is looked at a bounded number of times, so this is
+    linear in the length of the text no matter what it contains.
+
+    :param text: Text with mentions
+    :type text: str
+    :return: Iterator of ``Mention`` in order
+    """
+
+    return map(_to_mention, _MENTION_RE.finditer(text))
+
+
+def _convertible_mentions(text: str):
+    # Only mentions with a username (as in slash command text) are
+    # converted
+    for mention in scan_mentions(text):
+        if mention.username is not None and not mention.escaped:
+            yield mention
+
+
+def rich_text_leaves(content: list):
+    """Walk Slack Block Kit rich text in document order, including
+    everything inside sections, lists, quotes and preformatted blocks.
+
+    The tree is walked with an explicit stack, so there's no limit on
+    how deeply it's nested.
+
+    :param content: List with Slack Block Kit format rich text, either
+    elements (like ``text`` and ``user``) or containers of them (like
+    ``rich_text_section`` and ``rich_text_list``)
+    :type content: list
+    :return: Iterator of ``(elements, index)`` for each element that
+    isn't a container, so it can be replaced in place
+    """
+
+    stack = [(content, 0)]
+    while stack:
+        elements, i = stack.pop()
+        while i < len(elements):
+            children = elements[i].get("elements")
+            if isinstance(children, list):
+                stack.append((elements, i + 1))
+                elements, i = children, 0
+            else:
+                yield elements, i
+                i += 1
+
+
+def _block_kit_mentions(content: list) -> list:
+    """Find the unescaped ``user`` objects in rich text.
+
+    A mention is escaped by the next non-empty element, even if that's
+    in another container.
+
+    :param content: List with Slack Block Kit format rich text
+    :type content: list
+    :return: The unescaped ``user`` objects, in order
+    :rtype: list
+    """
+
+    mentions = []
+    pending = None  # A mention that may still be escaped
+    for elements, i in rich_text_leaves(content):
+        elem = elements[i]
+        if elem["type"] == "text" and not elem["text"]:
+            continue
+        if pending is not None:
+            if not (elem["type"] == "text"
+                    and starts_with_escape(elem["text"])):
+                mentions.append(pending)
+            pending = None
+        if elem["type"] == "user":
+            pending = elem
+
+    if pending is not None:
+        mentions.append(pending)
+    return mentions
+
+
+def mention_user_ids(text: str) -> list:
+    """Collect the IDs of users mentioned (without escaping) in text.
+
+    :param text: Text with mentions
+    :type text: str
+    :return: Unique user IDs, in order of first mention
+    :rtype: list
+    """
+
+    return list(dict.fromkeys(
+        mention.user_id for mention in _convertible_mentions(text)))
+
+
+def block_kit_mention_user_ids(content: list) -> list:
+    """Collect the IDs of users mentioned (without escaping) in Slack
+    Block Kit rich text.
+
+    :param content: List with Slack Block Kit format rich text
+    :type content: list
+    :return: Unique user IDs, in order of first mention
+    :rtype: list
+    """
+
+    return list(dict.fromkeys(
+        elem["user_id"] for elem in _block_kit_mentions(content)))
+
+
+def content_mention_user_ids(content) -> list:
+    """Collect the IDs of users mentioned (without escaping) in either
+    text or Slack Block Kit rich text.
+
+    :param content: Text or list with Slack Block Kit format rich text
+    :return: Unique user IDs, in order of first mention
+    :rtype: list
+    """
+
+    if type(content) == list:
+        return block_kit_mention_user_ids(content)
+    return mention_user_ids(content)
+
+
+def _resolve_names(user_ids: list, client, names: dict | None) -> dict:
+    """Resolve user IDs to profile names, looking up all unknown users
+    at once.
+
+    :param user_ids: User IDs to resolve
+    :type user_ids: list
+    :param client: Slack client to use for unknown users, or None
+    :param names: Already known profile names by user ID, or None
+    :type names: dict | None
+    :return: Profile names by user ID (only known ones if no client)
+    :rtype: dict
+    """
+
+    names = dict(names or {})
+    missing = [user_id for user_id in user_ids if user_id not in names]
+    if client and missing:
+        for user_id, profile in profiles.get_profiles(
+                client, missing).items():
+            names[user_id] = profiles.profile_name(profile)
+    return names
+
+
+async def _resolve_names_async(user_ids: list, client,
+                               names: dict | None) -> dict:
+    names = dict(names or {})
+    missing = [user_id for user_id in user_ids if user_id not in names]
+    if client and missing:
+        for user_id, profile in (await profiles.get_profiles_async(
+                client, missing)).items():
+            names[user_id] = profiles.profile_name(profile)
+    return names
+
+
+def mentions_to_links(text: str, team_domain: str, client=None,
+                      names: dict = None) -> str:
     """Convert Slack mentions ("<@...>") to links to the user's profile.
 
+    Unknown users are all looked up concurrently before any replacement
+    is done, so each mentioned user costs at most one lookup.
+
     :param text: Text with mentions to be converted
     :type text: str
     :param team_domain: Domain of the Slack workspace
     :type team_domain: str
     :param client: Slack client to use to retrieve a user's profile
-    name. If None, use the internal "username" in the Slack account
+    name (through the shared profile cache). If None, or if the user
+    can't be looked up, use the internal "username" in the Slack account
     settings.
+    :param names: Already resolved profile names by user ID. Users in
+    here are not looked up.
+    :type names: dict
     :return: Text with links from mentioned users' IDs
     :rtype: str
     """
 
-    def _repl(m):
-        if client:
-            profile = client.users_profile_get(
-                user=m.group("user_id"))
-            # Use either display_name or real_name; prefer display_name
-            # (some users and all bots don't have a display name)
-            profile_name = (
-                    profile.data["profile"]["display_name"]
-                    or profile.data["profile"]["real_name"]
-            )
+    names = _resolve_names(mention_user_ids(text), client, names)
+    return _link_mentions(text, _convertible_mentions(text), team_domain,
+        names)
 
-        else:
-            profile_name = m.group("username")
-        return (fr"<https://{team_domain}.slack.com/team/{m.group("user_id")}"
-                fr"?noping=1|@{profile_name}>")
 
-    return re.sub(
-        r"<@(?P<user_id>[^|]*)\|(?P<username>[a-z0-9-._]{1,21})>(?! ?\\)",
-        _repl,
-        text
-    )
+def _link_mentions(text: str, mentions, team_domain: str,
+                   names: dict) -> str:
+    parts = []
+    pos = 0
+    for mention in mentions:
+        profile_name = names.get(mention.user_id, mention.username)
+        parts.append(text[pos:mention.start])
+        parts.append(f"<https://{team_domain}.slack.com/team/"
+                     f"{mention.user_id}?noping=1|@{profile_name}>")
+        pos = mention.end
+    parts.append(text[pos:])
+
+    return "".join(parts)
 
 
 def block_kit_mentions_to_links(content: list, team_domain: str,
-                                client=None) -> list:
+                                client=None, names: dict = None) -> list:
     """Convert Slack block kit ``user`` objects to links to the user's
     profile.
 
+    Unknown users are all looked up concurrently before any replacement
+    is done, so each mentioned user costs at most one lookup. Mentions
+    are found anywhere in the rich text (see ``rich_text_leaves``) and
+    turned into links in place, keeping their style; nothing else is
+    copied or changed.
+
     :param content: List with Slack Block Kit format rich text
     :type content: list
     :param team_domain: Domain of the Slack workspace
     :type team_domain: str
     :param client: Slack client to use to retrieve a user's profile
-    name. If None, use ``"PlaceholderUsername"``.
+    name (through the shared profile cache). If None, or if the user
+    can't be looked up, use the user ID.
+    :param names: Already resolved profile names by user ID. Users in
+    here are not looked up.
+    :type names: dict
     :return: Slack Block Kit formatted rich text with converted mentions
     :rtype: str
     """
 
-    for i, elem in enumerate(content):
-        if elem["type"] != "user":
-            # Not a mention; ignore
-            continue
-        if i + 1 < len(content) and (
-                content[i + 1]["type"] == "text"
-                and re.match(r"^ ?\\", content[i + 1]["text"])
-        ):
-            # Escaped mention; ignore
-            continue
+    mentions = _block_kit_mentions(content)
+    names = _resolve_names(
+        list(dict.fromkeys(elem["user_id"] for elem in mentions)),
+        client, names)
+    _link_block_kit_mentions(mentions, team_domain, names)
+    return content
+
+
+def _link_block_kit_mentions(mentions: list, team_domain: str,
+                             names: dict) -> None:
+    for elem in mentions:
+        user_id = elem.pop("user_id")
+        elem["type"] = "link"
+        elem["text"] = "@" + names.get(user_id, user_id)
+        elem["url"] = (f"https://{team_domain}.slack.com"
+                       f"/team/{user_id}?noping=1")
+
+
+async def mentions_to_links_async(text: str, team_domain: str, client=None,
+                                  names: dict = None) -> str:
+    """Convert Slack mentions ("<@...>") to links to the user's profile.
+
+    This is the same as ``mentions_to_links`` but for an
+    ``AsyncWebClient``.
+
+    :param text: Text with mentions to be converted
+    :type text: str
+    :param team_domain: Domain of the Slack workspace
+    :type team_domain: str
+    :param client: Async Slack client to use to retrieve a user's
+    profile name. If None, or if the user can't be looked up, use the
+    internal "username" in the Slack account settings.
+    :param names: Already resolved profile names by user ID
+    :type names: dict
+    :return: Text with links from mentioned users' IDs
+    :rtype: str
+    """
+
+    names = await _resolve_names_async(mention_user_ids(text), client, names)
+    return mentions_to_links(text, team_domain, names=names)
+
+
+async def block_kit_mentions_to_links_async(content: list, team_domain: str,
+                                            client=None,
+                                            names: dict = None) -> list:
+    """Convert Slack block kit ``user`` objects to links to the user's
+    profile.
+
+    This is the same as ``block_kit_mentions_to_links`` but for an
+    ``AsyncWebClient``.
+
+    :param content: List with Slack Block Kit format rich text
+    :type content: list
+    :param team_domain: Domain of the Slack workspace
+    :type team_domain: str
+    :param client: Async Slack client to use to retrieve a user's
+    profile name. If None, or if the user can't be looked up, use the
+    user ID.
+    :param names: Already resolved profile names by user ID
+    :type names: dict
+    :return: Slack Block Kit formatted rich text with converted mentions
+    :rtype: str
+    """
+
+    names = await _resolve_names_async(
+        block_kit_mention_user_ids(content), client, names)
+    return block_kit_mentions_to_links(content, team_domain, names=names)
+
 
-        # Unescaped mention
-        if client:
-            profile = client.users_profile_get(
-                user=elem["user_id"]
-            ).data["profile"]
-            profile_name = (
-                    profile["display_name"]
-                    or profile["real_name"]
-            )
+# Messages bulk conversion reads before resolving their users
+BULK_BATCH_SIZE = 100
+
+
+def _batches(contents, batch_size: int | None):
+    if batch_size is None:
+        yield list(contents)
+        return
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    batch = []
+    for content in contents:
+        batch.append(content)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _batch_mentions(batch: list) -> list:
+    """Find the mentions of every message of a batch.
+
+    :return: ``(content, mentions)`` for each message, with the
+    mentions as in ``_convertible_mentions`` for text and
+    ``_block_kit_mentions`` for rich text
+    :rtype: list
+    """
+
+    return [
+        (content, _block_kit_mentions(content) if type(content) == list
+         else list(_convertible_mentions(content)))
+        for content in batch
+    ]
+
+
+def _unknown_user_ids(found: list, names: dict) -> list:
+    user_ids = dict.fromkeys(
+        mention["user_id"] if type(mention) == dict else mention.user_id
+        for _, mentions in found for mention in mentions)
+    return [user_id for user_id in user_ids if user_id not in names]
+
+
+def _link_batch(found: list, team_domain: str, names: dict):
+    for content, mentions in found:
+        if type(content) == list:
+            _link_block_kit_mentions(mentions, team_domain, names)
+            yield content
         else:
-            profile_name = "PlaceholderUsername"
+            yield _link_mentions(content, mentions, team_domain, names)
 
-        content[i] = {
-            "type": "link",
-            "text": "@" + profile_name,
-            "url": f"https://{team_domain}.slack.com"
-                   f"/team/{elem["user_id"]}?noping=1"
-        }
 
-    return content
+def bulk_mentions_to_links(contents, team_domain: str, client=None,
+                           names: dict = None,
+                           batch_size: int = BULK_BATCH_SIZE):
+    """Convert the mentions of many messages, e.g. to re-render archived
+    messages.
+
+    All users mentioned in a batch are resolved in a single pass before
+    its messages are converted, and every user is resolved at most once
+    for all batches. Without a client, only ``names`` are used, so
+    nothing is looked up and this works offline.
+
+    :param contents: Iterable of messages, each either text (see
+    ``mentions_to_links``) or a list with Slack Block Kit format rich
+    text (see ``block_kit_mentions_to_links``, which converts it in
+    place)
+    :param team_domain: Domain of the Slack workspace
+    :type team_domain: str
+    :param client: Slack client to use to retrieve profile names of users
+    not in ``names``, or None
+    :param names: Already resolved profile names by user ID. Users in
+    here are not looked up.
+    :type names: dict
+    :param batch_size: Number of messages to read from ``contents``
+    before converting them, or None to read all of them first (which
+    yields nothing until all users are resolved)
+    :type batch_size: int | None
+    :return: Iterator of the converted messages, in order
+    """
+
+    names = dict(names or {})
+    for batch in _batches(contents, batch_size):
+        found = _batch_mentions(batch)
+        missing = _unknown_user_ids(found, names)
+        if client and missing:
+            for user_id, profile in profiles.get_profiles(
+                    client, missing).items():
+                names[user_id] = profiles.profile_name(profile)
+        yield from _link_batch(found, team_domain, names)
+
+
+async def bulk_mentions_to_links_async(contents, team_domain: str,
+                                       client=None, names: dict = None,
+                                       batch_size: int = BULK_BATCH_SIZE):
+    """Convert the mentions of many messages, e.g. to re-render archived
+    messages.
+
+    This is the same as ``bulk_mentions_to_links`` but for an
+    ``AsyncWebClient``. ``contents`` is still a regular iterable.
+
+    :param contents: Iterable of messages, each either text or a list
+    with Slack Block Kit format rich text
+    :param team_domain: Domain of the Slack workspace
+    :type team_domain: str
+    :param client: Async Slack client to use to retrieve profile names of
+    users not in ``names``, or None
+    :param names: Already resolved profile names by user ID
+    :type names: dict
+    :param batch_size: Number of messages to read from ``contents``
+    before converting them, or None to read all of them first (which
+    yields nothing until all users are resolved)
+    :type batch_size: int | None
+    :return: Async iterator of the converted messages, in order
+    """
+
+    names = dict(names or {})
+    for batch in _batches(contents, batch_size):
+        found = _batch_mentions(batch)
+        missing = _unknown_user_ids(found, names)
+        if client and missing:
+            for user_id, profile in (await profiles.get_profiles_async(
+                    client, missing)).items():
+                names[user_id] = profiles.profile_name(profile)
+        for content in _link_batch(found, team_domain, names):
+            yield content
+
+
+def _add_link_name(names: dict, url: str, text: str) -> None:
+    m = _LINK_URL_RE.fullmatch(url)
+    if m is not None and text.startswith("@") and len(text) > 1:
+        names.setdefault(m.group("user_id"), text[1:])
+
+
+def link_names(blocks: list) -> dict:
+    """Collect the profile names used in the NoPing links of an existing
+    message, e.g. to avoid looking them up again when editing it.
+
+    :param blocks: Blocks of a NoPing message
+    :type blocks: list
+    :return: Profile names by user ID
+    :rtype: dict
+    """
+
+    names = {}
+    stack = [blocks]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+        elif isinstance(node, dict):
+            if node.get("type") == "link" and "text" in node:
+                _add_link_name(names, node["url"], node["text"])
+            elif node.get("type") == "mrkdwn":
+                for m in _MRKDWN_LINK_RE.finditer(node["text"]):
+                    _add_link_name(names, m.group("url"), m.group("name"))
+            else:
+                stack.extend(
+                    value for value in reversed(node.values())
+                    if isinstance(value, (list, dict)))
+
+    return names
 
 
 def user_owns_message(text: str, user: str) -> bool:
@@ -103,8 +518,10 @@ def user_owns_message(text: str, user: str) -> bool:
     :rtype: bool
     """
 
-    try:
-        return (re.match(r"^\*<@(?P<user_id>[^|]*)>\*:",
-            text).group("user_id") == user)
-    except AttributeError:
+    if not text.startswith("*"):
         return False
+    m = _MENTION_RE.match(text, 1)
+    return (m is not None
+            and m.group("username") is None
+            and text.startswith("*:", m.end())
+            and m.group("user_id") == user)
@@ -0,0 +1,555 @@
+"""Tracing functions.
+
+Every verified request gets a trace: a ``request`` span until it's
+acknowledged,
+a span for each lazy listener that handles it and a span for every Slack
+API call they make, so it's clear where the time of a slow ``/np`` went.
+Spans are exported in batches by a background thread to stdout, a JSON
+lines file or an OTLP/HTTP collector.
+
+User IDs are never exported as they are, only as keyed hashes (see
+``Tracer.hash_user_id``), and no message content is recorded.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from contextlib import ExitStack, contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import cache, wraps
+from inspect import iscoroutinefunction
+
+from slack_sdk.errors import SlackApiError
+
+from noping.metrics import request_kind
+
+# Span kinds, as in OTLP
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+# Key of the trace context in Bolt's request context
+CONTEXT_KEY = "noping_trace_context"
+
+logger = logging.getLogger(__name__)
+
+# (trace ID, span ID) of the current span, _UNSAMPLED in a trace that
+# isn't recorded, or None outside of a trace
+_UNSAMPLED = ("", "")
+_current = ContextVar("noping_trace_context", default=None)
+# Ends the request span (if any) of the request being dispatched
+_request_scope = ContextVar("noping_request_scope", default=None)
+
+
+class Span:
+    """A timed operation in a trace."""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id",
+                 "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, kind: int, trace_id: str, span_id: str,
+                 parent_id: str | None, attributes: dict):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class StreamExporter:
+    """Writes spans as JSON lines to a text stream, e.g. stdout."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def export(self, spans: list) -> None:
+        self.stream.write("".join(
+            json.dumps(span.to_dict()) + "\n" for span in spans))
+        self.stream.flush()
+
+
+class FileExporter:
+    """Appends spans as JSON lines to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: list) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(
+                json.dumps(span.to_dict()) + "\n" for span in spans))
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(span: Span) -> dict:
+    otlp = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [{"key": key, "value": _otlp_value(value)}
+                       for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {},
+    }
+    if span.parent_id:
+        otlp["parentSpanId"] = span.parent_id
+    return otlp
+
+
+class OtlpExporter:
+    """Sends spans to an OpenTelemetry collector over OTLP/HTTP (JSON)."""
+
+    def __init__(self, endpoint: str = "http://localhost:4318/v1/traces",
+                 service_name: str = "noping", timeout: float = 10):
+        """
+        :param endpoint: URL of the collector's traces endpoint
+        :type endpoint: str
+        :param service_name: ``service.name`` of the spans
+        :type service_name: str
+        :param timeout: Timeout of an export in seconds
+        :type timeout: float
+        """
+
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def payload(self, spans: list) -> dict:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{
+                "key": "service.name",
+                "value": {"stringValue": self.service_name},
+            }]},
+            "scopeSpans": [{
+                "scope": {"name": "noping"},
+                "spans": [_otlp_span(span) for span in spans],
+            }],
+        }]}
+
+    def export(self, spans: list) -> None:
+        request = urllib.request.Request(self.endpoint,
+            data=json.dumps(self.payload(spans)).encode(),
+            headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def _error_description(e: Exception) -> str:
+    if isinstance(e, SlackApiError):
+        return e.response.get("error") or type(e).__name__
+    return type(e).__name__
+
+
+class Tracer:
+    """Records sampled spans and exports them in the background."""
+
+    def __init__(self, exporter=None, sample_rate: float = 1.0,
+                 salt: str = None, interval: float = 5.0,
+                 max_queue: int = 2048):
+        """
+        :param exporter: Object with an ``export(spans)`` method. If
+        None, tracing is disabled.
+        :param sample_rate: Share of requests that are traced
+        :type sample_rate: float
+        :param salt: Key for hashing user IDs. If None, use a random one
+        so hashes can only be correlated within this process.
+        :type salt: str
+        :param interval: Seconds between exports
+        :type interval: float
+        :param max_queue: Number of finished spans kept for the next
+        export; more are dropped
+        :type max_queue: int
+        """
+
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._key = hashlib.sha256(
+            salt.encode() if salt is not None else os.urandom(32)).digest()
+        self._random = random.Random()
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._finished = []
+        self._thread = None
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        """Create a tracer configured by ``NOPING_TRACE_EXPORTER``
+        (``stdout``, ``file``, ``otlp`` or empty to disable tracing),
+        ``NOPING_TRACE_FILE``, ``NOPING_TRACE_OTLP_ENDPOINT``,
+        ``NOPING_TRACE_SAMPLE_RATE`` and ``NOPING_TRACE_SALT``.
+
+        :return: A new tracer
+        :rtype: Tracer
+        """
+
+        kind = os.environ.get("NOPING_TRACE_EXPORTER", "").strip().lower()
+        if kind == "stdout":
+            exporter = StreamExporter()
+        elif kind == "file":
+            exporter = FileExporter(os.environ.get("NOPING_TRACE_FILE",
+                "noping-traces.jsonl"))
+        elif kind == "otlp":
+            exporter = OtlpExporter(os.environ.get(
+                "NOPING_TRACE_OTLP_ENDPOINT",
+                "http://localhost:4318/v1/traces"))
+        elif kind:
+            raise ValueError(f"unknown trace exporter {kind!r}")
+        else:
+            exporter = None
+
+        tracer = cls(
+            exporter,
+            sample_rate=float(os.environ.get("NOPING_TRACE_SAMPLE_RATE",
+                1.0)),
+            salt=os.environ.get("NOPING_TRACE_SALT") or None,
+        )
+        if exporter is not None:
+            atexit.register(tracer.flush)
+        return tracer
+
+    def __deepcopy__(self, memo):
+        return self
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def hash_user_id(self, user_id: str) -> str:
+        """Pseudonymize a user ID for span attributes.
+
+        :param user_id: User ID
+        :type user_id: str
+        :return: Keyed hash of the user ID
+        :rtype: str
+        """
+
+        return hashlib.blake2b(user_id.encode(), key=self._key,
+            digest_size=8).hexdigest()
+
+    @contextmanager
+    def span(self, name: str, kind: int = INTERNAL,
+             attributes: dict = None):
+        """Record a span around the block, as a child of the current
+        span or as a new (possibly unsampled) trace.
+
+        :param name: Span name
+        :type name: str
+        :param kind: ``INTERNAL``, ``SERVER`` or ``CLIENT``
+        :type kind: int
+        :param attributes: Span attributes
+        :type attributes: dict
+        :return: Context manager yielding the span, or None if the
+        trace isn't sampled
+        """
+
+        parent = _current.get()
+        if not self.enabled or parent is _UNSAMPLED:
+            yield None
+            return
+        if parent is None and self._random.random() >= self.sample_rate:
+            token = _current.set(_UNSAMPLED)
+            try:
+                yield None
+            finally:
+                _current.reset(token)
+            return
+
+        span = Span(name, kind,
+            trace_id=parent[0] if parent else
+                f"{self._random.getrandbits(128):032x}",
+            span_id=f"{self._random.getrandbits(64):016x}",
+            parent_id=parent[1] if parent else None,
+            attributes=attributes or {})
+        token = _current.set((span.trace_id, span.span_id))
+        try:
+            yield span
+        except BaseException as e:
+            span.error = _error_description(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.end_ns = time.time_ns()
+            self._finish(span)
+
+    def _finish(self, span: Span) -> None:
+        with self._lock:
+            if len(self._finished) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._finished.append(span)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                    name="noping-tracing", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self) -> None:
+        """Export all finished spans now."""
+
+        with self._export_lock:
+            with self._lock:
+                spans, self._finished = self._finished, []
+            if not spans:
+                return
+            try:
+                self.exporter.export(spans)
+            except Exception as e:
+                logger.warning(f"Failed to export {len(spans)} spans: {e}")
+
+
+_default_tracer = None
+_default_tracer_lock = threading.Lock()
+
+
+def default_tracer() -> Tracer:
+    """Get the process-wide tracer, creating it from the environment on
+    first use.
+
+    :return: The shared tracer
+    :rtype: Tracer
+    """
+
+    global _default_tracer
+    if _default_tracer is None:
+        with _default_tracer_lock:
+            if _default_tracer is None:
+                _default_tracer = Tracer.from_env()
+    return _default_tracer
+
+
+def span(name: str, kind: int = INTERNAL, attributes: dict = None):
+    """Record a span with the shared tracer; see ``Tracer.span``."""
+
+    tracer = default_tracer()
+    if not tracer.enabled:
+        return nullcontext()
+    return tracer.span(name, kind, attributes)
+
+
+def current_context() -> tuple | None:
+    """Get the current trace context, to continue the trace elsewhere.
+
+    :return: The context, or None outside of a trace
+    :rtype: tuple | None
+    """
+
+    return _current.get()
+
+
+@contextmanager
+def attach(context: tuple | None):
+    """Continue a trace from ``current_context()`` in the block.
+
+    :param context: Trace context, or None to do nothing
+    :type context: tuple | None
+    """
+
+    if context is None:
+        yield
+        return
+    token = _current.set(context)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def bind(request, function):
+    """Make a function continue the trace of a Bolt request, e.g. in a
+    worker thread.
+
+    :param request: The (copied) Bolt request
+    :param function: Function to call without arguments
+    :return: The bound function
+    """
+
+    context = request.context.get(CONTEXT_KEY)
+
+    def _bound():
+        with attach(context):
+            return function()
+
+    return _bound
+
+
+def _user_id(body: dict) -> str | None:
+    if "user_id" in body:
+        return body["user_id"]
+    user = body.get("user") or body.get("event", {}).get("user")
+    return user.get("id") if isinstance(user, dict) else user
+
+
+def _request_attributes(tracer: Tracer, body: dict) -> dict:
+    attributes = {"slack.request": request_kind(body)}
+    team_id = body.get("team_id") or (body.get("team") or {}).get("id")
+    if team_id:
+        attributes["slack.team"] = team_id
+    user_id = _user_id(body)
+    if user_id:
+        attributes["slack.user_hash"] = tracer.hash_user_id(user_id)
+    return attributes
+
+
+@contextmanager
+def _dispatching():
+    with ExitStack() as scope:
+        token = _request_scope.set(scope)
+        try:
+            yield
+        finally:
+            _request_scope.reset(token)
+
+
+def traced_dispatch(dispatch):
+    """Wrap ``App.dispatch`` (or ``AsyncApp.async_dispatch``) to end the
+    ``request`` span started by ``trace_request`` once the request is
+    acknowledged.
+
+    :param dispatch: The app's dispatch method
+    :return: The wrapped method
+    """
+
+    if iscoroutinefunction(dispatch):
+        @wraps(dispatch)
+        async def _traced_dispatch_async(req):
+            with _dispatching():
+                return await dispatch(req)
+
+        return _traced_dispatch_async
+
+    @wraps(dispatch)
+    def _traced_dispatch(req):
+        with _dispatching():
+            return dispatch(req)
+
+    return _traced_dispatch
+
+
+def _start_request_span(req, context) -> None:
+    scope = _request_scope.get()
+    tracer = default_tracer()
+    if scope is None or not tracer.enabled:
+        return
+    scope.enter_context(tracer.span("request", SERVER,
+        _request_attributes(tracer, req.body)))
+    context[CONTEXT_KEY] = current_context()
+
+
+def trace_request(req, context, next):
+    """Bolt middleware starting the trace of a request, continued by its
+    lazy listeners and ended by ``traced_dispatch``.
+
+    Bolt runs it after verifying the request's signature and authorizing
+    it, so requests that don't come from Slack are never traced.
+    """
+
+    _start_request_span(req, context)
+    return next()
+
+
+async def trace_request_async(req, context, next):
+    """Bolt middleware starting the trace of a request.
+
+    This is the same as ``trace_request`` but for ``AsyncApp``.
+    """
+
+    _start_request_span(req, context)
+    return await next()
+
+
+@cache
+def trace_listener(function):
+    """Wrap a listener function to record a span around it.
+
+    The wrapper keeps the function's signature for Bolt's argument
+    injection.
+
+    :param function: Listener function, sync or async
+    :return: The wrapped function
+    """
+
+    name = "listener " + function.__name__
+
+    if iscoroutinefunction(function):
+        @wraps(function)
+        async def _traced_async(**kwargs):
+            with span(name):
+                return await function(**kwargs)
+
+        return _traced_async
+
+    @wraps(function)
+    def _traced(**kwargs):
+        with span(name):
+            return function(**kwargs)
+
+    return _traced
+
+
+def slack_api_span(method: str, kwargs: dict):
+    """Record a span around a Slack API call.
+
+    :param method: API method, e.g. ``"chat.postMessage"``
+    :type method: str
+    :param kwargs: Keyword arguments of ``WebClient.api_call``
+    :type kwargs: dict
+    :return: Context manager around the call
+    """
+
+    tracer = default_tracer()
+    if not tracer.enabled or _current.get() is _UNSAMPLED:
+        return nullcontext()
+
+    attributes = {"slack.method": method}
+    for args in (kwargs.get("params"), kwargs.get("json"),
+                 kwargs.get("data")):
+        if isinstance(args, dict) and isinstance(args.get("user"), str):
+            attributes["slack.user_hash"] = tracer.hash_user_id(
+                args["user"])
+            break
+    return tracer.span("slack " + method, CLIENT, attributes)
@@ -0,0 +1,370 @@
+"""Pooled HTTP transport functions.
+
+``slack_sdk``'s ``WebClient`` opens a new TLS connection with ``urllib``
+for every API call. A command makes several calls, so NoPing keeps
+connections to Slack open and reuses them instead.
+
+A failed request is only sent again if Slack can't have acted on it:
+if it failed before it was sent, or if the API method only reads
+(``IDEMPOTENT_METHODS``). Otherwise, e.g. ``chat.postMessage`` could
+post the message twice.
+"""
+
+import http.client
+import io
+import os
+import select
+import ssl
+import threading
+import time
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+
+from slack_sdk import WebClient
+from slack_sdk.http_retry.builtin_handlers import (
+    ConnectionErrorRetryHandler, ServerErrorRetryHandler)
+
+
+# A reused connection may have been closed by Slack while it was idle
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+# API methods that can be sent again after a connection error
+IDEMPOTENT_METHODS = frozenset({
+    "api.test",
+    "auth.test",
+    "users.info",
+    "users.list",
+    "users.profile.get",
+})
+
+
+class UnsentRequestError(URLError):
+    """A request failed before it was completely sent, so Slack can't
+    have acted on it.
+    """
+
+
+def api_method(url: str) -> str:
+    """Get the API method of a Web API URL.
+
+    :param url: URL, e.g. ``"https://slack.com/api/chat.postMessage"``
+    :type url: str
+    :return: The API method, e.g. ``"chat.postMessage"``
+    :rtype: str
+    """
+
+    return urlsplit(url).path.rsplit("/", 1)[-1]
+
+
+def _dropped(conn) -> bool:
+    # An idle keep-alive connection has nothing to read unless Slack
+    # closed it
+    if conn.sock is None:
+        return False
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+class ConnectionStats:
+    """Thread-safe counters for connection reuse."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+
+    def record_request(self, reused: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused += 1
+            else:
+                self.created += 1
+
+    def record_discarded(self) -> None:
+        with self._lock:
+            self.discarded += 1
+
+    def snapshot(self) -> dict:
+        """Get all counters.
+
+        :return: ``requests``, connections ``created``, ``reused`` and
+        ``discarded`` (closed by Slack), and the share of requests that
+        reused a connection
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "created": self.created,
+                "reused": self.reused,
+                "discarded": self.discarded,
+                "reuse_ratio": (
+                    self.reused / self.requests if self.requests else 0.0),
+            }
+
+
+class ConnectionPool:
+    """Keeps idle keep-alive HTTP connections for reuse, per host."""
+
+    def __init__(self, maxsize: int = 10, idle_timeout: float = 50.0,
+                 clock=time.monotonic):
+        """
+        :param maxsize: Maximum number of idle connections to keep per
+        host. More connections are opened if needed, but closed after
+        use.
+        :type maxsize: int
+        :param idle_timeout: Seconds after which an idle connection is
+        closed instead of reused
+        :type idle_timeout: float
+        :param clock: Function returning the current time in seconds
+        """
+
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.stats = ConnectionStats()
+        self._clock = clock
+        self._idle = {}  # (scheme, host, port, ssl) -> [(idle_since, conn)]
+        self._lock = threading.Lock()
+        self._default_context = None
+
+    @classmethod
+    def from_env(cls) -> "ConnectionPool":
+        """Create a pool configured by ``NOPING_HTTP_POOL_SIZE`` and
+        ``NOPING_HTTP_IDLE_TIMEOUT``.
+
+        :return: A new pool
+        :rtype: ConnectionPool
+        """
+
+        return cls(
+            maxsize=int(os.environ.get("NOPING_HTTP_POOL_SIZE", 10)),
+            idle_timeout=float(os.environ.get("NOPING_HTTP_IDLE_TIMEOUT",
+                50)),
+        )
+
+    def __deepcopy__(self, memo):
+        # Bolt copies the client for lazy listeners; connections must
+        # stay shared
+        return self
+
+    def _checkout(self, key, timeout: float):
+        now = self._clock()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                idle_since, conn = idle.pop()  # Most recently used first
+                if _dropped(conn):
+                    self.stats.record_discarded()
+                elif now - idle_since < self.idle_timeout:
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return conn, True
+                conn.close()
+
+        scheme, host, port, context = key
+        if scheme == "https":
+            if context is None:  # Loading the CA certificates is slow
+                if self._default_context is None:
+                    self._default_context = ssl.create_default_context()
+                context = self._default_context
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout,
+                context=context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        return conn, False
+
+    def _checkin(self, key, conn) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((self._clock(), conn))
+                return
+        conn.close()
+
+    def request(self, url: str, body: bytes | None, headers: dict,
+                timeout: float = 30,
+                ssl_context: ssl.SSLContext = None,
+                idempotent: bool = False
+                ) -> tuple[int, str, http.client.HTTPMessage, bytes]:
+        """Make a POST request on a pooled connection.
+
+        If a reused connection turns out to be closed, the request is
+        sent again on another one, but only if it wasn't sent yet or
+        it's ``idempotent``.
+
+        :param url: Complete URL
+        :type url: str
+        :param body: Request body
+        :type body: bytes | None
+        :param headers: Request headers
+        :type headers: dict
+        :param timeout: Socket timeout in seconds
+        :type timeout: float
+        :param ssl_context: SSL context for HTTPS connections
+        :type ssl_context: ssl.SSLContext
+        :param idempotent: Whether the request can be sent twice
+        :type idempotent: bool
+        :return: Status, reason, headers and body of the response
+        :rtype: tuple[int, str, http.client.HTTPMessage, bytes]
+        :raises UnsentRequestError: The request failed before it was sent
+        """
+
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port, ssl_context)
+        path = parts.path + ("?" + parts.query if parts.query else "")
+
+        while True:
+            conn, reused = self._checkout(key, timeout)
+            try:
+                conn.request("POST", path, body=body, headers=headers)
+            except _STALE_CONNECTION_ERRORS as e:
+                conn.close()
+                if not reused:
+                    raise UnsentRequestError(e) from e
+                self.stats.record_discarded()
+                continue  # Try again on another connection
+            except OSError as e:
+                conn.close()
+                raise UnsentRequestError(e) from e
+            except BaseException:
+                conn.close()
+                raise
+
+            try:
+                response = conn.getresponse()
+                data = response.read()
+            except _STALE_CONNECTION_ERRORS:
+                conn.close()
+                # Slack may have acted on it before closing the connection
+                if not (reused and idempotent):
+                    raise
+                self.stats.record_discarded()
+                continue
+            except BaseException:
+                conn.close()
+                raise
+
+            self.stats.record_request(reused)
+            if response.will_close:
+                conn.close()
+            else:
+                self._checkin(key, conn)
+            return response.status, response.reason, response.headers, data
+
+    def close(self) -> None:
+        """Close all idle connections."""
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, conn in connections:
+                conn.close()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_connection_pool() -> ConnectionPool:
+    """Get the process-wide connection pool, creating it from the
+    environment on first use.
+
+    :return: The shared connection pool
+    :rtype: ConnectionPool
+    """
+
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = ConnectionPool.from_env()
+    return _default_pool
+
+
+class SafeConnectionErrorRetryHandler(ConnectionErrorRetryHandler):
+    """Retries connection errors only if Slack can't have acted on the
+    request: it wasn't sent or its API method is idempotent.
+    """
+
+    def _can_retry(self, *, state, request, response=None, error=None
+                   ) -> bool:
+        if not (isinstance(error, UnsentRequestError)
+                or api_method(request.url) in IDEMPOTENT_METHODS):
+            return False
+        return super()._can_retry(state=state, request=request,
+            response=response, error=error)
+
+
+def client_options_from_env() -> dict:
+    """Get ``WebClient`` options configured by ``NOPING_SLACK_API_URL``,
+    ``NOPING_HTTP_TIMEOUT``, ``NOPING_HTTP_RETRIES`` (connection errors)
+    and ``NOPING_HTTP_SERVER_ERROR_RETRIES``.
+
+    Rate limited calls are retried by ``noping.ratelimit`` instead.
+
+    :return: ``base_url``, ``timeout`` and ``retry_handlers``
+    :rtype: dict
+    """
+
+    return {
+        # Only meant for pointing NoPing at a stand-in for testing
+        "base_url": os.environ.get("NOPING_SLACK_API_URL",
+            "https://slack.com/api/"),
+        "timeout": int(os.environ.get("NOPING_HTTP_TIMEOUT", 30)),
+        "retry_handlers": [
+            SafeConnectionErrorRetryHandler(
+                max_retry_count=int(os.environ.get("NOPING_HTTP_RETRIES", 1))),
+            ServerErrorRetryHandler(max_retry_count=int(
+                os.environ.get("NOPING_HTTP_SERVER_ERROR_RETRIES", 0))),
+        ],
+    }
+
+
+class PooledWebClient(WebClient):
+    """A ``WebClient`` that reuses connections from a
+    ``ConnectionPool``.
+    """
+
+    def __init__(self, *args, pool: ConnectionPool = None, **kwargs):
+        # Instead of slack_sdk's default, which retries any request
+        kwargs.setdefault("retry_handlers",
+            [SafeConnectionErrorRetryHandler()])
+        super().__init__(*args, **kwargs)
+        self.pool = pool or default_connection_pool()
+
+    # Private in slack_sdk, which has no option for another opener;
+    # test_transport fails if its signature changes
+    def _perform_urllib_http_request_internal(self, url, req):
+        if self.proxy is not None or not url.lower().startswith("http"):
+            return super()._perform_urllib_http_request_internal(url, req)
+
+        try:
+            status, reason, headers, body = self.pool.request(url, req.data,
+                dict(req.header_items()), self.timeout, self.ssl,
+                idempotent=api_method(url) in IDEMPOTENT_METHODS)
+        except URLError:
+            raise
+        except OSError as e:  # Like urllib, for the retry handlers
+            raise URLError(e) from e
+
+        if status >= 400:  # Handled like urllib's errors
+            raise HTTPError(url, status, reason, headers, io.BytesIO(body))
+        if headers.get_content_type() == "application/gzip":
+            return {"status": status, "headers": headers, "body": body}
+        charset = headers.get_content_charset() or "utf-8"
+        return {
+            "status": status,
+            "headers": headers,
+            "body": body.decode(charset),
+        }
@@ -0,0 +1,473 @@
+"""Slack Block Kit views and blocks.
+
+This module includes the modals and message blocks NoPing sends, shared
+by the sync and async apps.
+
+The static parts of modals are built once on import. Every view is a
+new plain ``dict`` with copies of them, which slack_sdk serializes as
+usual.
+"""
+
+from json import dumps
+
+
+def _copy(value):
+    """Copy a JSON-like value, e.g. static blocks built on import, so a
+    request can't change them for later ones.
+
+    This is much cheaper than ``copy.deepcopy``, which also handles
+    cycles and arbitrary objects.
+    """
+
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _is_rich_text_containers(content: list) -> bool:
+    return bool(content) and content[0]["type"].startswith("rich_text_")
+
+
+def message_blocks(user_id: str, content) -> list:
+    """Build the blocks of a NoPing message.
+
+    :param user_id: User ID of the sender
+    :type user_id: str
+    :param content: Converted message, either mrkdwn text or a list with
+    Slack Block Kit format rich text (either the elements of a single
+    section or whole ``rich_text`` elements like sections and lists)
+    :return: Message blocks, starting with the sender's mention
+    :rtype: list
+    """
+
+    if type(content) == list and _is_rich_text_containers(content):
+        body = {
+            "type": "rich_text",
+            "elements": content,
+        }
+    elif type(content) == list:
+        body = {
+            "type": "rich_text",
+            "elements": [
+                {
+                    "type": "rich_text_section",
+                    "elements": content,
+                }
+            ]
+        }
+    else:
+        body = {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": content,
+            }
+        }
+
+    return [
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"*<@{user_id}>*:"
+                }
+            ]
+        }
+    ] + [body]
+
+
+def get_message_editor_input(view) -> list:
+    """Get the message from the message editor, with every section, list,
+    quote and preformatted block.
+
+    :param view: Submitted view
+    :return: ``rich_text`` elements of the message
+    :rtype: list
+    """
+
+    return view["state"]["values"][view["blocks"][-1]["block_id"]][
+        "rich_text_input-action"]["rich_text_value"]["elements"]
+
+
+# Slack's limit for private_metadata
+PRIVATE_METADATA_MAX_LENGTH = 3000
+
+
+def _editor_metadata(shortcut, names: dict | None) -> str:
+    meta = {
+        "ts": shortcut["message"]["ts"],
+        "ch": shortcut["channel"]["id"],
+    }
+    if not names:
+        return dumps(meta)
+
+    # Keep as many names as fit; the rest are just looked up again
+    meta["names"] = dict(names)
+    private_metadata = dumps(meta)
+    while len(private_metadata) > PRIVATE_METADATA_MAX_LENGTH:
+        keep = len(meta["names"]) * PRIVATE_METADATA_MAX_LENGTH // len(
+            private_metadata)
+        meta["names"] = dict(list(meta["names"].items())[:keep])
+        private_metadata = dumps(meta)
+    return private_metadata
+
+
+_MESSAGE_EDITOR_HEADER = [
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": "Mentions will be depinged unless they're"
+                    r" followed by `\`."
+        },
+    },
+    {
+        "type": "divider"
+    },
+]
+
+
+def message_editor_view(callback_id: str, title: str, shortcut,
+                        names: dict = None) -> dict:
+    """Build the modal for composing a message in reply to a message
+    shortcut.
+
+    :param callback_id: Callback ID of the view submission
+    :type callback_id: str
+    :param title: Title of the modal
+    :type title: str
+    :param shortcut: Message shortcut payload
+    :param names: Profile names by user ID to pass on to the view
+    submission, as far as they fit in ``private_metadata``
+    :type names: dict
+    :return: The modal view
+    :rtype: dict
+    """
+
+    return {
+        "callback_id": callback_id,
+        "private_metadata": _editor_metadata(shortcut, names),
+        "type": "modal",
+        "title": {
+            "type": "plain_text",
+            "text": title,
+        },
+        "submit": {
+            "type": "plain_text",
+            "text": "Submit"
+        },
+        "close": {
+            "type": "plain_text",
+            "text": "Cancel"
+        },
+        "blocks": _copy(_MESSAGE_EDITOR_HEADER) + [
+            {
+                "type": "input",
+                "element": {
+                    "type": "rich_text_input",
+                    "action_id": "rich_text_input-action",
+                },
+                "label": {
+                    "type": "plain_text",
+                    "text": f"<@{shortcut['user']['id']}>:",
+                },
+            },
+        ],
+    }
+
+
+_CANT_ACCESS_CHANNEL_VIEW = {
+    "type": "modal",
+    "title": {
+        "type": "plain_text",
+        "text": "Can't access channel",
+    },
+    "close": {
+        "type": "plain_text",
+        "text": "Close",
+    },
+    "blocks": [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "NoPing is not in this private channel "
+                        "and cannot send messages in it. "
+                        "Try inviting NoPing with `/invite`.",
+            },
+        },
+        { "type": "divider" },
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "plain_text",
+                    "text": "Preview of your message:",
+                    "emoji": False,
+                }
+            ]
+        },
+    ],
+}
+
+
+def cant_access_channel_view(blocks: list) -> dict:
+    """Build the modal shown when a message can't be sent to a private
+    channel.
+
+    :param blocks: Blocks of the message that couldn't be sent
+    :type blocks: list
+    :return: The modal view
+    :rtype: dict
+    """
+
+    view = _copy(_CANT_ACCESS_CHANNEL_VIEW)
+    view["blocks"] += blocks
+    return view
+
+
+_NOTHING_TO_SEND_VIEW = {
+    "type": "modal",
+    "title": {
+        "type": "plain_text",
+        "text": "Can't access channel",
+    },
+    "close": {
+        "type": "plain_text",
+        "text": "Close",
+    },
+    "blocks": [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "There's nothing for me to send in "
+                        "this private channel. To use `/np` "
+                        "to send directly, use `/invite` to "
+                        "add me first. You can also use "
+                        "`/npp` to preview a message in any "
+                        "channel."
+            },
+        },
+    ],
+}
+
+
+def nothing_to_send_view() -> dict:
+    return _copy(_NOTHING_TO_SEND_VIEW)
+
+
+_PREVIEW_HEADER = [
+    {
+        "type": "context",
+        "elements": [{
+            "type": "mrkdwn",
+            "text": "This is only a preview; "
+                    "*your message hasn't been sent yet!*"
+        }],
+    },
+    {
+        "type": "divider",
+    },
+]
+
+
+def preview_header() -> list:
+    """Get the blocks put before a previewed message.
+
+    :return: A copy of the header blocks
+    :rtype: list
+    """
+
+    return _copy(_PREVIEW_HEADER)
+
+
+_PREVIEW_VIEW = {
+    "type": "modal",
+    "title": {
+        "type": "plain_text",
+        "text": "Message preview",
+    },
+    "close": {
+        "type": "plain_text",
+        "text": "Close",
+    },
+}
+
+
+def preview_view(reason: str, blocks: list) -> dict:
+    """Build the modal used by ``/npp`` instead of an ephemeral message.
+
+    :param reason: Why a modal is shown
+    :type reason: str
+    :param blocks: Blocks of the previewed message
+    :type blocks: list
+    :return: The modal view
+    :rtype: dict
+    """
+
+    view = _copy(_PREVIEW_VIEW)
+    view["blocks"] = preview_header() + [
+        {
+            "type": "context",
+            "elements": [{
+                "type": "mrkdwn",
+                "text": reason,
+            }],
+        },
+        {
+            "type": "divider",
+        },
+    ] + blocks
+    return view
+
+
+_NOTHING_TO_PREVIEW_VIEW = {
+    "type": "modal",
+    "title": {
+        "type": "plain_text",
+        "text": "Nothing to preview",
+    },
+    "close": {
+        "type": "plain_text",
+        "text": "Close",
+    },
+    "blocks": [
+        {
+            "type": "section",
+            "text": {
+                "type": "plain_text",
+                "text": "I can't preview an empty string. See "
+                        "my description for usage. "
+                        "You're seeing this because NoPing is "
+                        "not in this private channel."
+            },
+        },
+    ],
+}
+
+
+def nothing_to_preview_view() -> dict:
+    return _copy(_NOTHING_TO_PREVIEW_VIEW)
+
+
+_OUT_OF_ORDER_VIEW = {
+    "type": "modal",
+    "title": {
+        "type": "plain_text",
+        "text": "Out of order",
+    },
+    "close": {
+        "type": "plain_text",
+        "text": "Close",
+    },
+    "blocks": [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "Due to NoPing's \"impersonation\", it cannot "
+                        "delete messages. Use `/npp` to preview "
+                        "messages and manually send them to have "
+                        "control over your messages. "
+                        "Editing is unaffected.",
+            },
+        },
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": "(Slack prevents impersonated messages from "
+                        "being deleted by the bot who sent it. "
+                        "Allowing deletion requires a highly "
+                        "privileged and insecure admin token.)",
+            },
+        }
+    ],
+}
+
+
+def out_of_order_view() -> dict:
+    return _copy(_OUT_OF_ORDER_VIEW)
+
+
+_CANT_EDIT_VIEW = {
+    "type": "modal",
+    "title": {
+        "type": "plain_text",
+        "text": "Can't edit message",
+    },
+    "close": {
+        "type": "plain_text",
+        "text": "Close",
+    },
+    "blocks": [
+        {
+            "type": "section",
+            "text": {
+                "type": "plain_text",
+                "text": "This message wasn't sent using NoPing or"
+                        " was sent by someone else.",
+            },
+        },
+    ],
+}
+
+
+def cant_edit_view() -> dict:
+    return _copy(_CANT_EDIT_VIEW)
+
+
+BUSY_TEXT = "NoPing is busy right now. Please try again in a moment."
+
+_BUSY_VIEW = {
+    "type": "modal",
+    "title": {
+        "type": "plain_text",
+        "text": "NoPing is busy",
+    },
+    "close": {
+        "type": "plain_text",
+        "text": "Close",
+    },
+    "blocks": [
+        {
+            "type": "section",
+            "text": {
+                "type": "plain_text",
+                "text": BUSY_TEXT,
+            },
+        },
+    ],
+}
+
+
+def busy_view() -> dict:
+    return _copy(_BUSY_VIEW)
+
+
+def busy_response_body(body: dict) -> dict | None:
+    """Build the acknowledgement telling a user that NoPing is too busy
+    to handle their request.
+
+    :param body: Request body
+    :type body: dict
+    :return: An ephemeral message for slash commands, an error on the
+    message input for submitted message editors, or None for requests
+    that can't be answered in their acknowledgement (see ``busy_view``)
+    :rtype: dict | None
+    """
+
+    if "command" in body:
+        return {"response_type": "ephemeral", "text": BUSY_TEXT}
+    if body.get("type") == "view_submission":
+        return {"response_action": "errors", "errors": {
+            body["view"]["blocks"][-1]["block_id"]: BUSY_TEXT}}
+    return None
+
+
+RATELIMITED_TEXT = ("Slack is rate limiting NoPing right now."
+                    " Please try again in a moment.")
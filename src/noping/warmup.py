@@ -0,0 +1,134 @@
+"""Profile cache warm-up functions.
+
+Right after a restart every lookup is a cache miss. These functions
+fill the profile cache from ``users.list`` in the background instead.
+"""
+
+import os
+import threading
+
+from noping import profiles, ratelimit
+
+
+def _cacheable_members(members):
+    for user in members:
+        if not user.get("deleted") and "profile" in user:
+            yield user
+
+
+def _warmup_limit(cache: profiles.ProfileCache,
+                  max_profiles: int | None) -> int:
+    if max_profiles is None:
+        max_profiles = int(os.environ.get("NOPING_WARMUP_MAX_PROFILES",
+            cache.maxsize))
+    # Never evict anything that's already cached
+    return min(max_profiles, cache.maxsize - len(cache))
+
+
+def warm_profile_cache(client, cache: profiles.ProfileCache = None,
+                       max_profiles: int = None,
+                       page_size: int = 200) -> int:
+    """Fill the profile cache with active users, one ``users.list``
+    page at a time.
+
+    :param client: Slack client to use
+    :param cache: Profile cache to fill. If None, use the shared cache.
+    :type cache: ProfileCache
+    :param max_profiles: Maximum number of profiles to add. If None,
+    use ``NOPING_WARMUP_MAX_PROFILES`` or fill the cache.
+    :type max_profiles: int
+    :param page_size: Number of users to request per page
+    :type page_size: int
+    :return: Number of profiles added
+    :rtype: int
+    """
+
+    if cache is None:
+        cache = profiles.default_profile_cache()
+
+    limit = _warmup_limit(cache, max_profiles)
+    added = 0
+    cursor = None
+    with ratelimit.background():  # Never hold up anyone waiting
+        while added < limit:
+            page = client.users_list(limit=page_size, cursor=cursor)
+            for user in _cacheable_members(page["members"]):
+                cache.put(user["id"], user["profile"])
+                added += 1
+                if added >= limit:
+                    break
+
+            cursor = page.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                break
+
+    return added
+
+
+async def warm_profile_cache_async(client,
+                                   cache: profiles.ProfileCache = None,
+                                   max_profiles: int = None,
+                                   page_size: int = 200) -> int:
+    """Fill the profile cache with active users, one ``users.list``
+    page at a time.
+
+    This is the same as ``warm_profile_cache`` but for an
+    ``AsyncWebClient``.
+
+    :return: Number of profiles added
+    :rtype: int
+    """
+
+    if cache is None:
+        cache = profiles.default_profile_cache()
+
+    limit = _warmup_limit(cache, max_profiles)
+    added = 0
+    cursor = None
+    with ratelimit.background():
+        while added < limit:
+            page = await client.users_list(limit=page_size, cursor=cursor)
+            for user in _cacheable_members(page["members"]):
+                cache.put(user["id"], user["profile"])
+                added += 1
+                if added >= limit:
+                    break
+
+            cursor = page.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                break
+
+    return added
+
+
+def warmup_enabled() -> bool:
+    # Workspaces installed through OAuth (without SLACK_BOT_TOKEN) fill
+    # their caches as they're used
+    return (os.environ.get("NOPING_WARMUP") == "True"
+            and bool(os.environ.get("SLACK_BOT_TOKEN")))
+
+
+def start_warmup(client, logger) -> threading.Thread | None:
+    """Warm up the shared profile cache in a background thread if
+    ``NOPING_WARMUP`` is ``True``.
+
+    :param client: Slack client to use
+    :param logger: Logger for the result
+    :return: The warm-up thread, or None if warm-up is disabled
+    :rtype: threading.Thread | None
+    """
+
+    if not warmup_enabled():
+        return None
+
+    def _run():
+        try:
+            added = warm_profile_cache(client)
+        except Exception as e:
+            logger.warning(f"Profile cache warm-up failed ({e})")
+        else:
+            logger.info(f"Profile cache warm-up added {added} profiles")
+
+    thread = threading.Thread(target=_run, name="noping-warmup", daemon=True)
+    thread.start()
+    return thread
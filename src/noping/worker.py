@@ -0,0 +1,362 @@
+"""Background processing functions.
+
+Listeners only acknowledge requests right away; the actual work (profile
+lookups and posting) runs in a bounded worker pool so the HTTP response
+never waits for the Slack API.
+
+When the pool is full, ``reject_when_busy`` tells the user to try again
+instead of acknowledging work that would never run. Otherwise it
+reserves a slot for the request's lazy listener, so acknowledged work
+always has room to queue.
+"""
+
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from functools import wraps
+from logging import Logger
+
+from slack_bolt import BoltResponse
+from slack_bolt.lazy_listener.internals import build_runnable_function
+from slack_bolt.lazy_listener.runner import LazyListenerRunner
+
+from noping import metrics, tracing, views
+
+
+RESERVATION_KEY = "noping_worker_reservation"
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the worker queue can't take any more work."""
+
+
+class Reservation:
+    """A queue slot held for the lazy listener of an acknowledged
+    request.
+
+    A reservation that is never used (e.g. the listener has no lazy
+    function) gives its slot back when it is garbage collected.
+    """
+
+    def __init__(self, release):
+        """
+        :param release: Function freeing the slot
+        """
+
+        self._release = release
+        self._lock = threading.Lock()
+        self._taken = False
+
+    def __deepcopy__(self, memo):
+        # Bolt copies the request context for lazy listeners
+        return self
+
+    def take(self) -> bool:
+        """Claim the slot for a job.
+
+        :return: Whether the slot was still free to claim; only the first
+        call gets it
+        :rtype: bool
+        """
+
+        with self._lock:
+            taken, self._taken = self._taken, True
+            return not taken
+
+    def __del__(self):
+        if self.take():
+            self._release()
+
+
+def track_errors(function, errors: list):
+    """Wrap a listener function to keep the error it raises in
+    ``errors``, since Bolt's lazy listener wrappers log and swallow it.
+
+    The wrapper keeps the function's signature for Bolt's argument
+    injection.
+
+    :param function: Listener function, sync or async
+    :param errors: List to append the error to
+    :type errors: list
+    :return: The wrapped function
+    """
+
+    if inspect.iscoroutinefunction(function):
+        @wraps(function)
+        async def _tracked_async(**kwargs):
+            try:
+                return await function(**kwargs)
+            except Exception as e:
+                errors.append(e)
+                raise
+
+        return _tracked_async
+
+    @wraps(function)
+    def _tracked(**kwargs):
+        try:
+            return function(**kwargs)
+        except Exception as e:
+            errors.append(e)
+            raise
+
+    return _tracked
+
+
+class WorkerStats:
+    """Thread-safe counters for queue depth and processing latency."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.processing_seconds_total = 0.0
+        self.processing_seconds_max = 0.0
+
+    def record_queued(self) -> None:
+        with self._lock:
+            self.queued += 1
+
+    def record_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def record_started(self, waited: float) -> None:
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def record_finished(self, took: float, failed: bool = False) -> None:
+        with self._lock:
+            self.running -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self.processing_seconds_total += took
+            self.processing_seconds_max = max(self.processing_seconds_max,
+                took)
+
+    def depth(self) -> int:
+        """Get the number of queued and running jobs.
+
+        :return: Queue depth
+        :rtype: int
+        """
+
+        with self._lock:
+            return self.queued + self.running
+
+    def snapshot(self) -> dict:
+        """Get all counters.
+
+        :return: Queue depth, job counts and wait/processing latency
+        :rtype: dict
+        """
+
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_seconds_avg": (
+                    self.wait_seconds_total / finished if finished else 0.0),
+                "wait_seconds_max": self.wait_seconds_max,
+                "processing_seconds_avg": (
+                    self.processing_seconds_total / finished
+                    if finished else 0.0),
+                "processing_seconds_max": self.processing_seconds_max,
+            }
+
+
+class WorkerPool(Executor):
+    """A thread pool with a bounded queue that keeps ``WorkerStats``."""
+
+    def __init__(self, max_workers: int = 8, max_queue: int = 100):
+        """
+        :param max_workers: Number of worker threads
+        :type max_workers: int
+        :param max_queue: Number of jobs that can wait for a free worker
+        :type max_queue: int
+        """
+
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.stats = WorkerStats()
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+            thread_name_prefix="noping-worker")
+
+    @classmethod
+    def from_env(cls) -> "WorkerPool":
+        """Create a pool configured by ``NOPING_WORKERS`` and
+        ``NOPING_WORKER_QUEUE``.
+
+        :return: A new worker pool
+        :rtype: WorkerPool
+        """
+
+        return cls(
+            max_workers=int(os.environ.get("NOPING_WORKERS", 8)),
+            max_queue=int(os.environ.get("NOPING_WORKER_QUEUE", 100)),
+        )
+
+    def reserve(self) -> Reservation | None:
+        """Reserve a slot for a job that will be submitted with
+        ``submit_reserved``.
+
+        :return: The reservation, or None if the queue is full
+        :rtype: Reservation | None
+        """
+
+        if not self._slots.acquire(blocking=False):
+            return None
+        return Reservation(self._slots.release)
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        if not self._slots.acquire(blocking=False):
+            self.stats.record_rejected()
+            raise QueueFullError("the worker queue is full")
+        return self._submit(True, fn, args, kwargs)
+
+    def submit_reserved(self, reservation: Reservation | None, fn, /,
+                        *args, **kwargs) -> Future:
+        """Submit the job of an acknowledged request. It is never
+        rejected: without a slot reserved for it, it queues past the
+        bound.
+
+        :param reservation: Slot reserved with ``reserve``, or None
+        :type reservation: Reservation | None
+        :param fn: Function to call
+        :return: The job's future
+        :rtype: Future
+        """
+
+        return self._submit(reservation is not None and reservation.take(),
+            fn, args, kwargs)
+
+    def _submit(self, slot: bool, fn, args, kwargs) -> Future:
+        self.stats.record_queued()
+        queued_at = time.monotonic()
+
+        def _run():
+            started_at = time.monotonic()
+            self.stats.record_started(started_at - queued_at)
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.stats.record_finished(time.monotonic() - started_at,
+                    failed)
+                if slot:
+                    self._slots.release()
+
+        try:
+            return self._executor.submit(_run)
+        except BaseException:
+            if slot:
+                self._slots.release()
+            raise
+
+    def drain(self, timeout: float = None) -> bool:
+        """Wait for all queued and running jobs to finish.
+
+        :param timeout: Seconds to wait at most. If None, wait until
+        they finish.
+        :type timeout: float
+        :return: True if all jobs finished
+        :rtype: bool
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.stats.depth():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def shutdown(self, wait: bool = True, *,
+                 cancel_futures: bool = False) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+class WorkerLazyListenerRunner(LazyListenerRunner):
+    """Runs Bolt lazy listeners in a ``WorkerPool``."""
+
+    def __init__(self, logger: Logger, pool: WorkerPool):
+        self.logger = logger
+        self.pool = pool
+
+    def start(self, function, request) -> None:
+        errors = []
+        runnable = tracing.bind(request, build_runnable_function(
+            func=track_errors(metrics.instrument_listener(
+                tracing.trace_listener(function)), errors),
+            logger=self.logger,
+            request=request,
+        ))
+
+        def _run():
+            runnable()
+            if errors:  # Counted as failed by the pool
+                raise errors[0]
+
+        # The request is acknowledged already, so it must not be dropped
+        # (or run here, which would hold back the ack)
+        self.pool.submit_reserved(request.context.get(RESERVATION_KEY),
+            _run)
+
+
+def busy_response(body: dict, client) -> BoltResponse:
+    """Tell a user that NoPing is too busy to handle their request.
+
+    :param body: Request body
+    :type body: dict
+    :param client: Slack client, to show a modal for requests whose
+    acknowledgement can't say anything (message shortcuts)
+    :return: The acknowledgement
+    :rtype: BoltResponse
+    """
+
+    response_body = views.busy_response_body(body)
+    if response_body is None:
+        client.views_open(trigger_id=body["trigger_id"],
+            view=views.busy_view())
+        return BoltResponse(status=200, body="")
+    return BoltResponse(status=200, body=response_body)
+
+
+def reject_when_busy(pool: WorkerPool):
+    """Create a Bolt listener middleware that answers requests with
+    ``busy_response`` instead of acknowledging them when the pool is
+    full, since Slack doesn't redeliver acknowledged requests. Otherwise
+    it reserves a slot for the listener's lazy function.
+
+    :param pool: The pool running the listener's lazy functions
+    :type pool: WorkerPool
+    :return: The middleware
+    """
+
+    def _reject_when_busy(body, client, context, next):
+        reservation = pool.reserve()
+        if reservation is None:
+            pool.stats.record_rejected()
+            return busy_response(body, client)
+        context[RESERVATION_KEY] = reservation
+        return next()
+
+    return _reject_when_busy
@@ -0,0 +1,353 @@
+"""Workspace functions.
+
+With ``SLACK_CLIENT_ID`` and ``SLACK_CLIENT_SECRET`` set, NoPing can be
+installed in any number of workspaces through OAuth instead of using a
+single ``SLACK_BOT_TOKEN``. Every workspace then gets its own Slack
+client, profile cache and rate limit buckets, so a busy workspace can't
+evict another one's profiles or use up its API calls.
+
+Installations (bot tokens) are kept in ``NOPING_INSTALLATION_DIR``,
+by default ``$XDG_DATA_HOME/noping/installations``, which only its owner
+can read. At most ``NOPING_MAX_WORKSPACES`` workspaces are kept in
+memory; the least recently used one is dropped first.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from slack_bolt.authorization.authorize import InstallationStoreAuthorize
+from slack_bolt.oauth.oauth_settings import OAuthSettings
+from slack_sdk.oauth.installation_store import FileInstallationStore
+from slack_sdk.oauth.installation_store.cacheable_installation_store import (
+    CacheableInstallationStore)
+from slack_sdk.oauth.state_store import FileOAuthStateStore
+
+from noping.profiles import ProfileCache
+from noping.ratelimit import RateLimitScheduler, ScheduledWebClient
+
+# Bot scopes NoPing needs, unless SLACK_SCOPES says otherwise
+SCOPES = ("chat:write", "chat:write.customize", "commands",
+          "users.profile:read", "users:read")
+
+_logger = logging.getLogger(__name__)
+
+
+def oauth_enabled() -> bool:
+    """Check whether NoPing is installed through OAuth.
+
+    :return: Whether ``SLACK_CLIENT_ID`` is set and ``SLACK_BOT_TOKEN``
+    isn't
+    :rtype: bool
+    """
+
+    return bool(os.environ.get("SLACK_CLIENT_ID")
+                and not os.environ.get("SLACK_BOT_TOKEN"))
+
+
+def _installation_dir() -> str:
+    path = os.environ.get("NOPING_INSTALLATION_DIR")
+    if not path:  # Outside the code, unlike ./data
+        data_home = (os.environ.get("XDG_DATA_HOME")
+                     or os.path.join(os.path.expanduser("~"), ".local",
+                                     "share"))
+        path = os.path.join(data_home, "noping", "installations")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if os.stat(path).st_mode & 0o077:
+        _logger.warning(f"{path} keeps bot tokens but others can access"
+                        f" it; run chmod 700 on it")
+    return path
+
+
+def _oauth_settings_options() -> dict:
+    return {
+        "client_id": os.environ["SLACK_CLIENT_ID"],
+        "client_secret": os.environ["SLACK_CLIENT_SECRET"],
+        "scopes": os.environ.get("SLACK_SCOPES", ",".join(SCOPES)),
+        "installation_store_bot_only": True,
+        "state_store": FileOAuthStateStore(expiration_seconds=600,
+            base_dir=os.path.join(_installation_dir(), "states")),
+    }
+
+
+def _file_installation_store() -> FileInstallationStore:
+    # Only the latest installation of each workspace is kept
+    return FileInstallationStore(base_dir=_installation_dir(),
+        historical_data_enabled=False)
+
+
+def oauth_options(client) -> dict:
+    """Get the ``App`` options for installing through OAuth.
+
+    Installations are cached in memory, and so is ``auth.test`` for each
+    bot token, so requests don't read files or call Slack to authorize.
+
+    :param client: The app's client
+    :return: ``oauth_settings``, ``installation_store`` and
+    ``authorize``
+    :rtype: dict
+    """
+
+    store = CacheableInstallationStore(_file_installation_store())
+    return {
+        "oauth_settings": OAuthSettings(installation_store=store,
+            **_oauth_settings_options()),
+        "installation_store": store,
+        "authorize": InstallationStoreAuthorize(logger=_logger,
+            installation_store=store, bot_only=True, cache_enabled=True,
+            client=client),
+    }
+
+
+def oauth_options_async(client) -> dict:
+    """Get the ``AsyncApp`` options for installing through OAuth.
+
+    This is the same as ``oauth_options`` but for the asyncio app.
+
+    :param client: The app's client
+    :return: ``oauth_settings``, ``installation_store`` and
+    ``authorize``
+    :rtype: dict
+    """
+
+    from slack_bolt.authorization.async_authorize import (
+        AsyncInstallationStoreAuthorize)
+    from slack_bolt.oauth.async_oauth_settings import AsyncOAuthSettings
+    from slack_sdk.oauth.installation_store.async_cacheable_installation_store import (
+        AsyncCacheableInstallationStore)
+
+    store = AsyncCacheableInstallationStore(_file_installation_store())
+    return {
+        "oauth_settings": AsyncOAuthSettings(installation_store=store,
+            **_oauth_settings_options()),
+        "installation_store": store,
+        "authorize": AsyncInstallationStoreAuthorize(logger=_logger,
+            installation_store=store, bot_only=True, cache_enabled=True,
+            client=client),
+    }
+
+
+def workspace_id(context) -> str | None:
+    """Get the ID a request's installation is kept by.
+
+    :param context: Bolt request context
+    :return: The team ID, or the enterprise ID for org-wide installations
+    :rtype: str | None
+    """
+
+    return context.team_id or context.enterprise_id
+
+
+class Workspace:
+    """The profile cache, rate limit scheduler and client of one
+    workspace.
+    """
+
+    def __init__(self, team_id: str, profile_cache: ProfileCache,
+                 scheduler: RateLimitScheduler):
+        self.team_id = team_id
+        self.profile_cache = profile_cache
+        self.scheduler = scheduler
+        self.client = None
+
+
+def workspace_profile_cache(team_id: str) -> ProfileCache:
+    """Create a workspace's profile cache from the environment. If
+    ``NOPING_SHARED_PROFILE_CACHE`` is set, it's a ``SharedProfileCache``
+    shared with other processes, in a segment of its own.
+
+    :param team_id: Team (or enterprise) ID
+    :type team_id: str
+    :return: A new profile cache
+    :rtype: ProfileCache
+    """
+
+    name = os.environ.get("NOPING_SHARED_PROFILE_CACHE")
+    if not name:
+        return ProfileCache.from_env()
+
+    from noping.shared_profiles import SharedProfileCache
+
+    return SharedProfileCache.from_env(f"{name}-{team_id}")
+
+
+def _delete_profile_cache(workspace: Workspace) -> None:
+    # Deletes a shared segment so dropped workspaces don't keep /dev/shm
+    # memory; clients still in use keep the mapping until they're done
+    unlink = getattr(workspace.profile_cache, "unlink", None)
+    if unlink is not None:
+        unlink()
+
+
+class WorkspaceRegistry:
+    """Creates and keeps a ``Workspace`` for every team NoPing is used
+    in, up to ``maxsize`` of them.
+    """
+
+    def __init__(self, client_class=ScheduledWebClient,
+                 client_options: dict = None,
+                 cache_factory=workspace_profile_cache,
+                 scheduler_factory=RateLimitScheduler.from_env,
+                 maxsize: int = 1000):
+        """
+        :param client_class: ``ScheduledWebClient`` or
+        ``AsyncScheduledWebClient``
+        :param client_options: Options for every client, e.g. from
+        ``transport.client_options_from_env()``
+        :type client_options: dict
+        :param cache_factory: Function creating a workspace's profile
+        cache from its team ID
+        :param scheduler_factory: Function creating a workspace's rate
+        limit scheduler
+        :param maxsize: Maximum number of workspaces to keep; the least
+        recently used one is dropped first, deleting its shared profile
+        cache (if any)
+        :type maxsize: int
+        """
+
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.client_class = client_class
+        self.client_options = client_options or {}
+        self.cache_factory = cache_factory
+        self.scheduler_factory = scheduler_factory
+        self.maxsize = maxsize
+        self.evictions = 0
+        self._workspaces = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, client_class=ScheduledWebClient,
+                 client_options: dict = None) -> "WorkspaceRegistry":
+        """Create a registry keeping up to ``NOPING_MAX_WORKSPACES``
+        workspaces.
+
+        :param client_class: ``ScheduledWebClient`` or
+        ``AsyncScheduledWebClient``
+        :param client_options: Options for every client
+        :type client_options: dict
+        :return: A new registry
+        :rtype: WorkspaceRegistry
+        """
+
+        return cls(client_class, client_options,
+            maxsize=int(os.environ.get("NOPING_MAX_WORKSPACES", 1000)))
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def workspace(self, team_id: str) -> Workspace:
+        """Get a team's workspace, creating it the first time.
+
+        :param team_id: Team (or enterprise) ID
+        :type team_id: str
+        :return: The workspace
+        :rtype: Workspace
+        """
+
+        with self._lock:
+            workspace = self._workspaces.get(team_id)
+            if workspace is not None:
+                self._workspaces.move_to_end(team_id)
+                return workspace
+
+            workspace = self._workspaces[team_id] = Workspace(team_id,
+                self.cache_factory(team_id), self.scheduler_factory())
+            evicted = None
+            if len(self._workspaces) > self.maxsize:
+                _, evicted = self._workspaces.popitem(last=False)
+                self.evictions += 1
+        if evicted is not None:
+            _delete_profile_cache(evicted)
+        return workspace
+
+    def client(self, team_id: str, token: str):
+        """Get the client for a team's bot token.
+
+        The client uses the team's profile cache and rate limit
+        scheduler, and is reused until the token changes.
+
+        :param team_id: Team (or enterprise) ID
+        :type team_id: str
+        :param token: The team's bot token
+        :type token: str
+        :return: The team's client
+        """
+
+        workspace = self.workspace(team_id)
+        client = workspace.client
+        if client is None or client.token != token:
+            client = workspace.client = self.client_class(token=token,
+                scheduler=workspace.scheduler,
+                profile_cache=workspace.profile_cache,
+                **self.client_options)
+        return client
+
+    def forget(self, team_id: str) -> bool:
+        """Drop a team's workspace, e.g. after NoPing is uninstalled,
+        deleting its shared profile cache (if any).
+
+        :param team_id: Team (or enterprise) ID
+        :type team_id: str
+        :return: Whether there was a workspace
+        :rtype: bool
+        """
+
+        with self._lock:
+            workspace = self._workspaces.pop(team_id, None)
+        if workspace is None:
+            return False
+        _delete_profile_cache(workspace)
+        return True
+
+    def stats(self) -> dict:
+        """Get totals over all workspaces.
+
+        :return: Number of ``workspaces`` and workspaces evicted
+        (``evictions``), cached ``profiles``, cache ``hits`` and
+        ``misses``, and API ``calls`` and ``ratelimited`` calls
+        :rtype: dict
+        """
+
+        with self._lock:
+            workspaces = list(self._workspaces.values())
+            evictions = self.evictions
+        totals = {"workspaces": len(workspaces), "evictions": evictions,
+                  "profiles": 0, "hits": 0, "misses": 0, "calls": 0,
+                  "ratelimited": 0}
+        for workspace in workspaces:
+            cache_stats = workspace.profile_cache.stats()
+            scheduler_stats = workspace.scheduler.stats()
+            totals["profiles"] += cache_stats["size"]
+            totals["hits"] += cache_stats["hits"]
+            totals["misses"] += cache_stats["misses"]
+            totals["calls"] += scheduler_stats["calls"]
+            totals["ratelimited"] += scheduler_stats["ratelimited"]
+        return totals
+
+    def profile_cache_stats(self) -> dict:
+        """Get the profile cache counters added up over all workspaces.
+
+        :return: The counters of ``ProfileCache.stats``, with the hit
+        ratio of all lookups
+        :rtype: dict
+        """
+
+        with self._lock:
+            caches = [workspace.profile_cache
+                      for workspace in self._workspaces.values()]
+        totals = {"size": 0, "maxsize": 0, "hits": 0, "misses": 0,
+                  "evictions": 0, "expirations": 0, "negative_size": 0,
+                  "negative_hits": 0}
+        for cache in caches:
+            cache_stats = cache.stats()
+            for key in totals:
+                totals[key] += cache_stats[key]
+        lookups = totals["hits"] + totals["misses"]
+        totals["hit_ratio"] = totals["hits"] / lookups if lookups else 0.0
+        return totals
+
+    def __len__(self) -> int:
+        return len(self._workspaces)
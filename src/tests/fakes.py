@@ -0,0 +1,129 @@
+"""Fakes shared by the tests."""
+
+import asyncio
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web import SlackResponse
+
+from noping.profiles import ProfileCache
+
+
+def api_error(error, status_code=200, headers=None, method=""):
+    return SlackApiError(error, SlackResponse(
+        client=None,
+        http_verb="POST",
+        api_url=method,
+        req_args={},
+        data={"ok": False, "error": error},
+        headers=headers or {},
+        status_code=status_code,
+    ))
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def named_profile(user):
+    return {"display_name": f"Name {user}"}
+
+
+class FakeClient:
+    """Slack client recording its calls as ``(method, kwargs)``.
+
+    :param token: Bot token
+    :param bot_id: Bot ID returned by ``auth.test``
+    :param team_id: Team ID returned by ``auth.test``
+    :param profile: Makes the profile of a user ID for
+    ``users.profile.get``, or raises
+    :param errors: Error returned by each method, e.g.
+    ``{"views.open": "ratelimited"}``
+    :param gate: Event that ``auth.test`` waits for
+    """
+
+    def __init__(self, token="xoxb-test", bot_id="B1", team_id="T1",
+                 profile=named_profile, errors=None, gate=None):
+        self.token = token
+        self.bot_id = bot_id
+        self.team_id = team_id
+        self.profile = profile
+        self.errors = errors or {}
+        self.gate = gate
+        self.calls = []
+        self.profile_cache = ProfileCache()
+
+    def called(self, method):
+        return [kwargs for name, kwargs in self.calls if name == method]
+
+    def looked_up(self):
+        return [kwargs["user"] for kwargs in self.called("users.profile.get")]
+
+    def _call(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        error = self.errors.get(method)
+        if error:
+            raise api_error(error, 429 if error == "ratelimited" else 200,
+                method=method)
+
+    def auth_test(self):
+        self._call("auth.test")
+        if self.gate is not None:
+            self.gate.wait()
+        return FakeResponse({"bot_id": self.bot_id, "user_id": "UBOT",
+                             "team_id": self.team_id})
+
+    def views_open(self, **kwargs):
+        self._call("views.open", **kwargs)
+
+    def chat_postEphemeral(self, **kwargs):
+        self._call("chat.postEphemeral", **kwargs)
+
+    def chat_postMessage(self, **kwargs):
+        self._call("chat.postMessage", **kwargs)
+
+    def chat_update(self, **kwargs):
+        self._call("chat.update", **kwargs)
+
+    def users_profile_get(self, user):
+        self._call("users.profile.get", user=user)
+        return FakeResponse({"profile": self.profile(user)})
+
+
+class FakeAsyncClient(FakeClient):
+    # Each call lets other tasks run, like a request would
+
+    async def auth_test(self):
+        await asyncio.sleep(0.01)
+        return super().auth_test()
+
+    async def views_open(self, **kwargs):
+        await asyncio.sleep(0)
+        super().views_open(**kwargs)
+
+    async def chat_postEphemeral(self, **kwargs):
+        await asyncio.sleep(0)
+        super().chat_postEphemeral(**kwargs)
+
+    async def chat_postMessage(self, **kwargs):
+        await asyncio.sleep(0)
+        super().chat_postMessage(**kwargs)
+
+    async def chat_update(self, **kwargs):
+        await asyncio.sleep(0)
+        super().chat_update(**kwargs)
+
+    async def users_profile_get(self, user):
+        await asyncio.sleep(0)
+        return super().users_profile_get(user)
@@ -0,0 +1,63 @@
+import unittest
+
+from slack_bolt import BoltRequest
+
+from noping.idempotency import *
+from tests.fakes import FakeClock
+
+
+class TestIdempotencyStore(unittest.TestCase):
+    def test_duplicates(self):
+        store = IdempotencyStore()
+        self.assertFalse(store.check("trigger:1"))
+        self.assertTrue(store.check("trigger:1", retry=True))
+        self.assertFalse(store.check("trigger:2"))
+        self.assertEqual(store.stats(), {
+            "keys": 2,
+            "checked": 3,
+            "retries": 1,
+            "suppressed": 1,
+        })
+
+    def test_window(self):
+        clock = FakeClock()
+        store = IdempotencyStore(ttl=10, clock=clock)
+        store.check("trigger:1")
+        clock.now = 10
+        self.assertFalse(store.check("trigger:1"))
+
+    def test_bounded(self):
+        store = IdempotencyStore(maxsize=2)
+        for key in ("a", "b", "c"):
+            store.check(key)
+        self.assertEqual(len(store), 2)
+        self.assertFalse(store.check("a"))
+
+    def test_forget(self):
+        store = IdempotencyStore()
+        store.check("trigger:1")
+        store.forget("trigger:1")
+        self.assertFalse(store.check("trigger:1"))
+
+
+class TestDeliveries(unittest.TestCase):
+    def test_delivery_key(self):
+        self.assertEqual(delivery_key({"event_id": "Ev1"}), "event:Ev1")
+        self.assertEqual(delivery_key({"trigger_id": "1.2", "view": {
+            "id": "V1"}}), "trigger:1.2")
+        self.assertEqual(delivery_key({"view": {"id": "V1", "hash": "h"}}),
+            "view:V1:h")
+        self.assertIsNone(delivery_key({"type": "url_verification"}))
+
+    def test_is_duplicate(self):
+        store = IdempotencyStore()
+        body = "command=%2Fnp&text=hi&trigger_id=1.2"
+        first = BoltRequest(body=body)
+        retry = BoltRequest(body=body, headers={"x-slack-retry-num": ["1"]})
+        self.assertFalse(is_duplicate(first, store))
+        self.assertTrue(is_duplicate(retry, store))
+        self.assertEqual(store.stats()["retries"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+
+from noping import identity
+from noping.identity import *
+from tests.fakes import FakeAsyncClient, FakeClient
+
+
+class TestIdentity(unittest.TestCase):
+    def setUp(self):
+        forget_bot_identities()
+
+    def test_get_bot_identity(self):
+        client = FakeClient("xoxb-1", "B1")
+        self.assertEqual(get_bot_identity(client)["bot_id"], "B1")
+        self.assertEqual(get_bot_identity(client)["bot_id"], "B1")
+        self.assertEqual(len(client.called("auth.test")), 1)
+
+    def test_rotated_token(self):
+        get_bot_identity(FakeClient("xoxb-1", "B1"))
+        rotated = FakeClient("xoxb-2", "B2")
+        self.assertEqual(get_bot_identity(rotated)["bot_id"], "B2")
+        rotated.bot_id = "B3"
+        self.assertEqual(refresh_bot_identity(rotated)["bot_id"], "B3")
+        self.assertEqual(get_bot_identity(rotated)["bot_id"], "B3")
+
+    def test_token_not_kept(self):
+        get_bot_identity(FakeClient("xoxb-secret", "B1"))
+        self.assertNotIn("xoxb-secret", identity._identities)
+        self.assertNotIn("xoxb-secret", repr(identity._identities))
+
+    def test_bounded(self):
+        with mock.patch.dict(os.environ, {"NOPING_MAX_WORKSPACES": "2"}):
+            first = FakeClient("xoxb-1", "B1")
+            get_bot_identity(first)
+            get_bot_identity(FakeClient("xoxb-2", "B2"))
+            get_bot_identity(first)  # Now the most recently used
+            get_bot_identity(FakeClient("xoxb-3", "B3"))
+            self.assertEqual(stats()["cached"], 2)
+            get_bot_identity(first)
+            self.assertEqual(len(first.called("auth.test")), 1)
+
+    def test_forget_team(self):
+        one = FakeClient("xoxb-1", "B1", "T1")
+        two = FakeClient("xoxb-2", "B2", "T2")
+        get_bot_identity(one)
+        get_bot_identity(two)
+        forget_bot_identities("T1")
+        get_bot_identity(one)
+        get_bot_identity(two)
+        self.assertEqual(len(one.called("auth.test")), 2)
+        self.assertEqual(len(two.called("auth.test")), 1)
+
+    def test_single_flight(self):
+        gate = threading.Event()
+        client = FakeClient("xoxb-1", "B1", gate=gate)
+        results = []
+        shared = identity_flight.stats()["shared"]
+        threads = [threading.Thread(
+            target=lambda: results.append(get_bot_identity(client)))
+            for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while identity_flight.stats()["shared"] < shared + 2:
+            time.sleep(0.001)
+        gate.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(client.called("auth.test")), 1)
+        self.assertEqual([result["bot_id"] for result in results],
+            ["B1"] * 3)
+
+    def test_single_flight_async(self):
+        client = FakeAsyncClient("xoxb-1", "B1")
+
+        async def _get():
+            return await asyncio.gather(
+                *(get_bot_identity_async(client) for _ in range(3)))
+
+        results = asyncio.run(_get())
+        self.assertEqual(len(client.called("auth.test")), 1)
+        self.assertEqual([result["bot_id"] for result in results],
+            ["B1"] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+from urllib.error import URLError
+
+from slack_bolt import App
+from slack_sdk.errors import SlackApiError
+
+import noping.__main__ as main
+import noping.async_app as async_app
+from tests.fakes import FakeAsyncClient, FakeClient
+
+ENV = {
+    "SLACK_BOT_TOKEN": "xoxb-test",
+    "SLACK_SIGNING_SECRET": "test",
+    # Nothing listens here, so any API call fails
+    "NOPING_SLACK_API_URL": "http://127.0.0.1:9/api/",
+    "NOPING_HTTP_RETRIES": "0",
+}
+
+
+class TestCreateApp(unittest.TestCase):
+    def test_import_builds_nothing(self):
+        self.assertFalse(hasattr(main, "app"))
+        self.assertIsNone(main._default_app)
+
+    def test_no_token_check(self):
+        with mock.patch.dict(os.environ, ENV):
+            app = main.create_app()
+        self.assertIsInstance(app, App)
+        self.assertEqual(app.client.base_url, ENV["NOPING_SLACK_API_URL"])
+
+    def test_token_check(self):
+        with mock.patch.dict(os.environ, ENV):
+            with self.assertRaises(URLError):
+                main.create_app(token_verification_enabled=True)
+
+    def test_flask_app_factory(self):
+        from noping import flask_app
+
+        with (mock.patch.dict(os.environ, ENV),
+              mock.patch.object(main, "_default_app", None),
+              mock.patch.object(flask_app, "_handler", None),
+              mock.patch.object(flask_app.warmup, "start_warmup") as start):
+            app = flask_app.create_flask_app()
+            # Ready before the first request
+            self.assertIsNotNone(flask_app._handler)
+            start.assert_called_once()
+        self.assertIn("/slack/events",
+            [rule.rule for rule in app.url_map.iter_rules()])
+
+    def test_oauth(self):
+        env = ENV | {"SLACK_CLIENT_ID": "1.2", "SLACK_CLIENT_SECRET": "test",
+                     "NOPING_INSTALLATION_DIR": tempfile.mkdtemp()}
+        del env["SLACK_BOT_TOKEN"]
+        with mock.patch.dict(os.environ, env):
+            os.environ.pop("SLACK_BOT_TOKEN", None)
+            app = main.create_app()
+        self.assertIsNotNone(app.oauth_flow)
+        self.assertIsNotNone(app.installation_store)
+
+
+# No user can be looked up
+UNRESOLVABLE = {"users.profile.get": "user_not_found"}
+
+COMMAND = {
+    "command": "/np",
+    "text": "hi <@U2|two>",
+    "user_id": "U1",
+    "team_id": "T1",
+    "team_domain": "workspace",
+    "channel_id": "C1",
+    "trigger_id": "1.2.abc",
+}
+SHORTCUT = {
+    "trigger_id": "1.2.abc",
+    "channel": {"id": "C1"},
+    "user": {"id": "U1"},
+    "message": {"ts": "1.2", "text": "hi"},
+}
+EDITOR = {
+    "private_metadata": json.dumps(
+        {"ch": "C1", "ts": "1.2", "names": {"U2": "old"}}),
+    "blocks": [{"block_id": "input"}],
+    "state": {"values": {"input": {"rich_text_input-action": {
+        "rich_text_value": {"elements": [{
+            "type": "rich_text_section",
+            "elements": [{"type": "user", "user_id": "U2"}],
+        }]},
+    }}}},
+}
+BODY = {"user": {"id": "U1"}, "team": {"domain": "workspace"}}
+
+
+class TestHandlers(unittest.TestCase):
+    def test_ratelimited_modal(self):
+        client = FakeClient(errors={"views.open": "ratelimited"})
+        main.reply_thread(client, SHORTCUT)
+        self.assertEqual(client.calls[-1], ("chat.postEphemeral", {
+            "text": main.views.RATELIMITED_TEXT,
+            "channel": "C1",
+            "user": "U1",
+        }))
+
+        client = FakeClient(errors={"views.open": "expired_trigger_id"})
+        with self.assertRaises(SlackApiError):
+            main.reply_thread(client, SHORTCUT)
+        self.assertEqual(len(client.calls), 1)
+
+    def test_unresolvable_sender(self):
+        for policy in ("lookup", "embedded"):
+            with mock.patch.dict(os.environ,
+                    {"NOPING_RESOLUTION_POLICY": policy}):
+                client = FakeClient(errors=UNRESOLVABLE)
+                main.np(client, COMMAND)
+                method, message = client.calls[-1]
+                self.assertEqual(method, "chat.postMessage")
+                self.assertEqual(message["username"], "U1")
+                self.assertNotIn("icon_url", message)
+
+                client = FakeAsyncClient(errors=UNRESOLVABLE)
+                asyncio.run(async_app.np(client, COMMAND))
+                self.assertEqual(client.calls[-1][1]["username"], "U1")
+
+    def test_edit_uses_workspace_cache(self):
+        logger = logging.getLogger(__name__)
+        client = FakeClient(errors=UNRESOLVABLE)
+        client.profile_cache.put("U2", {"display_name": "new"})
+        main.handle_edit_message(client, EDITOR, BODY, logger)
+        self.assertIn("@new", json.dumps(client.calls[-1][1]["blocks"]))
+
+        client = FakeAsyncClient(errors=UNRESOLVABLE)
+        client.profile_cache.put("U2", {"display_name": "new"})
+        asyncio.run(async_app.handle_edit_message(client, EDITOR, BODY,
+            logger))
+        self.assertIn("@new", json.dumps(client.calls[-1][1]["blocks"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from noping import profiles, resolution
+from noping.messages import *
+
+
+class TestMessages(unittest.TestCase):
+    def test_users_to_look_up(self):
+        self.assertEqual(users_to_look_up("U1", ["U2"]), ["U1", "U2"])
+        self.assertEqual(users_to_look_up(None, ["U2"]), ["U2"])
+        self.assertEqual(users_to_look_up("U1", ["U2"], resolution.CACHED),
+            ["U1"])
+
+    def test_lookup_result(self):
+        found = {"U1": profiles.slim_profile({"real_name": "One"}),
+                 "U2": profiles.slim_profile({"display_name": "two"})}
+        cache = profiles.ProfileCache()
+        profile, names = lookup_result(found, "U1", ["U2", "U3"],
+            resolution.LOOKUP, cache)
+        self.assertEqual(profile, found["U1"])
+        self.assertEqual(names, {"U2": "two"})
+
+        profile, names = lookup_result({}, "U1", ["U2"], resolution.EMBEDDED,
+            cache)
+        self.assertEqual(profile, profiles.unknown_profile("U1"))
+        self.assertEqual(names, {})
+        self.assertEqual(lookup_result({}, None, [], resolution.LOOKUP,
+            cache), (None, {}))
+
+    def test_noping_message(self):
+        message = noping_message(profiles.unknown_profile("U1"), "U1", [])
+        self.assertEqual(message["username"], "U1")
+        self.assertNotIn("icon_url", message)
+        message = noping_message(profiles.slim_profile(
+            {"real_name": "One", "image_512": "https://a/b.png"}), "U1", [])
+        self.assertEqual(message["icon_url"], "https://a/b.png")
+
+    def test_preview_request(self):
+        self.assertEqual(preview_request("-m hi -m"), ("hi -m", True))
+        self.assertEqual(preview_request("hi -m there"),
+            ("hi -m there", False))
@@ -0,0 +1,148 @@
+import asyncio
+import math
+import os
+import unittest
+from unittest import mock
+
+from slack_sdk.errors import SlackApiError
+
+from noping.metrics import *
+from tests.fakes import api_error
+
+
+class TestHistogram(unittest.TestCase):
+    def test_quantile(self):
+        histogram = Histogram(buckets=(1.0, 2.0, 4.0))
+        self.assertTrue(math.isnan(histogram.quantile(0.5)))
+        for value in (0.5, 1.5, 1.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [1, 2, 1, 0])
+        self.assertAlmostEqual(histogram.quantile(0.5), 1.5)
+        self.assertAlmostEqual(histogram.quantile(1.0), 4.0)
+
+    def test_overflow(self):
+        histogram = Histogram(buckets=(1.0,))
+        histogram.observe(10.0)
+        self.assertEqual(histogram.quantile(0.99), 1.0)
+
+
+class TestRegistry(unittest.TestCase):
+    def test_render(self):
+        registry = Registry()
+        registry.describe("noping_test_duration_seconds", "Test")
+        registry.observe("noping_test_duration_seconds", 0.02, kind="a")
+        registry.inc("noping_test_errors_total", kind="a")
+        registry.register_stats("cache", lambda: {"hits": 3,
+                                                  "hit_ratio": 0.75})
+        text = registry.render()
+        self.assertIn("# HELP noping_test_duration_seconds Test\n", text)
+        self.assertIn("# TYPE noping_test_duration_seconds histogram\n",
+                      text)
+        self.assertIn('noping_test_duration_seconds_bucket{kind="a",'
+                      'le="0.01"} 0\n', text)
+        self.assertIn('noping_test_duration_seconds_bucket{kind="a",'
+                      'le="0.025"} 1\n', text)
+        self.assertIn('noping_test_duration_seconds_bucket{kind="a",'
+                      'le="+Inf"} 1\n', text)
+        self.assertIn('noping_test_duration_seconds_count{kind="a"} 1\n',
+                      text)
+        self.assertIn('noping_test_errors_total{kind="a"} 1\n', text)
+        self.assertIn("noping_cache_hits 3\n", text)
+        self.assertIn("noping_cache_hit_ratio 0.75\n", text)
+
+    def test_register_stats_replaces(self):
+        registry = Registry()
+        registry.register_stats("cache", lambda: {"hits": 1})
+        registry.register_stats("cache", lambda: {"hits": 2}, ("hits",))
+        text = registry.render()
+        self.assertIn("noping_cache_hits 2\n", text)
+        self.assertNotIn("noping_cache_hits 1\n", text)
+        self.assertEqual(registry.summary(), "cache.hits=2")
+
+
+class TestInstrumentation(unittest.TestCase):
+    def test_instrument_listener(self):
+        def failing_listener(body):
+            raise ValueError(body)
+
+        instrumented = instrument_listener(failing_listener)
+        self.assertIs(instrument_listener(failing_listener), instrumented)
+        self.assertIs(inspect.unwrap(instrumented), failing_listener)
+        before = REGISTRY.counter("noping_listener_errors_total",
+                                  listener="failing_listener")
+        with self.assertRaises(ValueError):
+            instrumented(body="x")
+        self.assertEqual(REGISTRY.counter("noping_listener_errors_total",
+                                          listener="failing_listener"),
+                         before + 1)
+        self.assertGreaterEqual(REGISTRY.histogram(
+            "noping_listener_duration_seconds",
+            listener="failing_listener").count, 1)
+
+    def test_instrument_async_listener(self):
+        async def async_listener(body):
+            return body
+
+        instrumented = instrument_listener(async_listener)
+        self.assertTrue(inspect.iscoroutinefunction(instrumented))
+        self.assertEqual(asyncio.run(instrumented(body="x")), "x")
+
+    def test_slack_api_call_errors(self):
+        labels = {"method": "test.method", "error": "channel_not_found"}
+        before = REGISTRY.counter("noping_slack_api_errors_total", **labels)
+        with self.assertRaises(SlackApiError):
+            with slack_api_call("test.method"):
+                raise api_error("channel_not_found")
+        with self.assertRaises(TimeoutError):
+            with slack_api_call("test.method"):
+                raise TimeoutError()
+        self.assertEqual(REGISTRY.counter("noping_slack_api_errors_total",
+                                          **labels), before + 1)
+        self.assertEqual(REGISTRY.counter("noping_slack_api_errors_total",
+            method="test.method", error="TimeoutError"), 1)
+
+    def test_timed_dispatch(self):
+        class FakeRequest:
+            body = {"command": "/npp"}
+
+        class FakeResponse:
+            def __init__(self, status):
+                self.status = status
+
+        before = REGISTRY.histogram("noping_ack_duration_seconds",
+                                    request="/npp")
+        before = before.count if before else 0
+        dispatch = timed_dispatch(lambda req: FakeResponse(200))
+        self.assertEqual(dispatch(FakeRequest()).status, 200)
+        # Requests failing signature verification aren't recorded
+        timed_dispatch(lambda req: FakeResponse(401))(FakeRequest())
+        self.assertEqual(REGISTRY.histogram("noping_ack_duration_seconds",
+                                            request="/npp").count, before + 1)
+
+    def test_request_kind(self):
+        self.assertEqual(request_kind({"command": "/np"}), "/np")
+        self.assertEqual(request_kind({"type": "view_submission", "view": {
+            "callback_id": "edit_message"}}), "edit_message")
+        self.assertEqual(request_kind({"event": {"type": "user_change"}}),
+                         "user_change")
+        # Unknown (e.g. made up) values don't become label values
+        for body in ({"command": "/random"}, {"event": {"type": "x" * 99}},
+                     {"event": "user_change"}, {"view": "edit_message"},
+                     {"callback_id": ["edit_message"]}, {}):
+            self.assertEqual(request_kind(body), "other")
+
+class TestMetricsRoute(unittest.TestCase):
+    def test_access_control(self):
+        from noping.flask_app import flask_app
+
+        client = flask_app.test_client()
+        with mock.patch.dict(os.environ, {"NOPING_METRICS_TOKEN": ""}):
+            self.assertEqual(client.get("/metrics").status_code, 404)
+        with mock.patch.dict(os.environ, {"NOPING_METRICS_TOKEN": "secret"}):
+            self.assertEqual(client.get("/metrics").status_code, 401)
+            self.assertEqual(client.get("/metrics", headers={
+                "Authorization": "Bearer wrong"}).status_code, 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
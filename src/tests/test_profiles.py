@@ -0,0 +1,116 @@
+import unittest
+
+from noping.profiles import *
+from tests.fakes import FakeAsyncClient, FakeClient, FakeClock, api_error
+
+
+def real_profile(user):
+    if user.startswith("X"):  # External users
+        raise api_error("user_not_found")
+    return {
+        "display_name": "",
+        "real_name": f"Real {user}",
+        "image_512": f"https://example.com/{user}.png",
+        "status_text": "not cached",
+    }
+
+
+class TestProfileCache(unittest.TestCase):
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = ProfileCache(ttl=10, clock=clock)
+        cache.put("U1", {"display_name": "one", "real_name": "One"})
+        self.assertEqual(cache.get("U1")["display_name"], "one")
+        clock.now = 10
+        self.assertIsNone(cache.get("U1"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_eviction(self):
+        lru = ProfileCache(maxsize=2)
+        fifo = ProfileCache(maxsize=2, eviction="fifo")
+        for cache in (lru, fifo):
+            cache.put("U1", {})
+            cache.put("U2", {})
+            cache.get("U1")
+            cache.put("U3", {})
+            self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertIsNotNone(lru.get("U1"))
+        self.assertIsNone(lru.get("U2"))
+        self.assertIsNone(fifo.get("U1"))
+        self.assertIsNotNone(fifo.get("U2"))
+
+    def test_update_cached_user(self):
+        cache = ProfileCache()
+        cache.put("U1", {"display_name": "old", "real_name": ""})
+        update_cached_user({"id": "U1", "profile": {
+            "display_name": "new", "real_name": ""}}, cache)
+        update_cached_user({"id": "U2", "profile": {
+            "display_name": "two", "real_name": ""}}, cache)
+        self.assertEqual(cache.get("U1")["display_name"], "new")
+        self.assertIsNone(cache.get("U2"))
+
+        update_cached_user({"id": "U1", "deleted": True, "profile": {}},
+            cache)
+        self.assertIsNone(cache.get("U1"))
+
+    def test_get_profile(self):
+        client = FakeClient(profile=real_profile)
+        cache = ProfileCache()
+        profile = get_profile(client, "U1", cache)
+        self.assertEqual(get_profile(client, "U1", cache), profile)
+        self.assertEqual(client.looked_up(), ["U1"])
+        self.assertNotIn("status_text", profile)
+        self.assertEqual(profile_name(profile), "Real U1")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_get_profiles(self):
+        client = FakeClient(profile=real_profile)
+        cache = ProfileCache()
+        get_profile(client, "U1", cache)
+        found = get_profiles(client, ["U1", "U2", "U3", "U2"], cache)
+        self.assertEqual(list(found), ["U1", "U2", "U3"])
+        self.assertEqual(sorted(client.looked_up()), ["U1", "U2", "U3"])
+
+    def test_unresolvable(self):
+        client = FakeClient(profile=real_profile)
+        clock = FakeClock()
+        cache = ProfileCache(clock=clock, negative_ttl=30)
+        for _ in range(2):
+            found = get_profiles(client, ["U1", "X1", "X2"], cache)
+            self.assertEqual(list(found), ["U1"])
+            with self.assertRaises(ProfileNotFound):
+                get_profile(client, "X1", cache)
+        self.assertEqual(sorted(client.looked_up()), ["U1", "X1", "X2"])
+        self.assertEqual(cache.stats()["negative_size"], 2)
+
+        clock.now = 30
+        get_profiles(client, ["X1"], cache)
+        self.assertEqual(client.looked_up().count("X1"), 2)
+
+        # Joining makes the user look up-able again
+        update_cached_user({"id": "X2", "profile": {}}, cache)
+        get_profiles(client, ["X2"], cache)
+        self.assertEqual(client.looked_up().count("X2"), 2)
+
+
+class TestProfilesAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_get_profiles_async(self):
+        client = FakeAsyncClient(profile=real_profile)
+        cache = ProfileCache()
+        await get_profile_async(client, "U1", cache)
+        found = await get_profiles_async(client, ["U1", "U2", "U2"], cache)
+        self.assertEqual(list(found), ["U1", "U2"])
+        self.assertEqual(client.looked_up(), ["U1", "U2"])
+
+    async def test_unresolvable_async(self):
+        client = FakeAsyncClient(profile=real_profile)
+        cache = ProfileCache()
+        for _ in range(2):
+            found = await get_profiles_async(client, ["U1", "X1"], cache)
+            self.assertEqual(list(found), ["U1"])
+        self.assertEqual(client.looked_up(), ["U1", "X1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
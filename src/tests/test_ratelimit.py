@@ -0,0 +1,135 @@
+import unittest
+
+from slack_sdk.errors import SlackApiError
+
+from noping.ratelimit import *
+from tests.fakes import FakeClock, api_error
+
+
+def ratelimited(retry_after="2"):
+    return api_error("ratelimited", 429, {"retry-after": retry_after})
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refill(self):
+        clock = FakeClock()
+        bucket = TokenBucket(60, burst=2, clock=clock)
+        self.assertEqual(bucket.reserve(CRITICAL), 0)
+        self.assertEqual(bucket.reserve(CRITICAL), 0)
+        self.assertAlmostEqual(bucket.reserve(CRITICAL), 1)
+        clock.now = 1
+        self.assertEqual(bucket.reserve(CRITICAL), 0)
+
+    def test_priority_reserve(self):
+        bucket = TokenBucket(60, burst=4, clock=FakeClock())
+        self.assertEqual(bucket.reserve(BACKGROUND), 0)
+        self.assertEqual(bucket.reserve(BACKGROUND), 0)
+        # Half the bucket is left for normal and critical calls
+        self.assertGreater(bucket.reserve(BACKGROUND), 0)
+        self.assertEqual(bucket.reserve(NORMAL), 0)
+        self.assertGreater(bucket.reserve(NORMAL), 0)
+        self.assertEqual(bucket.reserve(CRITICAL), 0)
+
+    def test_reactive(self):
+        clock = FakeClock()
+        bucket = TokenBucket(60, burst=2, clock=clock, reactive=True)
+        for _ in range(10):
+            self.assertEqual(bucket.reserve(NORMAL), 0)
+
+        # Throttled from empty once Slack rate limits it
+        bucket.pause(5)
+        self.assertEqual(bucket.reserve(CRITICAL), 5)
+        clock.now = 6
+        self.assertEqual(bucket.reserve(CRITICAL), 0)
+        self.assertAlmostEqual(bucket.reserve(CRITICAL), 1)
+
+        # Until it fills up again
+        clock.now = 10
+        for _ in range(10):
+            self.assertEqual(bucket.reserve(NORMAL), 0)
+
+    def test_pause(self):
+        clock = FakeClock()
+        bucket = TokenBucket(60, clock=clock)
+        bucket.pause(5)
+        self.assertEqual(bucket.reserve(CRITICAL), 5)
+
+
+class TestRateLimitScheduler(unittest.TestCase):
+    def test_priority(self):
+        self.assertEqual(RateLimitScheduler.priority("views.open"), CRITICAL)
+        self.assertEqual(RateLimitScheduler.priority("users.info"), NORMAL)
+        self.assertEqual(RateLimitScheduler.priority("users.list"),
+            BACKGROUND)
+        with background():
+            self.assertEqual(RateLimitScheduler.priority("views.open"),
+                BACKGROUND)
+
+    def test_retry_after(self):
+        clock = FakeClock()
+        scheduler = RateLimitScheduler(clock=clock, sleep=clock.sleep,
+            reactive=False)
+        responses = [ratelimited("2"), "ok"]
+
+        def call():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertEqual(scheduler.call("users.profile.get", call), "ok")
+        self.assertEqual(clock.now, 2)
+        stats = scheduler.stats()
+        self.assertEqual(stats["ratelimited"], 1)
+        self.assertEqual(stats["retries"], 1)
+        self.assertEqual(stats["calls"], 2)
+
+    def test_gives_up(self):
+        clock = FakeClock()
+        scheduler = RateLimitScheduler(max_retries=1, clock=clock,
+            sleep=clock.sleep)
+
+        def call():
+            raise ratelimited("1")
+
+        with self.assertRaises(SlackApiError):
+            scheduler.call("users.profile.get", call)
+        self.assertEqual(scheduler.stats()["ratelimited"], 2)
+        self.assertEqual(scheduler.stats()["retries"], 1)
+
+    def test_trigger_bound(self):
+        clock = FakeClock()
+        scheduler = RateLimitScheduler(clock=clock, sleep=clock.sleep)
+        calls = []
+
+        def call():
+            calls.append(clock.now)
+            raise ratelimited("30")
+
+        # Not retried: the trigger ID would expire first
+        with self.assertRaises(SlackApiError):
+            scheduler.call("views.open", call)
+        self.assertEqual(calls, [0])
+        self.assertEqual(scheduler.stats()["retries"], 0)
+
+        # Nor called while Slack says to wait
+        with self.assertRaises(SlackApiError) as raised:
+            scheduler.call("views.open", call)
+        self.assertTrue(is_ratelimited(raised.exception))
+        self.assertEqual(calls, [0])
+        self.assertEqual(clock.now, 0)
+        self.assertEqual(scheduler.stats()["ratelimited"], 2)
+
+    def test_other_errors(self):
+        scheduler = RateLimitScheduler()
+
+        def call():
+            raise api_error("channel_not_found")
+
+        with self.assertRaises(SlackApiError):
+            scheduler.call("chat.postMessage", call)
+        self.assertEqual(scheduler.stats()["ratelimited"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
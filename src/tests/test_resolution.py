@@ -0,0 +1,47 @@
+import os
+import unittest
+from unittest import mock
+
+from noping.profiles import ProfileCache
+from noping.resolution import *
+
+
+class TestResolution(unittest.TestCase):
+    def test_parse_overrides(self):
+        self.assertEqual(
+            parse_overrides("T1=cached, /npp=embedded,T2/np=Lookup,"),
+            {"T1": "cached", "/npp": "embedded", "T2/np": "lookup"}
+        )
+        with self.assertRaises(ValueError):
+            parse_overrides("T1=fast")
+
+    def test_resolution_policy(self):
+        with mock.patch.dict(os.environ, {
+            "NOPING_RESOLUTION_POLICY": "cached",
+            "NOPING_RESOLUTION_POLICY_OVERRIDES":
+                "T1=embedded,/npp=lookup,T1/npp=cached",
+        }):
+            self.assertEqual(resolution_policy("T2", "/np"), CACHED)
+            self.assertEqual(resolution_policy("T1", "/np"), EMBEDDED)
+            self.assertEqual(resolution_policy("T2", "/npp"), LOOKUP)
+            self.assertEqual(resolution_policy("T1", "/npp"), CACHED)
+
+    def test_cached_names(self):
+        cache = ProfileCache()
+        cache.put("U1", {"display_name": "", "real_name": "One"})
+        self.assertEqual(cached_names(["U1", "U2"], cache), {"U1": "One"})
+
+    def test_reused_names(self):
+        cache = ProfileCache()
+        cache.put("U1", {"display_name": "new one", "real_name": ""})
+        names, saved = reused_names(
+            "<@U1|one> <@U2|two> <@U3|three>",
+            {"U1": "old one", "U2": "two", "U4": "four"},
+            cache
+        )
+        self.assertEqual(names, {"U1": "new one", "U2": "two"})
+        self.assertEqual(saved, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
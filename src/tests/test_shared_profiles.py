@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import struct
+import tempfile
+import unittest
+
+from noping.shared_profiles import *
+from tests.fakes import FakeClock
+
+
+def _put_in_child(directory, name):
+    cache = SharedProfileCache(name, directory=directory)
+    cache.put("U2", {"display_name": "two", "real_name": "Two"})
+
+
+class TestSharedProfileCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(
+            dir=SHM_DIR if os.path.isdir(SHM_DIR) else None)
+        self.clock = FakeClock(1000.0)
+        self.cache = SharedProfileCache("test", maxsize=16, ttl=10,
+            clock=self.clock, directory=self.directory)
+
+    def tearDown(self):
+        self.cache.close()
+        self.cache.unlink()
+        os.rmdir(self.directory)
+
+    def test_ttl(self):
+        self.cache.put("U1", {"display_name": "one", "real_name": "One",
+                              "status_text": "not cached"})
+        self.assertEqual(self.cache.get("U1"),
+            {"display_name": "one", "real_name": "One", "image_512": ""})
+        self.clock.now += 10
+        self.assertIsNone(self.cache.get("U1"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+        # Its slot stays taken until it's reused
+        self.assertEqual(len(self.cache), 1)
+
+    def test_shared(self):
+        other = SharedProfileCache("test", maxsize=1024, ttl=10,
+            clock=self.clock, directory=self.directory)
+        self.addCleanup(other.close)
+        self.assertEqual(other.maxsize, 16)
+        other.put("U1", {"display_name": "one"})
+        self.assertEqual(self.cache.get("U1")["display_name"], "one")
+        self.assertEqual(len(self.cache), 1)
+        self.assertTrue(self.cache.invalidate("U1"))
+        self.assertIsNone(other.get("U1"))
+        self.assertEqual(len(other), 0)
+
+    def test_replace(self):
+        self.assertFalse(self.cache.replace("U1", {"display_name": "one"}))
+        self.cache.put("U1", {"display_name": "one"})
+        self.assertTrue(self.cache.replace("U1", {"display_name": "uno"}))
+        self.assertEqual(self.cache.get("U1")["display_name"], "uno")
+        self.assertEqual(len(self.cache), 1)
+
+    def test_bounded(self):
+        for i in range(100):
+            self.clock.now += 0.01
+            self.cache.put(f"U{i}", {"display_name": str(i)})
+        self.assertEqual(len(self.cache), 16)
+        self.assertEqual(self.cache.stats()["evictions"], 84)
+        # The newest profile is never the one evicted
+        self.assertEqual(self.cache.get("U99")["display_name"], "99")
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_dead_writer(self):
+        self.cache.put("U1", {"display_name": "one"})
+        # Every slot of the group is left odd, as by a writer that died
+        group = self.cache._group("U1")
+        for slot in range(group, group + GROUP_SIZE):
+            offset = self.cache._offset(slot)
+            seq = struct.unpack_from("<I", self.cache._map, offset)[0]
+            struct.pack_into("<I", self.cache._map, offset, seq | 1)
+        self.assertIsNone(self.cache.get("U1"))
+
+        self.assertFalse(self.cache.invalidate("U1"))
+        self.cache.put("U1", {"display_name": "uno"})
+        self.assertEqual(self.cache.get("U1")["display_name"], "uno")
+        self.assertEqual(len(self.cache), 1)
+
+    def test_oversized(self):
+        self.cache.put("U1", {"display_name": "x" * MAX_PROFILE_SIZE})
+        self.assertIsNone(self.cache.get("U1"))
+        self.assertEqual(self.cache.stats()["oversized"], 1)
+
+    def test_other_process(self):
+        process = multiprocessing.get_context("spawn").Process(
+            target=_put_in_child, args=(self.directory, "test"))
+        process.start()
+        process.join(30)
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(self.cache.get("U2")["real_name"], "Two")
+
+
+if __name__ == '__main__':
+    unittest.main()
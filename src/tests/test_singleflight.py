@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from noping.singleflight import *
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_do(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def _slow():
+            started.set()
+            release.wait()
+            return "profile"
+
+        def _call():
+            results.append(flight.do("U1", _slow))
+
+        leader = threading.Thread(target=_call)
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=_call) for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        while flight.stats()["shared"] < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(results, ["profile"] * 4)
+        self.assertEqual(flight.stats(), {"calls": 1, "shared": 3})
+        self.assertEqual(flight.do("U1", lambda: "again"), "again")
+
+    def test_error(self):
+        flight = SingleFlight()
+        with self.assertRaises(ZeroDivisionError):
+            flight.do("U1", lambda: 1 / 0)
+        self.assertEqual(flight.do("U1", lambda: "ok"), "ok")
+
+
+class TestAsyncSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_do(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def _slow(user_id):
+            calls.append(user_id)
+            await asyncio.sleep(0.01)
+            if user_id == "bad":
+                raise ValueError(user_id)
+            return user_id
+
+        results = await asyncio.gather(
+            *(flight.do(user_id, _slow, user_id)
+              for user_id in ["U1", "U1", "bad", "bad"]),
+            return_exceptions=True
+        )
+        self.assertEqual(results[:2], ["U1", "U1"])
+        self.assertIsInstance(results[2], ValueError)
+        self.assertIs(results[2], results[3])
+        self.assertEqual(calls, ["U1", "bad"])
+        self.assertEqual(await flight.do("U1", _slow, "U1"), "U1")
+
+
+if __name__ == '__main__':
+    unittest.main()
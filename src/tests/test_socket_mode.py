@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from noping.async_socket_mode import *
+from noping.socket_mode import *
+from noping.worker import WorkerLazyListenerRunner, WorkerPool
+
+
+class FakeHandler:
+    instances = []
+
+    def __init__(self, app, app_token, **options):
+        self.app_token = app_token
+        self.options = options
+        self.connected = False
+        self.closed = False
+        FakeHandler.instances.append(self)
+
+    def connect(self):
+        self.connected = True
+
+    def close(self):
+        self.closed = True
+
+    async def connect_async(self):
+        self.connect()
+
+    async def close_async(self):
+        self.close()
+
+
+def fake_app(lazy_listener_runner=None):
+    logger = logging.getLogger("test")
+    return SimpleNamespace(logger=logger, listener_runner=SimpleNamespace(
+        lazy_listener_runner=lazy_listener_runner))
+
+
+class TestSocketModeRunner(unittest.TestCase):
+    def setUp(self):
+        FakeHandler.instances = []
+
+    def test_connections(self):
+        with self.assertRaises(ValueError):
+            SocketModeRunner(fake_app(), "xapp-1", connections=11)
+
+        runner = SocketModeRunner(fake_app(), "xapp-1", connections=3,
+            concurrency=4, handler_class=FakeHandler)
+        runner.connect()
+        self.assertEqual(len(FakeHandler.instances), 3)
+        for handler in FakeHandler.instances:
+            self.assertTrue(handler.connected)
+            self.assertEqual(handler.app_token, "xapp-1")
+            self.assertEqual(handler.options["concurrency"], 4)
+
+    def test_stop_finishes_work(self):
+        pool = WorkerPool(max_workers=1, max_queue=1)
+        app = fake_app(WorkerLazyListenerRunner(logging.getLogger("test"),
+            pool))
+        runner = SocketModeRunner(app, "xapp-1", connections=2,
+            handler_class=FakeHandler)
+        thread = threading.Thread(target=runner.start)
+        thread.start()
+        finished = pool.submit(time.sleep, 0.2)
+
+        runner.stop()
+        thread.join(timeout=5)
+        self.assertTrue(finished.done())
+        self.assertTrue(all(handler.closed
+                            for handler in FakeHandler.instances))
+        pool.shutdown()
+
+
+class TestAsyncSocketModeRunner(unittest.TestCase):
+    def setUp(self):
+        FakeHandler.instances = []
+
+    def test_start_and_stop(self):
+        async def _run():
+            runner = AsyncSocketModeRunner(fake_app(), "xapp-1",
+                connections=2, handler_class=FakeHandler)
+            task = asyncio.create_task(runner.start())
+            while len(runner.handlers) < 2:
+                await asyncio.sleep(0.01)
+            runner.stop()
+            await task
+
+        asyncio.run(_run())
+        self.assertEqual(len(FakeHandler.instances), 2)
+        self.assertTrue(all(handler.connected and handler.closed
+                            for handler in FakeHandler.instances))
+
+
+if __name__ == '__main__':
+    unittest.main()
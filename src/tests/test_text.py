@@ -1,6 +1,9 @@
+import asyncio
+import time
 import unittest
 
 from noping.text import *
+from tests.fakes import FakeAsyncClient, FakeClient
 
 
 class TestText(unittest.TestCase):
@@ -22,6 +25,18 @@ class TestText(unittest.TestCase):
             r"hello <@U094NTBR1S5|twonum> \!"
         )
 
+    def test_mention_user_ids(self):
+        self.assertEqual(
+            mention_user_ids(r"<@U1|one> <@U2|two> \ <@U1|one> <@U3|three>"),
+            ["U1", "U3"]
+        )
+        self.assertEqual(
+            mentions_to_links("<@U1|one> and <@U1|one>", "hackclub",
+                names={"U1": "First"}),
+            "<https://hackclub.slack.com/team/U1?noping=1|@First> and "
+            "<https://hackclub.slack.com/team/U1?noping=1|@First>"
+        )
+
     def test_user_owns_message(self):
         self.assertTrue(
             user_owns_message("*<@U098A37C0AU>*: hello",
@@ -32,6 +47,55 @@ class TestText(unittest.TestCase):
                 "userid1")
         )
 
+        self.assertFalse(
+            user_owns_message("*<@userid2>*: hi <@userid1>*: hi",
+                "userid1")
+        )
+
+    def test_link_names(self):
+        self.assertEqual(
+            link_names([
+                {
+                    "type": "context",
+                    "elements": [{"type": "mrkdwn", "text": "*<@U9>*:"}],
+                },
+                {
+                    "type": "section",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": "hi <https://hackclub.slack.com/team/U1"
+                                "?noping=1|@one> and <https://example.com"
+                                "|@nope>",
+                    },
+                },
+                {
+                    "type": "rich_text",
+                    "elements": [{
+                        "type": "rich_text_section",
+                        "elements": [{
+                            "type": "link",
+                            "text": "@two",
+                            "url": "https://hackclub.slack.com/team/U2"
+                                   "?noping=1",
+                        }],
+                    }],
+                },
+            ]),
+            {"U1": "one", "U2": "two"}
+        )
+
+    def test_pathological_input(self):
+        # Each of these took quadratic time with the old regexes
+        for text in (
+                "<@" * 500_000,
+                "<@a|" * 250_000,
+                "*<@" + "x" * 1_000_000,
+                "<@x|" + "a" * 1_000_000,
+        ):
+            start = time.perf_counter()
+            mentions_to_links(text, "hackclub")
+            user_owns_message(text, "x")
+            self.assertLess(time.perf_counter() - start, 2)
 
     def test_block_kit_mentions_to_links(self):
         self.assertEqual(
@@ -72,9 +136,9 @@ class TestText(unittest.TestCase):
                 },
                 {
                     "type": "link",
-                    "text": "@PlaceholderUsername",
-                    "url": f"https://workspace.slack.com"
-                           f"/team/U09CE3KJ1FG?noping=1"
+                    "text": "@U09CE3KJ1FG",
+                    "url": "https://workspace.slack.com"
+                           "/team/U09CE3KJ1FG?noping=1"
                 },
                 {
                     "text": "! This is a part of tests of NoPing. ",
@@ -99,6 +163,114 @@ class TestText(unittest.TestCase):
             ]
         )
 
+    def test_block_kit_containers(self):
+        untouched = {
+            "type": "rich_text_preformatted",
+            "elements": [{"type": "text", "text": "code"}],
+        }
+        content = [
+            {
+                "type": "rich_text_section",
+                "elements": [{"type": "text", "text": "Hi "}],
+            },
+            {
+                "type": "rich_text_list",
+                "style": "bullet",
+                "elements": [{
+                    "type": "rich_text_section",
+                    "elements": [{"type": "user", "user_id": "U1",
+                                  "style": {"bold": True}}],
+                }],
+            },
+            {
+                "type": "rich_text_quote",
+                "elements": [{"type": "user", "user_id": "U2"}],
+            },
+            {
+                # Escapes the mention at the end of the quote
+                "type": "rich_text_section",
+                "elements": [{"type": "text", "text": "\\ and "},
+                             {"type": "user", "user_id": "U3"}],
+            },
+            untouched,
+        ]
+        self.assertEqual(block_kit_mention_user_ids(content), ["U1", "U3"])
+
+        converted = block_kit_mentions_to_links(content, "workspace",
+            names={"U1": "one", "U3": "three"})
+        self.assertIs(converted, content)
+        self.assertIs(converted[4], untouched)
+        self.assertEqual(converted[1]["elements"][0]["elements"][0], {
+            "type": "link",
+            "text": "@one",
+            "url": "https://workspace.slack.com/team/U1?noping=1",
+            "style": {"bold": True},
+        })
+        self.assertEqual(converted[2]["elements"][0],
+            {"type": "user", "user_id": "U2"})
+        self.assertEqual(converted[3]["elements"][1]["text"], "@three")
+
+    def test_deeply_nested_block_kit(self):
+        content = [{"type": "user", "user_id": "U1"}]
+        for _ in range(10000):
+            content = [{"type": "rich_text_quote", "elements": content}]
+        self.assertEqual(block_kit_mention_user_ids(content), ["U1"])
+
+    def test_bulk_mentions_to_links(self):
+        def contents():
+            yield "hi <@U1|one> and <@U2|two> \\"
+            yield [{"type": "user", "user_id": "U3"}]
+            yield "<@U1|one> <@U4|four>"
+
+        converted = bulk_mentions_to_links(contents(), "workspace",
+            names={"U1": "First"})
+        self.assertEqual(list(converted), [
+            "hi <https://workspace.slack.com/team/U1?noping=1|@First>"
+            " and <@U2|two> \\",
+            [{"type": "link", "text": "@U3",
+              "url": "https://workspace.slack.com/team/U3?noping=1"}],
+            "<https://workspace.slack.com/team/U1?noping=1|@First> "
+            "<https://workspace.slack.com/team/U4?noping=1|@four>",
+        ])
+
+        # Users are looked up once per batch, and only once in total
+        client = FakeClient()
+        converted = bulk_mentions_to_links(contents(), "workspace",
+            client=client, names={"U1": "First"}, batch_size=2)
+        self.assertEqual(next(converted),
+            "hi <https://workspace.slack.com/team/U1?noping=1|@First>"
+            " and <@U2|two> \\")
+        self.assertEqual(sorted(client.looked_up()), ["U3"])
+        self.assertEqual(len(list(converted)), 2)
+        self.assertEqual(sorted(client.looked_up()), ["U3", "U4"])
+
+        async def convert():
+            client = FakeAsyncClient()
+            converted = [content async for content in
+                         bulk_mentions_to_links_async(contents(), "workspace",
+                             client=client)]
+            return converted, client.looked_up()
+
+        converted, calls = asyncio.run(convert())
+        self.assertEqual(sorted(calls), ["U1", "U3", "U4"])
+        self.assertEqual(converted[2],
+            "<https://workspace.slack.com/team/U1?noping=1|@Name U1> "
+            "<https://workspace.slack.com/team/U4?noping=1|@Name U4>")
+
+        with self.assertRaises(ValueError):
+            next(bulk_mentions_to_links([], "workspace", batch_size=0))
+
+        # Messages are converted as they are read by default
+        def endless():
+            while True:
+                yield "<@U1|one>"
+
+        client = FakeClient()
+        converted = bulk_mentions_to_links(endless(), "workspace",
+            client=client)
+        self.assertEqual(next(converted),
+            "<https://workspace.slack.com/team/U1?noping=1|@Name U1>")
+
 
 if __name__ == '__main__':
     unittest.main()
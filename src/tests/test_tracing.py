@@ -0,0 +1,164 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.parse import urlencode
+
+from slack_bolt import App, BoltRequest
+from slack_bolt.authorization import AuthorizeResult
+from slack_sdk.signature import SignatureVerifier
+
+from noping import tracing
+from noping.tracing import *
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans += spans
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.exporter = ListExporter()
+        self.tracer = Tracer(self.exporter, salt="test")
+
+    def test_parent_and_child(self):
+        with self.tracer.span("request", SERVER) as parent:
+            with self.tracer.span("slack chat.postMessage", CLIENT,
+                                  {"slack.method": "chat.postMessage"}):
+                pass
+        self.assertIsNone(current_context())
+        self.tracer.flush()
+
+        child, root = self.exporter.spans
+        self.assertIs(root, parent)
+        self.assertIsNone(root.parent_id)
+        self.assertEqual(child.trace_id, root.trace_id)
+        self.assertEqual(child.parent_id, root.span_id)
+        self.assertEqual(child.attributes,
+                         {"slack.method": "chat.postMessage"})
+        self.assertGreaterEqual(root.end_ns, child.end_ns)
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.span("listener np"):
+                raise ValueError("secret message")
+        self.tracer.flush()
+        self.assertEqual(self.exporter.spans[0].error, "ValueError")
+
+    def test_sampling(self):
+        tracer = Tracer(self.exporter, sample_rate=0.0)
+        with tracer.span("request") as span:
+            self.assertIsNone(span)
+            # Children of an unsampled trace aren't recorded either
+            with tracer.span("slack users.info") as child:
+                self.assertIsNone(child)
+        tracer.flush()
+        self.assertEqual(self.exporter.spans, [])
+
+    def test_disabled(self):
+        tracer = Tracer()
+        self.assertFalse(tracer.enabled)
+        with tracer.span("request") as span:
+            self.assertIsNone(span)
+
+    def test_hash_user_id(self):
+        hashed = self.tracer.hash_user_id("U012AB3CD")
+        self.assertNotIn("U012AB3CD", hashed)
+        self.assertEqual(hashed,
+                         Tracer(salt="test").hash_user_id("U012AB3CD"))
+        self.assertNotEqual(hashed,
+                            Tracer(salt="other").hash_user_id("U012AB3CD"))
+
+    def test_max_queue(self):
+        tracer = Tracer(self.exporter, max_queue=2)
+        for _ in range(3):
+            with tracer.span("request"):
+                pass
+        tracer.flush()
+        self.assertEqual(len(self.exporter.spans), 2)
+        self.assertEqual(tracer.dropped, 1)
+
+    def test_attach_in_thread(self):
+        with self.tracer.span("request") as parent:
+            context = current_context()
+
+        def _work():
+            with attach(context), self.tracer.span("listener np"):
+                pass
+
+        thread = threading.Thread(target=_work)
+        thread.start()
+        thread.join()
+        self.tracer.flush()
+        child = self.exporter.spans[1]
+        self.assertEqual(child.trace_id, parent.trace_id)
+        self.assertEqual(child.parent_id, parent.span_id)
+
+
+class TestOtlpExporter(unittest.TestCase):
+    def test_payload(self):
+        exporter = ListExporter()
+        tracer = Tracer(exporter)
+        with tracer.span("slack users.info", CLIENT,
+                         {"slack.method": "users.info", "retries": 1}):
+            pass
+        tracer.flush()
+
+        payload = OtlpExporter().payload(exporter.spans)
+        resource_spans = payload["resourceSpans"][0]
+        self.assertEqual(resource_spans["resource"]["attributes"][0],
+                         {"key": "service.name",
+                          "value": {"stringValue": "noping"}})
+        span = resource_spans["scopeSpans"][0]["spans"][0]
+        self.assertEqual(span["name"], "slack users.info")
+        self.assertEqual(span["kind"], CLIENT)
+        self.assertEqual(len(span["traceId"]), 32)
+        self.assertEqual(len(span["spanId"]), 16)
+        self.assertNotIn("parentSpanId", span)
+        self.assertEqual(span["attributes"], [
+            {"key": "slack.method", "value": {"stringValue": "users.info"}},
+            {"key": "retries", "value": {"intValue": "1"}},
+        ])
+
+
+class TestTraceRequest(unittest.TestCase):
+    def test_only_verified_requests(self):
+        exporter = ListExporter()
+        app = App(signing_secret="secret", authorize=lambda **kwargs:
+            AuthorizeResult(enterprise_id=None, team_id="T1",
+                bot_token="xoxb-test", bot_user_id="U0", bot_id="B0"))
+        app.dispatch = traced_dispatch(app.dispatch)
+        app.middleware(trace_request)
+        app.command("/np")(lambda ack: ack())
+
+        body = urlencode({"command": "/np", "text": "hi", "team_id": "T1",
+                          "user_id": "U1", "trigger_id": "1.2"})
+        timestamp = str(int(time.time()))
+        signed = {
+            "content-type": ["application/x-www-form-urlencoded"],
+            "x-slack-request-timestamp": [timestamp],
+            "x-slack-signature": [SignatureVerifier("secret")
+                .generate_signature(timestamp=timestamp, body=body)],
+        }
+        with mock.patch.object(tracing, "_default_tracer",
+                               Tracer(exporter, salt="test")) as tracer:
+            unsigned = dict(signed, **{"x-slack-signature": ["v0=forged"]})
+            self.assertEqual(app.dispatch(
+                BoltRequest(body=body, headers=unsigned)).status, 401)
+            self.assertEqual(app.dispatch(
+                BoltRequest(body=body, headers=signed)).status, 200)
+            tracer.flush()
+
+        self.assertEqual([span.name for span in exporter.spans],
+                         ["request"])
+        self.assertEqual(exporter.spans[0].attributes["slack.request"],
+                         "/np")
+        self.assertIsNotNone(exporter.spans[0].end_ns)
+
+
+if __name__ == '__main__':
+    unittest.main()
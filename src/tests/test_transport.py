@@ -0,0 +1,173 @@
+import asyncio
+import http.client
+import inspect
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import URLError
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+from noping.transport import *
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        status = 429 if self.path.endswith("ratelimited") else 200
+        body = b'{"ok": true}' if status == 200 else b'{"ok": false}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StaleConnection:
+    sock = None
+
+    def request(self, *args, **kwargs):
+        raise http.client.RemoteDisconnected("closed while idle")
+
+    def close(self):
+        pass
+
+
+class ClosedAfterSending(StaleConnection):
+    """Closed by Slack after the request was sent, which Slack may have
+    acted on.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def request(self, method, path, **kwargs):
+        self.sent.append(path)
+
+    def getresponse(self):
+        raise http.client.RemoteDisconnected("closed after sending")
+
+
+class TestPooledWebClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever,
+            kwargs={"poll_interval": 0.01}, daemon=True).start()
+        self.pool = ConnectionPool(maxsize=2)
+        self.client = PooledWebClient(token="xoxb-test", pool=self.pool,
+            base_url=f"http://127.0.0.1:{self.server.server_port}/api/")
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        for _ in range(3):
+            self.assertTrue(self.client.api_test()["ok"])
+        stats = self.pool.stats.snapshot()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 2)
+
+    def test_stale_connection(self):
+        key = ("http", "127.0.0.1", self.server.server_port, None)
+        self.pool._idle[key] = [(self.pool._clock(), StaleConnection())]
+        self.assertTrue(self.client.api_test()["ok"])
+        stats = self.pool.stats.snapshot()
+        self.assertEqual(stats["discarded"], 1)
+        self.assertEqual(stats["created"], 1)
+
+    def test_closed_after_sending(self):
+        key = ("http", "127.0.0.1", self.server.server_port, None)
+        idle = ClosedAfterSending()
+        self.pool._idle[key] = [(self.pool._clock(), idle)]
+        # Not sent again: the message could be posted twice
+        with self.assertRaises(URLError):
+            self.client.chat_postMessage(channel="C1", text="hi")
+        self.assertEqual(idle.sent, ["/api/chat.postMessage"])
+        self.assertEqual(self.pool.stats.snapshot()["requests"], 0)
+
+        # Reads are
+        idle = ClosedAfterSending()
+        self.pool._idle[key] = [(self.pool._clock(), idle)]
+        self.assertTrue(self.client.users_profile_get(user="U1")["ok"])
+        self.assertEqual(self.pool.stats.snapshot()["discarded"], 1)
+
+    def test_dropped_while_idle(self):
+        self.assertTrue(self.client.api_test()["ok"])
+        # Slack closes the idle connection, which is seen before reuse
+        key = ("http", "127.0.0.1", self.server.server_port, None)
+        _, conn = self.pool._idle[key][0]
+        conn.sock.shutdown(2)
+        self.assertTrue(self.client.chat_postMessage(channel="C1",
+            text="hi")["ok"])
+        stats = self.pool.stats.snapshot()
+        self.assertEqual(stats["discarded"], 1)
+        self.assertEqual(stats["created"], 2)
+
+    def test_http_error(self):
+        with self.assertRaises(SlackApiError) as cm:
+            self.client.api_call("ratelimited")
+        self.assertEqual(cm.exception.response.status_code, 429)
+        self.assertEqual(cm.exception.response.headers["retry-after"], "1")
+
+
+    def test_slack_sdk_internals(self):
+        # PooledWebClient overrides this private method, which slack_sdk
+        # calls with the URL and the urllib request of every API call
+        method = WebClient._perform_urllib_http_request_internal
+        self.assertEqual(list(inspect.signature(method).parameters),
+            ["self", "url", "req"])
+        self.assertIn("_perform_urllib_http_request_internal(",
+            inspect.getsource(WebClient._perform_urllib_http_request))
+        self.assertTrue(self.client.api_test()["ok"])
+        self.assertEqual(self.pool.stats.snapshot()["created"], 1)
+
+
+class TestSessionPool(unittest.TestCase):
+    def test_new_event_loop(self):
+        from noping.async_transport import SessionPool
+
+        pool = SessionPool()
+
+        async def session():
+            return pool.session()
+
+        first = asyncio.run(session())
+
+        async def next_loop():
+            second = pool.session()
+            await asyncio.sleep(0)
+            await pool.close()
+            return second
+
+        # The session of the finished loop is closed, not leaked
+        self.assertIsNot(asyncio.run(next_loop()), first)
+        self.assertTrue(first.closed)
+
+    def test_client_session(self):
+        from noping.async_transport import AsyncPooledWebClient, SessionPool
+
+        pool = SessionPool()
+        client = AsyncPooledWebClient(token="xoxb-test", pool=pool)
+        self.assertIsNone(client.session)  # Outside of an event loop
+
+        async def session():
+            try:
+                return client.session, pool.session()
+            finally:
+                await pool.close()
+
+        used, pooled = asyncio.run(session())
+        self.assertIs(used, pooled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import unittest
+
+from noping.views import *
+
+
+class TestViews(unittest.TestCase):
+    def test_message_editor_view_names(self):
+        shortcut = {
+            "message": {"ts": "1.2"},
+            "channel": {"id": "C1"},
+            "user": {"id": "U1"},
+        }
+        names = {f"U{i:010}": "x" * 21 for i in range(200)}
+        view = message_editor_view("edit_message", "Edit message", shortcut,
+            names)
+        self.assertLessEqual(len(view["private_metadata"]),
+            PRIVATE_METADATA_MAX_LENGTH)
+        meta = json.loads(view["private_metadata"])
+        self.assertEqual((meta["ts"], meta["ch"]), ("1.2", "C1"))
+        self.assertTrue(0 < len(meta["names"]) < len(names))
+
+    def test_message_blocks_containers(self):
+        section = [{"type": "text", "text": "hi"}]
+        containers = [{"type": "rich_text_list", "elements": [
+            {"type": "rich_text_section", "elements": section}]}]
+        self.assertEqual(message_blocks("U1", section)[1]["elements"], [
+            {"type": "rich_text_section", "elements": section}])
+        self.assertIs(message_blocks("U1", containers)[1]["elements"],
+            containers)
+
+    def test_views_are_copies(self):
+        # Changing a view doesn't change the next one
+        view = preview_view("reason", [{"type": "divider"}])
+        view["blocks"][0]["elements"][0]["text"] = "changed"
+        view["title"]["text"] = "changed"
+        other = preview_view("other", [])
+        self.assertNotEqual(other["blocks"][0]["elements"][0]["text"],
+            "changed")
+        self.assertEqual(other["title"]["text"], "Message preview")
+        self.assertEqual(other["blocks"][:2], preview_header())
+        self.assertEqual(other["blocks"][2]["elements"][0]["text"], "other")
+        self.assertEqual(len(other["blocks"]), 4)
+
+        blocks = [{"type": "section", "text": {"type": "mrkdwn",
+                                               "text": "hi"}}]
+        view = cant_access_channel_view(blocks)
+        self.assertEqual(view["blocks"][-1], blocks[0])
+        self.assertEqual(len(cant_access_channel_view([])["blocks"]), 3)
+        cant_edit_view()["blocks"].clear()
+        self.assertTrue(cant_edit_view()["blocks"])
+        # Views are plain JSON for slack_sdk to serialize
+        json.dumps(message_editor_view("edit_message", "Edit message",
+            {"message": {"ts": "1.2"}, "channel": {"id": "C1"},
+             "user": {"id": "U1"}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from noping.profiles import ProfileCache
+from noping.warmup import *
+
+
+class FakeClient:
+    def __init__(self, pages):
+        self.pages = pages
+        self.cursors = []
+
+    def users_list(self, limit, cursor=None):
+        self.cursors.append(cursor)
+        return self.pages[cursor]
+
+
+def _member(user_id, **kwargs):
+    return {"id": user_id, "profile": {"display_name": user_id,
+                                       "real_name": ""}, **kwargs}
+
+
+class TestWarmup(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient({
+            None: {
+                "members": [_member("U1"), _member("U2", deleted=True)],
+                "response_metadata": {"next_cursor": "page2"},
+            },
+            "page2": {
+                "members": [_member("U3"), _member("U4")],
+                "response_metadata": {"next_cursor": ""},
+            },
+        })
+
+    def test_warm_profile_cache(self):
+        cache = ProfileCache()
+        self.assertEqual(warm_profile_cache(self.client, cache), 3)
+        self.assertEqual(self.client.cursors, [None, "page2"])
+        self.assertIsNone(cache.get("U2"))
+        self.assertEqual(cache.get("U4")["display_name"], "U4")
+
+    def test_max_profiles(self):
+        cache = ProfileCache(maxsize=3)
+        cache.put("U0", {})
+        self.assertEqual(warm_profile_cache(self.client, cache), 2)
+        self.assertEqual(cache.stats()["evictions"], 0)
+        self.assertEqual(
+            warm_profile_cache(self.client, ProfileCache(), max_profiles=1),
+            1)
+        self.assertEqual(self.client.cursors, [None, "page2", None])
+
+
+if __name__ == '__main__':
+    unittest.main()
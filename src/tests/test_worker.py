@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import threading
+import unittest
+
+from slack_bolt import BoltRequest
+from slack_bolt.request.async_request import AsyncBoltRequest
+
+from noping.async_worker import *
+from noping.views import BUSY_TEXT
+from noping.worker import *
+from tests.fakes import FakeAsyncClient, FakeClient
+
+
+COMMAND = {"command": "/np", "text": "hi", "trigger_id": "1.command"}
+SUBMISSION = {"type": "view_submission", "trigger_id": "1.view",
+              "view": {"blocks": [{"type": "input", "block_id": "input"}]}}
+SHORTCUT = {"type": "message_action", "trigger_id": "1.shortcut"}
+
+
+class TestWorkerPool(unittest.TestCase):
+    def test_bounded_queue(self):
+        pool = WorkerPool(max_workers=1, max_queue=1)
+        release = threading.Event()
+        running = pool.submit(release.wait)
+        queued = pool.submit(lambda: "done")
+        with self.assertRaises(QueueFullError):
+            pool.submit(lambda: "dropped")
+        self.assertEqual(pool.stats.depth(), 2)
+
+        release.set()
+        self.assertTrue(running.result(timeout=1))
+        self.assertEqual(queued.result(timeout=1), "done")
+        pool.shutdown()
+
+        stats = pool.stats.snapshot()
+        self.assertEqual(stats["completed"], 2)
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["queued"] + stats["running"], 0)
+
+    def test_failed_job(self):
+        pool = WorkerPool(max_workers=1, max_queue=0)
+        future = pool.submit(lambda: 1 / 0)
+        with self.assertRaises(ZeroDivisionError):
+            future.result(timeout=1)
+        pool.shutdown()
+        self.assertEqual(pool.stats.snapshot()["failed"], 1)
+
+
+    def test_drain(self):
+        pool = WorkerPool(max_workers=1, max_queue=1)
+        release = threading.Event()
+        pool.submit(release.wait)
+        self.assertFalse(pool.drain(timeout=0.1))
+        release.set()
+        self.assertTrue(pool.drain(timeout=1))
+        pool.shutdown()
+
+    def test_reject_when_busy(self):
+        pool = WorkerPool(max_workers=1, max_queue=0)
+        middleware = reject_when_busy(pool)
+        client = FakeClient()
+        context = {}
+        self.assertEqual(middleware(COMMAND, client, context,
+            lambda: "next"), "next")
+        self.assertIsNotNone(context[RESERVATION_KEY])
+
+        # The reserved slot counts until the lazy listener takes it
+        response = middleware(COMMAND, client, {}, lambda: "next")
+        self.assertEqual(response.status, 200)
+        self.assertIn(BUSY_TEXT, response.body)
+        response = middleware(SUBMISSION, client, {}, lambda: "next")
+        self.assertIn('"errors"', response.body)
+        self.assertIn(BUSY_TEXT, response.body)
+        middleware(SHORTCUT, client, {}, lambda: "next")
+        self.assertEqual(client.called("views.open")[0]["trigger_id"],
+            "1.shortcut")
+        self.assertEqual(pool.stats.snapshot()["rejected"], 3)
+
+        # An unused reservation gives its slot back
+        del context[RESERVATION_KEY]
+        self.assertEqual(middleware(COMMAND, client, {}, lambda: "next"),
+            "next")
+        pool.shutdown()
+
+    def test_reserved_listener(self):
+        pool = WorkerPool(max_workers=1, max_queue=0)
+        self.addCleanup(pool.shutdown)
+        runner = WorkerLazyListenerRunner(logging.getLogger(__name__), pool)
+        request = BoltRequest(body=COMMAND, mode="socket_mode")
+        request.context[RESERVATION_KEY] = pool.reserve()
+        ran = threading.Event()
+
+        def listener(body):
+            ran.set()
+
+        runner.start(listener, request)
+        self.assertTrue(ran.wait(timeout=1))
+        self.assertTrue(pool.drain(timeout=1))
+        self.assertIsNotNone(pool.reserve())  # The slot was freed
+
+    def test_full_pool_queues(self):
+        # A request that got past reject_when_busy is never dropped, and
+        # never run on the thread that acknowledges it
+        pool = WorkerPool(max_workers=1, max_queue=0)
+        release = threading.Event()
+        self.addCleanup(pool.shutdown)
+        self.addCleanup(release.set)
+        pool.submit(release.wait)
+        runner = WorkerLazyListenerRunner(logging.getLogger(__name__), pool)
+        ran = []
+
+        def listener(body):
+            ran.append((body, threading.current_thread()))
+
+        runner.start(listener, BoltRequest(body=COMMAND, mode="socket_mode"))
+        self.assertEqual(ran, [])
+        release.set()
+        self.assertTrue(pool.drain(timeout=1))
+        self.assertEqual(ran[0][0], COMMAND)
+        self.assertIsNot(ran[0][1], threading.current_thread())
+
+    def test_failed_listener(self):
+        pool = WorkerPool(max_workers=1, max_queue=0)
+        runner = WorkerLazyListenerRunner(logging.getLogger(__name__), pool)
+
+        def listener():
+            raise ValueError("failed")
+
+        with self.assertLogs(level="ERROR"):
+            runner.start(listener,
+                BoltRequest(body=COMMAND, mode="socket_mode"))
+            self.assertTrue(pool.drain(timeout=1))
+        pool.shutdown()
+        self.assertEqual(pool.stats.snapshot()["failed"], 1)
+
+    def test_reject_when_busy_async(self):
+        runner = AsyncWorkerLazyListenerRunner(logging.getLogger(__name__),
+            max_running=1, max_queue=0)
+        middleware = reject_when_busy_async(runner)
+        client = FakeAsyncClient()
+        context = {}
+
+        async def _next():
+            return "next"
+
+        async def _run():
+            self.assertEqual(await middleware(COMMAND, client, context,
+                _next), "next")
+            return await middleware(SHORTCUT, client, {}, _next)
+
+        response = asyncio.run(_run())
+        self.assertEqual(response.status, 200)
+        self.assertEqual(client.called("views.open")[0]["trigger_id"],
+            "1.shortcut")
+        self.assertEqual(runner.stats.snapshot()["rejected"], 1)
+
+    def test_async_runner(self):
+        runner = AsyncWorkerLazyListenerRunner(logging.getLogger(__name__),
+            max_running=1, max_queue=0)
+        ran = []
+
+        async def listener(body):
+            await asyncio.sleep(0.01)
+            ran.append(body)
+
+        async def failing():
+            raise ValueError("failed")
+
+        def _request():
+            request = AsyncBoltRequest(body=COMMAND, mode="socket_mode")
+            request.context[RESERVATION_KEY] = runner.reserve()
+            return request
+
+        async def _run():
+            runner.start(listener, _request())
+            self.assertIsNone(runner.reserve())
+            # Over the bound without a reservation, but still run
+            runner.start(failing, AsyncBoltRequest(body=COMMAND,
+                mode="socket_mode"))
+            self.assertTrue(await runner.drain(timeout=1))
+            self.assertIsNotNone(runner.reserve())
+
+        with self.assertLogs(level="ERROR"):
+            asyncio.run(_run())
+        self.assertEqual(ran, [COMMAND])
+        stats = runner.stats.snapshot()
+        self.assertEqual((stats["completed"], stats["failed"]), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import copy
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from noping.profiles import ProfileCache, cache_for
+from noping.ratelimit import ScheduledWebClient
+from noping import workspaces
+from noping.workspaces import *
+
+
+class FakeContext:
+    def __init__(self, team_id=None, enterprise_id=None):
+        self.team_id = team_id
+        self.enterprise_id = enterprise_id
+
+
+class TestWorkspaceRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = WorkspaceRegistry(ScheduledWebClient)
+
+    def test_separate_workspaces(self):
+        one = self.registry.client("T1", "xoxb-1")
+        two = self.registry.client("T2", "xoxb-2")
+        self.assertIsNot(one.scheduler, two.scheduler)
+        self.assertIsNot(cache_for(one), cache_for(two))
+        # Connections to Slack are still shared
+        self.assertIs(one.pool, two.pool)
+
+        cache_for(one).put("U1", {"display_name": "one"})
+        self.assertIsNone(cache_for(two).get("U1"))
+        self.assertEqual(len(self.registry), 2)
+
+    def test_client_reused(self):
+        client = self.registry.client("T1", "xoxb-1")
+        self.assertIs(self.registry.client("T1", "xoxb-1"), client)
+        rotated = self.registry.client("T1", "xoxb-rotated")
+        self.assertIsNot(rotated, client)
+        self.assertEqual(rotated.token, "xoxb-rotated")
+        self.assertIs(rotated.profile_cache, client.profile_cache)
+
+    def test_copied_client_keeps_cache(self):
+        client = self.registry.client("T1", "xoxb-1")
+        copied = copy.deepcopy(client)
+        self.assertIs(copied.profile_cache, client.profile_cache)
+        self.assertIs(copied.scheduler, client.scheduler)
+
+    def test_forget(self):
+        cache = cache_for(self.registry.client("T1", "xoxb-1"))
+        self.assertTrue(self.registry.forget("T1"))
+        self.assertFalse(self.registry.forget("T1"))
+        self.assertIsNot(cache_for(self.registry.client("T1", "xoxb-1")),
+            cache)
+
+    def test_bounded(self):
+        registry = WorkspaceRegistry(ScheduledWebClient, maxsize=2)
+        one = registry.workspace("T1")
+        registry.workspace("T2")
+        self.assertIs(registry.workspace("T1"), one)
+        registry.workspace("T3")  # T2 was used least recently
+        self.assertEqual(len(registry), 2)
+        self.assertIs(registry.workspace("T1"), one)
+        self.assertEqual(registry.stats()["evictions"], 1)
+        with self.assertRaises(ValueError):
+            WorkspaceRegistry(maxsize=0)
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "needs /dev/shm")
+    def test_shared_profile_cache(self):
+        from noping.shared_profiles import SharedProfileCache
+
+        name = f"noping-test-{os.getpid()}"
+        with mock.patch.dict(os.environ,
+                {"NOPING_SHARED_PROFILE_CACHE": name}):
+            one = cache_for(self.registry.client("T1", "xoxb-1"))
+            two = cache_for(self.registry.client("T2", "xoxb-2"))
+        self.addCleanup(two.unlink)
+        self.assertIsInstance(one, SharedProfileCache)
+        self.assertEqual(os.path.basename(two.path), f"{name}-T2")
+        one.put("U1", {"display_name": "one"})
+        self.assertIsNone(two.get("U1"))
+
+        # Uninstalling deletes the workspace's segment
+        self.assertTrue(self.registry.forget("T1"))
+        self.assertFalse(os.path.exists(one.path))
+
+    @unittest.skipUnless(os.path.isdir("/dev/shm"), "needs /dev/shm")
+    def test_evicted_shared_profile_cache(self):
+        name = f"noping-test-{os.getpid()}"
+        registry = WorkspaceRegistry(ScheduledWebClient, maxsize=1)
+        with mock.patch.dict(os.environ,
+                {"NOPING_SHARED_PROFILE_CACHE": name}):
+            one = cache_for(registry.client("T1", "xoxb-1"))
+            # Opened once per process
+            self.assertIs(workspace_profile_cache("T1"), one)
+            two = cache_for(registry.client("T2", "xoxb-2"))
+            self.addCleanup(two.unlink)
+            # Evicting deletes the workspace's segment
+            self.assertFalse(os.path.exists(one.path))
+            self.assertTrue(os.path.exists(two.path))
+            again = cache_for(registry.client("T1", "xoxb-1"))
+            self.addCleanup(again.unlink)
+        self.assertIsNot(again, one)
+        self.assertTrue(os.path.exists(again.path))
+
+    def test_stats(self):
+        cache_for(self.registry.client("T1", "xoxb-1")).put("U1", {})
+        cache_for(self.registry.client("T2", "xoxb-2")).get("U1")
+        stats = self.registry.stats()
+        self.assertEqual(stats["workspaces"], 2)
+        self.assertEqual(stats["profiles"], 1)
+        self.assertEqual(stats["misses"], 1)
+        cache_stats = self.registry.profile_cache_stats()
+        self.assertEqual((cache_stats["size"], cache_stats["hits"],
+                          cache_stats["misses"]), (1, 0, 1))
+        self.assertEqual(cache_stats["hit_ratio"], 0.0)
+
+    def test_workspace_id(self):
+        self.assertEqual(workspace_id(FakeContext("T1", "E1")), "T1")
+        self.assertEqual(workspace_id(FakeContext(None, "E1")), "E1")
+
+
+class TestInstallationDir(unittest.TestCase):
+    def test_private_default(self):
+        home = tempfile.mkdtemp()
+        with mock.patch.dict(os.environ, {"XDG_DATA_HOME": home}):
+            os.environ.pop("NOPING_INSTALLATION_DIR", None)
+            path = workspaces._installation_dir()
+        self.assertEqual(path, os.path.join(home, "noping", "installations"))
+        self.assertEqual(stat.S_IMODE(os.stat(path).st_mode), 0o700)
+
+
+class TestCacheFor(unittest.TestCase):
+    def test_default(self):
+        from noping.profiles import default_profile_cache
+
+        client = ScheduledWebClient(token="xoxb-1")
+        self.assertIs(cache_for(client), default_profile_cache())
+        cache = ProfileCache()
+        self.assertIs(cache_for(ScheduledWebClient(token="xoxb-1",
+            profile_cache=cache)), cache)
+
+
+if __name__ == '__main__':
+    unittest.main()